@@ -0,0 +1,364 @@
+#! /usr/bin/env python
+# Benchmarks of the generators on synthetic data
+#
+#   bench.py [--sizes 100000,500000,2000000] [--cases LIST] [--output results.json] [--compare old.json]
+#
+# Every case runs in its own process (--run), with a temporary data directory
+# and config (OSINT_CONFIG, ~/.osint.json of the older scripts), so the peak
+# memory is measured per case and the real data are never touched. The
+# fixtures are generated once per (size, seed) and reused, run the same command
+# on two trees (--generator) and compare the results with --compare to see the
+# effect of a change.
+#
+# The scripts are called through small adapters, so the generators of the older
+# trees (without osintlib, the publish batches and the trends stores) are
+# measured as well.
+import os
+import sys
+import imp
+import json
+import time
+import shutil
+import inspect
+import logging
+import resource
+import tempfile
+import platform
+import subprocess
+from optparse import OptionParser
+
+path_benchdir = os.path.dirname(os.path.abspath(__file__))
+import fixtures
+
+# default fixtures cache
+path_fixtures = os.path.join(tempfile.gettempdir(),"osint-bench-fixtures")
+# default generator scripts (of this tree)
+path_generator = os.path.join(os.path.dirname(path_benchdir),"generator")
+# global config, read before ~/.osint.json by the scripts without OSINT_CONFIG
+config_global = "/usr/local/etc/osint/config.json"
+# scripts of the cases
+scripts = {'sknic':'update-sknic.py','resolved':'update-resolved.py','shodan':'update-shodan.py'}
+# raw massdns files of the rounds (same names in all the versions)
+filename_raw_massdns_round = "massdns-resolved-r%d.txt"
+# cases in the order of the daily update
+cases = ['sknic-actual','resolved-import','resolved-geoip','resolved-save','trends']
+# the trends case does not depend on the number of domains, it is run once
+cases_once = ['trends']
+
+
+# Setup of the temporary data directory and config of a case, the scripts are loaded after it
+def setup_case(workdir,geoip_file):
+    config = {
+        "keys":{"shodan":"benchmark"},
+        "path":{
+            "basedir":os.path.join(workdir,"data"),
+            "logdir":os.path.join(workdir,"log"),
+            "geoip":geoip_file,
+            "bindir":workdir,
+        },
+    }
+    for path in config["path"].values():
+        if path != geoip_file and not os.path.isdir(path):
+            os.makedirs(path)
+    config_file = os.path.join(workdir,"config.json")
+    with open(config_file,'w') as fp:
+        json.dump(config, fp)
+    os.environ["OSINT_CONFIG"] = config_file
+    # the older scripts read only ~/.osint.json
+    shutil.copy(config_file,os.path.join(workdir,".osint.json"))
+    os.environ["HOME"] = workdir
+    logging.basicConfig(filename=os.path.join(config["path"]["logdir"],"updates.log"),level=logging.INFO)
+
+def makedirs(path):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+# Link the massdns fixtures to the raw directory of update-resolved
+def link_massdns(resolved,files):
+    makedirs(resolved.path_raw)
+    os.symlink(files['hosts'],resolved.path_raw_domains)
+    for round_no, filename in enumerate(files['rounds']):
+        os.symlink(filename,os.path.join(resolved.path_raw,filename_raw_massdns_round % (round_no+1)))
+
+
+# Adapters to the API of the scripts
+
+# Load the generator script (named like osint.load_command does)
+def load_script(generator,name):
+    module = os.path.splitext(scripts[name])[0].replace('-','_')
+    if module not in sys.modules:
+        imp.load_source(module,os.path.join(generator,scripts[name]))
+    return sys.modules[module]
+
+# Publish batch of the script, None for the scripts which write the files directly
+def open_batch(script):
+    try:
+        from osintlib import publish
+    except ImportError:
+        return None
+    return publish.Batch(getattr(script,'file_publish_journal',None) or script.path_raw_publish_journal)
+
+def commit_batch(batch):
+    if batch is not None:
+        batch.commit()
+
+# Call the function of the script, the batch is passed to the versions which publish through it
+def call(function,batch,*args):
+    if batch is not None:
+        args += (batch,)
+    return function(*args)
+
+# Does the function take any arguments (the timed functions take *args)
+def takes_args(function):
+    spec = inspect.getargspec(function)
+    return bool(spec.args or spec.varargs)
+
+# Number of hosts in the imported results (HostMap, or dict address -> hosts of the older versions)
+def host_count(resolved_map):
+    if hasattr(resolved_map,'host_count'):
+        return resolved_map.host_count()
+    return sum(len(hosts) for hosts in resolved_map.values())
+
+# Store file of the trends, None for the versions without the stores
+def trends_store(trends_file):
+    try:
+        from osintlib import trends
+    except ImportError:
+        return None
+    if not hasattr(trends,'store_filename'):
+        return None
+    return trends.store_filename(trends_file)
+
+
+# Run one case in this process, returns (seconds, items)
+def run_case(case,size,options):
+    if case == 'sknic-actual':
+        files = fixtures.sknic_exports(options.fixtures,size,options.seed)
+        sknic = load_script(options.generator,'sknic')
+        sknic.create_dirs()
+        makedirs(sknic.path_actual)
+        shutil.copy(files['previous'],sknic.file_actual_stats_sk_domains)
+        time_start = time.time()
+        batch = open_batch(sknic)
+        call(sknic.parse_domains_file,batch,files['domains'],files['registrars'])
+        commit_batch(batch)
+        return (time.time() - time_start, size)
+
+    if case.startswith('resolved-'):
+        resolved = load_script(options.generator,'resolved')
+        link_massdns(resolved,fixtures.massdns_results(options.fixtures,size,options.cname_ratio,options.seed))
+        if not takes_args(resolved.generate_actual):
+            # the older versions import the results in generate_actual, the import is measured in resolved-geoip
+            if case == 'resolved-import':
+                time_start = time.time()
+                resolved.import_results_file()
+                return (time.time() - time_start, size)
+            hosts = host_count(resolved.import_results_file())
+            time_start = time.time()
+            actual = resolved.generate_actual()
+        else:
+            time_start = time.time()
+            resolved_map = resolved.import_results_file()
+            if case == 'resolved-import':
+                return (time.time() - time_start, size)
+            hosts = host_count(resolved_map)
+            time_start = time.time()
+            actual = resolved.generate_actual(resolved_map)
+        if case == 'resolved-geoip':
+            return (time.time() - time_start, hosts)
+        time_start = time.time()
+        batch = open_batch(resolved)
+        makedirs(resolved.path_actual)
+        call(resolved.save_actual,batch,resolved.file_actual_resolved,actual)
+        commit_batch(batch)
+        return (time.time() - time_start, hosts)
+
+    if case == 'trends':
+        files = fixtures.trends_files(options.fixtures,size,options.seed)
+        sknic = load_script(options.generator,'sknic')
+        resolved = load_script(options.generator,'resolved')
+        shodan = load_script(options.generator,'shodan')
+        sknic.create_dirs()
+        makedirs(sknic.path_actual)
+        targets = {
+            'sknic-registrar':sknic.file_actual_trends_count_by_registrar,
+            'sknic-holder':sknic.file_actual_trends_count_by_holder,
+            'sknic-changes':sknic.file_actual_trends_domain_changes,
+            'resolved-country':resolved.file_trends_resolved_country,
+            'resolved-ip':resolved.file_trends_resolved_ip,
+            'shodan-db':shodan.file_trends_stats_db,
+        }
+        for name, (filename,_) in files.items():
+            makedirs(os.path.dirname(targets[name]))
+            shutil.copy(filename,targets[name])
+            store_file = trends_store(targets[name])
+            if store_file is not None:
+                makedirs(os.path.dirname(store_file))
+                shutil.copy(os.path.splitext(filename)[0] + '.jsonl',store_file)
+        # the stats of the day read by the sknic trends
+        counts = dict(('item-%d' % i,i) for i in range(1000))
+        for filename, data in ((sknic.file_actual_stats_count_by_registrar,counts),(sknic.file_actual_stats_count_by_holder,counts),
+                               (sknic.file_actual_stats_domain_changes,{'added':['a.sk'],'deleted':[]})):
+            with open(filename,'w') as fp:
+                json.dump(data, fp)
+        time_start = time.time()
+        batch = open_batch(sknic)
+        call(sknic.update_trends_from_actual,batch)
+        call(resolved.save_trends,batch,resolved.file_trends_resolved_country,dict(counts),'resolved_by_country')
+        call(resolved.save_trends,batch,resolved.file_trends_resolved_ip,dict(counts),'resolved_by_ip')
+        call(shodan.update_trends,batch,shodan.file_trends_stats_db,dict(counts))
+        commit_batch(batch)
+        return (time.time() - time_start, len(files) * size)
+
+    raise ValueError("Unknown case %s" % case)
+
+# Peak RSS of this process (kB)
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+# Child process: run the case and print the result as JSON
+def child(options):
+    options.generator = os.path.abspath(options.generator)
+    sys.path.insert(0, options.generator)
+    if not os.path.isfile(os.path.join(options.generator,"osintlib","common.py")) and os.path.exists(config_global):
+        # the older scripts prefer the global config to ~/.osint.json
+        print("[!] The scripts in %s would use the config %s (real data)" % (options.generator,config_global))
+        exit(2)
+    workdir = tempfile.mkdtemp(prefix="osint-bench-")
+    try:
+        setup_case(workdir,fixtures.geoip_database(options.fixtures,seed=options.seed))
+        rss_before = peak_rss()
+        seconds, items = run_case(options.run,options.size,options)
+        try:
+            from osintlib import metrics
+            spans = metrics.summary(options.run)['spans']
+        except ImportError:
+            # no metrics in the older versions
+            spans = {}
+        print(json.dumps({
+            'seconds':seconds,
+            'items':items,
+            'peak_rss_kb':peak_rss(),
+            'rss_before_kb':rss_before,
+            'spans':spans,
+        }))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# Run the case in a child process, returns the parsed result
+def run_child(case,size,options):
+    command = [sys.executable,os.path.abspath(__file__),'--run',case,'--size',str(size),'--fixtures',options.fixtures,
+               '--seed',str(options.seed),'--cname-ratio',str(options.cname_ratio),'--generator',options.generator]
+    output = subprocess.check_output(command)
+    return json.loads(output.strip().splitlines()[-1])
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle-1] + values[middle]) / 2.0
+
+# Generate the fixtures before the measurements (not measured)
+def prepare_fixtures(selected,sizes,options):
+    print("[ ] Fixtures in %s" % options.fixtures)
+    fixtures.geoip_database(options.fixtures,seed=options.seed)
+    for size in sizes:
+        if 'sknic-actual' in selected:
+            fixtures.sknic_exports(options.fixtures,size,options.seed)
+        if [case for case in selected if case.startswith('resolved-')]:
+            fixtures.massdns_results(options.fixtures,size,options.cname_ratio,options.seed)
+    if 'trends' in selected:
+        fixtures.trends_files(options.fixtures,options.trends_days,options.seed)
+
+# Current commit of the measured tree, to tell the result files apart
+def git_revision(generator):
+    try:
+        return subprocess.check_output(['git','rev-parse','--short','HEAD'], cwd=generator, stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def result_key(result):
+    return "%s/%s" % (result['case'],result['size'])
+
+def print_results(results,compare=None):
+    previous = {}
+    if compare:
+        previous = dict((result_key(result),result) for result in compare['results'])
+        print("[ ] Compared with %s (%s)" % (compare.get('commit'),compare.get('date')))
+    print("%-16s %9s %10s %12s %12s %8s" % ('case','size','seconds','items/s','peak MB','change'))
+    for result in results:
+        change = ''
+        old = previous.get(result_key(result))
+        if old and old['seconds'] > 0:
+            change = "%+.0f%%" % ((result['seconds'] / old['seconds'] - 1) * 100)
+        print("%-16s %9s %10.3f %12.0f %12.1f %8s" % (result['case'],result['size'],result['seconds'],result['throughput'],result['peak_rss_kb'] / 1024.0,change))
+
+
+def main():
+    usage = "usage: %prog [options]"
+    parser = OptionParser(usage)
+    parser.add_option("-s", "--sizes", dest="sizes", default="100000,500000,2000000", help="Numbers of domains (default: %default)", metavar="LIST")
+    parser.add_option("-c", "--cases", dest="cases", default=",".join(cases), help="Cases to run (default: %default)", metavar="LIST")
+    parser.add_option("-n", "--repeat", type="int", dest="repeat", default=3, help="Runs of every case, the median is reported (default: %default)")
+    parser.add_option("--cname-ratio", type="float", dest="cname_ratio", default=0.3, help="Share of the hosts resolved to a CNAME (default: %default)")
+    parser.add_option("--trends-days", type="int", dest="trends_days", default=fixtures.trends_days, help="Days of history in the trends files (default: %default)")
+    parser.add_option("--seed", type="int", dest="seed", default=1, help="Seed of the fixtures (default: %default)")
+    parser.add_option("--fixtures", dest="fixtures", default=path_fixtures, help="Directory of the generated fixtures (default: %default)", metavar="DIR")
+    parser.add_option("-g", "--generator", dest="generator", default=path_generator, help="Directory of the generator scripts to measure (default: %default)", metavar="DIR")
+    parser.add_option("-o", "--output", dest="output", help="Write the results as JSON", metavar="FILE")
+    parser.add_option("--compare", dest="compare", help="Compare with the results of a previous run", metavar="FILE")
+    # internal, one case in a child process
+    parser.add_option("--run", dest="run", help="(internal) run the CASE in this process", metavar="CASE")
+    parser.add_option("--size", type="int", dest="size", help="(internal) size of the case")
+    (options, _) = parser.parse_args()
+
+    if options.run:
+        child(options)
+        return
+
+    selected = [case.strip() for case in options.cases.split(',') if case.strip()]
+    unknown = [case for case in selected if case not in cases]
+    if unknown:
+        print("[!] Unknown cases: %s" % ", ".join(unknown))
+        exit(2)
+    sizes = [int(size) for size in options.sizes.split(',')]
+    compare = None
+    if options.compare:
+        with open(options.compare) as fp:
+            compare = json.load(fp)
+
+    prepare_fixtures(selected,sizes,options)
+    results = []
+    for case in selected:
+        for size in ([options.trends_days] if case in cases_once else sizes):
+            runs = [run_child(case,size,options) for _ in range(options.repeat)]
+            seconds = median([run['seconds'] for run in runs])
+            results.append({
+                'case':case,
+                'size':size,
+                'items':runs[0]['items'],
+                'seconds':round(seconds,3),
+                'runs':[round(run['seconds'],3) for run in runs],
+                'throughput':round(runs[0]['items'] / seconds, 1) if seconds > 0 else 0,
+                'peak_rss_kb':max(run['peak_rss_kb'] for run in runs),
+                'rss_before_kb':min(run['rss_before_kb'] for run in runs),
+                'spans':runs[len(runs) // 2]['spans'],
+            })
+            print("[+] %s %d: %.3f s" % (case,size,seconds))
+
+    print_results(results,compare)
+    if options.output:
+        with open(options.output,'w') as fp:
+            json.dump({
+                'commit':git_revision(options.generator),
+                'date':time.strftime("%Y-%m-%d %H:%M:%S"),
+                'python':platform.python_version(),
+                'seed':options.seed,
+                'cname_ratio':options.cname_ratio,
+                'repeat':options.repeat,
+                'results':results,
+            }, fp, indent=4, sort_keys=True)
+        print("[+] Results written to %s" % options.output)
+
+if __name__ == '__main__':
+    main()
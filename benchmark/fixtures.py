@@ -0,0 +1,216 @@
+# Synthetic input data for the benchmarks
+#
+# All the fixtures are generated from a seeded random generator, the same
+# (kind, size, seed) always gives the same files, so the results of two
+# commits are measured on the same data. The generated files are kept in the
+# fixtures directory and reused by the next runs.
+import os
+import json
+import random
+import struct
+import socket
+
+# countries of the fake GeoIP database
+countries = ['SK','CZ','DE','US','NL','FR','AT','HU','PL','GB']
+# number of registrars and share of holders (holders = domains / holders_ratio)
+registrars_count = 120
+holders_ratio = 3
+# days of history in the trends files
+trends_days = 3650
+# date of the synthetic exports
+export_date = '2020-01-02'
+
+
+# Deterministic domain name of the index
+def domain_name(rnd):
+    length = rnd.randint(3,14)
+    return ''.join(rnd.choice('abcdefghijklmnopqrstuvwxyz0123456789') for _ in range(length)) + '.sk'
+
+# Directory of the fixture, created on the first use
+def fixture_dir(path,kind,size,seed,*params):
+    name = '-'.join([kind,str(size),str(seed)] + [str(param) for param in params])
+    directory = os.path.join(path,name)
+    return directory, os.path.isfile(os.path.join(directory,'.done'))
+
+def mark_done(directory):
+    open(os.path.join(directory,'.done'),'w').close()
+
+
+# SK-NIC exports: domains_<date>.txt (size lines), registrars_<date>.txt and the previous sk-domains.txt
+def sknic_exports(path,size,seed=1):
+    directory, done = fixture_dir(path,'sknic',size,seed)
+    files = {
+        'domains':os.path.join(directory,'domains_%s.txt' % export_date),
+        'registrars':os.path.join(directory,'registrars_%s.txt' % export_date),
+        'previous':os.path.join(directory,'sk-domains.txt'),
+    }
+    if done:
+        return files
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    rnd = random.Random(seed)
+    with open(files['registrars'],'w') as fp:
+        fp.write('--\n-- SK-NIC\n-- registrars\n--\n--\n-- id;name\n')
+        for i in range(registrars_count):
+            fp.write('REG-%d;Registrar %d s.r.o.\n' % (i,i))
+    domains = sorted(set(domain_name(rnd) for _ in range(size)))
+    while len(domains) < size:
+        domains = sorted(set(domains + [domain_name(rnd) for _ in range(size - len(domains))]))
+    holders = max(1,size // holders_ratio)
+    with open(files['domains'],'w') as fp:
+        fp.write('--\n-- SK-NIC\n-- domains\n--\n--\n-- domena;ID reg;ID drzitela;stav\n')
+        for domain in domains:
+            # a few big registrars and holders, a long tail of small ones
+            registrar = min(registrars_count-1,int(rnd.paretovariate(1.2))-1)
+            holder = min(holders-1,int(rnd.paretovariate(0.8))-1) if rnd.random() < 0.3 else rnd.randrange(holders)
+            fp.write('%s;REG-%d;H-%d;DOM_OK;\n' % (domain,registrar,holder))
+    # the previous day: 0.1% deleted since then, 0.1% not registered yet
+    with open(files['previous'],'w') as fp:
+        previous = [domain for domain in domains if rnd.random() >= 0.001]
+        previous += [domain_name(rnd) for _ in range(size // 1000)]
+        fp.write('\n'.join(sorted(set(previous))))
+    mark_done(directory)
+    return files
+
+
+# IP address in one of the networks of the fake GeoIP database (index of a /16 block)
+def random_ip(rnd,blocks):
+    block = rnd.randrange(blocks)
+    return '%d.%d.%d.%d' % (11 + block // 256, block % 256, rnd.randrange(256), rnd.randrange(1,255))
+
+# massdns -o S outputs of the resolution of size hosts, cname_ratio of them are CNAMEs (to a shared pool of targets)
+def massdns_results(path,size,cname_ratio=0.3,seed=1,blocks=512):
+    directory, done = fixture_dir(path,'massdns',size,seed,cname_ratio)
+    files = {
+        'hosts':os.path.join(directory,'domains-to-resolve.txt'),
+        'rounds':[os.path.join(directory,'massdns-resolved-r1.txt'),os.path.join(directory,'massdns-resolved-r2.txt')],
+    }
+    if done:
+        return files
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    rnd = random.Random(seed)
+    # shared hosting, many hosts on one address
+    addresses = [random_ip(rnd,blocks) for _ in range(max(1,size // 20))]
+    targets = ['cdn%d.example.net' % i for i in range(max(1,int(size * cname_ratio) // 10))]
+    # the hosts are resolved in the order of the sorted domains list
+    hosts = sorted(set('www.' + domain_name(rnd) for _ in range(size)))
+    with open(files['hosts'],'w') as fp_hosts, open(files['rounds'][0],'w') as fp_r1:
+        for host in hosts:
+            fp_hosts.write(host + '\n')
+            if rnd.random() < cname_ratio:
+                fp_r1.write('%s. CNAME %s.\n' % (host,rnd.choice(targets)))
+            elif rnd.random() < 0.95:
+                for _ in range(1 if rnd.random() < 0.9 else 2):
+                    fp_r1.write('%s. A %s\n' % (host,rnd.choice(addresses)))
+    with open(files['rounds'][1],'w') as fp_r2:
+        for target in targets:
+            fp_r2.write('%s. A %s\n' % (target,random_ip(rnd,blocks)))
+    mark_done(directory)
+    return files
+
+
+# Encoding of the MaxMind DB data section
+def mmdb_control(data_type,size):
+    extended = data_type > 7
+    first = (0 if extended else data_type) << 5
+    if size < 29:
+        control, extra = chr(first | size), ''
+    elif size < 285:
+        control, extra = chr(first | 29), chr(size - 29)
+    else:
+        control, extra = chr(first | 30), struct.pack('>H', size - 285)
+    return control + (chr(data_type - 7) if extended else '') + extra
+
+def mmdb_encode(value):
+    if isinstance(value, dict):
+        return mmdb_control(7,len(value)) + ''.join(mmdb_encode(k) + mmdb_encode(v) for k, v in sorted(value.items()))
+    if isinstance(value, unicode):
+        value = value.encode('utf8')
+    if isinstance(value, str):
+        return mmdb_control(2,len(value)) + value
+    if isinstance(value, list):
+        return mmdb_control(11,len(value)) + ''.join(mmdb_encode(v) for v in value)
+    packed = struct.pack('>Q', value).lstrip('\x00')
+    return mmdb_control(9 if value >= 2**32 else 6,len(packed)) + packed
+
+# Fake GeoLite2-Country database (IPv4 only), every /16 of the benchmark address space gets a country
+def geoip_database(path,blocks=512,seed=1):
+    directory, done = fixture_dir(path,'geoip',blocks,seed)
+    filename = os.path.join(directory,'GeoLite2-Country.mmdb')
+    if done:
+        return filename
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    rnd = random.Random(seed)
+    networks = []
+    for block in range(blocks):
+        network = '%d.%d.0.0/16' % (11 + block // 256, block % 256)
+        networks.append((network,{'country':{'iso_code':rnd.choice(countries)}}))
+    # binary search tree, one leaf per network
+    nodes = [[None,None]]
+    data = ''
+    for network, record in networks:
+        address, prefix = network.split('/')
+        prefix = int(prefix)
+        address = struct.unpack('!I', socket.inet_aton(address))[0]
+        offset = len(data)
+        data += mmdb_encode(record)
+        node = 0
+        for i in range(prefix):
+            bit = (address >> (31 - i)) & 1
+            if i == prefix - 1:
+                nodes[node][bit] = ('data',offset)
+            else:
+                if nodes[node][bit] is None:
+                    nodes.append([None,None])
+                    nodes[node][bit] = ('node',len(nodes) - 1)
+                node = nodes[node][bit][1]
+    count = len(nodes)
+    def pointer(item):
+        if item is None:
+            return count
+        if item[0] == 'node':
+            return item[1]
+        return count + 16 + item[1]
+    tree = ''.join(struct.pack('>I', pointer(left))[1:] + struct.pack('>I', pointer(right))[1:] for left, right in nodes)
+    metadata = {'node_count':count,'record_size':24,'ip_version':4,'database_type':'GeoLite2-Country',
+                'languages':['en'],'binary_format_major_version':2,'binary_format_minor_version':0,
+                'build_epoch':1577836800,'description':{'en':'osint-sk benchmark'}}
+    with open(filename,'wb') as fp:
+        fp.write(tree + '\x00' * 16 + data + '\xab\xcd\xefMaxMind.com' + mmdb_encode(metadata))
+    mark_done(directory)
+    return filename
+
+
+# Trends files with days of history and their stores: {name: (path, key)}
+def trends_files(path,days=trends_days,seed=1):
+    directory, done = fixture_dir(path,'trends',days,seed)
+    files = {
+        'sknic-registrar':('trends-count-by-registrar.json','domains-count-by-registrar'),
+        'sknic-holder':('trends-count-by-holder.json','domains-count-by-holder'),
+        'sknic-changes':('trends-domain-changes.json','domain-changes'),
+        'resolved-country':('sk-resolved-country.json','resolved_by_country'),
+        'resolved-ip':('sk-resolved-ip.json','resolved_by_ip'),
+        'shodan-db':('trends-db.json','stats-db'),
+    }
+    files = dict((name,(os.path.join(directory,filename),key)) for name, (filename,key) in files.items())
+    if done:
+        return files
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    rnd = random.Random(seed)
+    for name, (filename,key) in sorted(files.items()):
+        entries = []
+        for day in range(days):
+            entry = dict(('item-%d' % i,rnd.randrange(100000)) for i in range(10))
+            entry['date'] = 'day-%05d' % day
+            entries.append(entry)
+        with open(filename,'w') as fp:
+            json.dump({key:entries}, fp, indent=4)
+        # the store (one entry per line) next to the published file, as left by the previous runs
+        with open(os.path.splitext(filename)[0] + '.jsonl','w') as fp:
+            for entry in entries:
+                fp.write(json.dumps(entry) + '\n')
+    mark_done(directory)
+    return files
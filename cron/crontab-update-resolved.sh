@@ -47,6 +47,10 @@ echo "$(date '+%Y-%m-%d %H:%M:%S,000') - crontab-update-resolved - INFO - Settin
 # git commit the changes
 cd ${GITDIR}
 echo "$(date '+%Y-%m-%d %H:%M:%S,000') - crontab-update-resolved - INFO - Executing git coommit + push." >> ${LOGDIR}/crontab.log
+# the delta is a new file, git commit -a does not add it
+if [ -f actual/resolve/sk-www-domains-resolved-delta.json ]; then
+  /usr/bin/git add actual/resolve/sk-www-domains-resolved-delta.json
+fi
 if OUTPUT=$(/usr/bin/git commit -a -m "factory-worker: auto-commit ${DATE}" && /usr/bin/git push 2>&1); then
   RESULT_GIT="OK"
 else 
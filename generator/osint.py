@@ -0,0 +1,50 @@
+#! /usr/bin/env python
+# Single entry point of the generator scripts: osint.py COMMAND [options]
+#  only the script of the command is loaded, so the light commands do not pay for the imports of the others
+import os
+import sys
+import imp
+
+# command -> script
+commands = {
+    'sknic' : 'update-sknic.py',
+    'resolved' : 'update-resolved.py',
+    'shodan' : 'update-shodan.py',
+    'query-sknic' : 'query-sknic.py',
+    'all' : 'update-all.py',
+}
+path_bindir = os.path.dirname(os.path.abspath(__file__))
+
+
+# Load the script of the command as a module (the scripts have dashes in the names), once per interpreter
+def load_command(command):
+    filename = os.path.join(path_bindir,commands[command])
+    # named after the script, the command names would shadow real modules (shodan)
+    name = os.path.splitext(commands[command])[0].replace('-','_')
+    if name not in sys.modules:
+        imp.load_source(name,filename)
+    return sys.modules[name]
+
+def usage():
+    print("usage: %s COMMAND [options]" % os.path.basename(sys.argv[0]))
+    print("commands: %s" % ", ".join(sorted(commands)))
+    print("use %s COMMAND --help for the options of the command" % os.path.basename(sys.argv[0]))
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        usage()
+        exit(2)
+    command = sys.argv[1]
+    # the command sees its own arguments, as if the script was run directly
+    sys.argv = [commands[command]] + sys.argv[2:]
+    script = load_command(command)
+    if hasattr(script,'run_name'):
+        # the generators record the metrics of the run, like when the script is run directly
+        from osintlib import metrics
+        metrics.run(script.main,script.path_metrics,script.run_name)
+    else:
+        script.main()
+
+if __name__ == '__main__':
+    main()
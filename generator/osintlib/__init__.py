@@ -0,0 +1 @@
+# Shared code of the osint-sk generator scripts
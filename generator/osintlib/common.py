@@ -0,0 +1,56 @@
+# Bootstrap shared by the generator scripts (config, logging, dates, lazy imports)
+import os
+import json
+import logging
+import datetime
+import importlib
+
+# Path to the config file given in the environment (used by the benchmarks), global or local config file
+config_env = "OSINT_CONFIG"
+config_global = "/usr/local/etc/osint/config.json"
+config_local = os.path.expanduser("~/.osint.json")
+# loaded once per interpreter
+_config = None
+
+
+# Load the config from $OSINT_CONFIG, the global config, or the local one if there is no global config
+def load_config():
+    global _config
+    if _config is None:
+        for filename in filter(None,(os.environ.get(config_env),config_global,config_local)):
+            if os.path.exists(filename) and os.path.getsize(filename) > 0:
+                with open(filename) as json_file:
+                    _config = json.load(json_file)
+                break
+        else:
+            print("No configuration file found in %s or %s" % (config_global,config_local))
+            exit(1)
+    return _config
+
+# Log to the file, the name identifies the script in the shared log
+def setup_logging(file_log,name,debug=False):
+    level = logging.DEBUG if debug else logging.INFO
+    logging.basicConfig(filename=file_log,level=level,format='%(asctime)s - ' + name + ' - %(levelname)s - %(message)s')
+
+# Today's date in YMD format
+def date_today():
+    return datetime.datetime.now().strftime("%Y-%m-%d")
+
+
+# Module imported on the first attribute access, keeps the heavy imports (dns, geoip, shodan)
+# out of the startup of the commands which do not need them
+class LazyModule(object):
+
+    def __init__(self,name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __getattr__(self,attr):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        return getattr(module, attr)
+
+def lazy_import(name):
+    return LazyModule(name)
@@ -0,0 +1,123 @@
+# Persistent cache of the resolved hosts (sqlite)
+#
+# The cache keeps the final answer for every host (addresses at the end of the
+# CNAME chain and the chain itself) together with the TTL used for the
+# revalidation and the time of the last resolution. Only the hosts which are not
+# cached or whose entry expired are resolved again.
+#
+# The TTL of a host is the lowest TTL of the records of its chain, limited to
+# [min_ttl, max_ttl]. The answers without the TTLs (raw files in the massdns
+# simple format) get a short default TTL, spread per host (up to 1.5x).
+#
+# The engines do not tell a NXDOMAIN from a lost query, so a host without any
+# answer is never cached: it is resolved again by the next run. A cached answer
+# of such a host is kept (and served) for a while, so a single timeout does not
+# remove the host from the results.
+import time
+import zlib
+import sqlite3
+import logging
+from osintlib import dnschain
+
+# default TTL of a resolved host when the records have no TTL (seconds)
+default_ttl = 6 * 3600
+# limits of the TTL of the records (seconds)
+default_min_ttl = 3600
+default_max_ttl = 2 * 86400
+# how long the answer is kept for a host which is no longer answered (seconds since it was resolved)
+default_stale = 14 * 86400
+
+schema = """
+CREATE TABLE IF NOT EXISTS hosts (
+    host TEXT PRIMARY KEY,
+    addresses TEXT NOT NULL,
+    chain TEXT NOT NULL,
+    ttl INTEGER NOT NULL,
+    resolved INTEGER NOT NULL,
+    expires INTEGER NOT NULL
+)
+"""
+
+
+# The host specific TTL (the base TTL spread by up to 50%)
+def host_ttl(host,ttl):
+    return int(ttl * (1 + (zlib.crc32(host) & 0xffff) % 100 / 200.0))
+
+
+class Cache(object):
+
+    def __init__(self,path,ttl=default_ttl,stale=default_stale,min_ttl=default_min_ttl,max_ttl=default_max_ttl):
+        self.path = path
+        self.ttl = ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.stale = stale
+        self.db = sqlite3.connect(path)
+        self.db.text_factory = str
+        self.db.execute(schema)
+        self.db.execute("CREATE INDEX IF NOT EXISTS hosts_expires ON hosts (expires)")
+
+    def close(self):
+        self.db.close()
+
+    # Hosts which need to be resolved (not cached, expired or in the list of hosts to refresh)
+    def select(self,hostnames,refresh=(),now=None):
+        if now is None:
+            now = int(time.time())
+        refresh = set(dnschain.normalize(host) for host in refresh)
+        fresh = set(row[0] for row in self.db.execute("SELECT host FROM hosts WHERE expires > ?", (now,)))
+        selected = [host for host in hostnames if dnschain.normalize(host) not in fresh or dnschain.normalize(host) in refresh]
+        logging.info("DNS cache: %d hosts, %d fresh, %d to resolve" % (len(hostnames),len(fresh),len(selected)))
+        return selected
+
+    # Store the answers for the resolved hosts, the hosts without an answer are not cached
+    #  (their previous answer is dropped once it is older than the stale limit)
+    def update(self,records,hostnames,depth=dnschain.default_depth,now=None):
+        if now is None:
+            now = int(time.time())
+        rows = []
+        unanswered = []
+        for host in hostnames:
+            host = dnschain.normalize(host)
+            if records.known(host):
+                chain, addresses, _ = records.follow(host,depth)
+                if not addresses:
+                    addresses = ['NX']
+                ttl = records.min_ttl([host] + chain)
+                if ttl is None:
+                    ttl = host_ttl(host,self.ttl)
+                else:
+                    ttl = max(self.min_ttl,min(self.max_ttl,ttl))
+                rows.append((host,' '.join(addresses),' '.join(chain),ttl,now,now+ttl))
+            else:
+                unanswered.append((host,now-self.stale))
+        self.db.executemany("INSERT OR REPLACE INTO hosts VALUES (?,?,?,?,?,?)", rows)
+        self.db.executemany("DELETE FROM hosts WHERE host = ? AND resolved < ?", unanswered)
+        self.db.commit()
+        logging.debug("DNS cache: stored %d hosts, %d without an answer" % (len(rows),len(unanswered)))
+
+    # Drop the hosts which are no longer in the list
+    def purge(self,hostnames):
+        hostnames = set(dnschain.normalize(host) for host in hostnames)
+        deleted = [(row[0],) for row in self.db.execute("SELECT host FROM hosts") if row[0] not in hostnames]
+        self.db.executemany("DELETE FROM hosts WHERE host = ?", deleted)
+        self.db.commit()
+        logging.debug("DNS cache: purged %d hosts" % len(deleted))
+
+    # Cached answers for the hosts (address, host, chain), same as dnschain.resolved_hosts
+    def resolved_hosts(self,hostnames):
+        hostnames = set(dnschain.normalize(host) for host in hostnames)
+        for host, addresses, chain in self.db.execute("SELECT host, addresses, chain FROM hosts ORDER BY host"):
+            if host not in hostnames or len(addresses) == 0:
+                continue
+            chain = chain.split()
+            for address in addresses.split():
+                yield (address,host,chain)
+
+    # Rebuild the entries of the hosts from the raw massdns files, the other hosts are kept
+    #  (the raw files of a cached run hold only the hosts which were resolved)
+    def rebuild(self,filenames,hostnames,depth=dnschain.default_depth,now=None):
+        records = dnschain.Records()
+        for filename in filenames:
+            dnschain.read_records(filename,records)
+        self.update(records,hostnames,depth,now)
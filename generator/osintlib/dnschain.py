@@ -0,0 +1,146 @@
+# CNAME chain resolution on top of a resolution engine
+#
+# The hostnames are resolved in rounds. After every round the CNAME chains are
+# followed through the answers collected so far. The names at the end of the
+# chains which are still unknown are queried in the next round, each one only
+# once no matter how many hosts point to it.
+import logging
+from collections import defaultdict
+
+# default number of CNAME hops to follow
+default_depth = 5
+
+
+# Normalized name used as the key (lowercase, no trailing dot), a name already normalized is not copied
+def normalize(name):
+    if name[-1:] == '.' or not name.islower():
+        return name.lower().rstrip('.')
+    return name
+
+# Answers collected from the massdns output (simple -o S or full -o F), can be used as the output file of the engine
+#  the full output has the TTLs, only its answer sections are read
+class Records(object):
+
+    def __init__(self,raw=None,on_address=None):
+        self.a = defaultdict(list)
+        self.cname = {}
+        # lowest TTL of the records of the name (only the full output has them)
+        self.ttls = {}
+        # section of the full output, the simple output has only the answers
+        self.section = 'ANSWER'
+        # optional file to keep a copy of the raw answers
+        self.raw = raw
+        # optional callback for every new address, while the answers are still arriving
+        self.on_address = on_address
+        self.cnt = 0
+
+    def add(self,name,rdtype,value,ttl=None):
+        name = normalize(name)
+        if ttl is not None and rdtype in ('A','CNAME'):
+            self.ttls[name] = min(self.ttls.get(name,ttl),ttl)
+        if rdtype == 'A':
+            # one string per address, shared by all the hosts on it
+            value = intern(value)
+            if value not in self.a[name]:
+                self.a[name].append(value)
+                if self.on_address is not None:
+                    self.on_address(value)
+        elif rdtype == 'CNAME':
+            self.cname[name] = normalize(value)
+
+    def add_line(self,line):
+        if line.startswith(';'):
+            if line.startswith(';; ') and line.rstrip().endswith(' SECTION:'):
+                self.section = line[3:].split()[0]
+            return
+        if self.section != 'ANSWER':
+            return
+        fields = line.split()
+        if len(fields) >= 5 and fields[2] == 'IN' and fields[1].isdigit():
+            # full output: name TTL IN type value
+            self.cnt += 1
+            self.add(fields[0],fields[3],fields[4],int(fields[1]))
+        elif len(fields) >= 3:
+            self.cnt += 1
+            self.add(fields[0],fields[1],fields[2])
+
+    def write(self,data):
+        if self.raw is not None:
+            self.raw.write(data)
+        for line in data.splitlines():
+            self.add_line(line)
+
+    def writelines(self,lines):
+        for line in lines:
+            self.write(line)
+
+    # Any answer for the name?
+    def known(self,name):
+        return name in self.a or name in self.cname
+
+    # Lowest TTL of the records of the names (host and its chain), None if no TTL is known
+    def min_ttl(self,names):
+        ttls = [self.ttls[name] for name in names if name in self.ttls]
+        return min(ttls) if ttls else None
+
+    # Follow the CNAMEs from the host, returns (chain, addresses, name at the end of the chain)
+    def follow(self,host,max_depth=default_depth):
+        name = normalize(host)
+        chain = []
+        while name in self.cname and name not in self.a and len(chain) < max_depth:
+            name = self.cname[name]
+            # loop
+            if name in chain:
+                break
+            chain.append(name)
+        return (chain,self.a.get(name,[]),name)
+
+
+# Load the records from a massdns output file
+def read_records(filename,records=None):
+    if records is None:
+        records = Records()
+    records.section = 'ANSWER'
+    with open(filename) as fp:
+        for line in fp:
+            records.add_line(line)
+    return records
+
+# Resolve the hostnames and follow the CNAME chains
+#  resolve_round(round, names, records) resolves the names and writes the answers to records
+def resolve_chains(resolve_round,hostnames,max_depth=default_depth,records=None):
+    if records is None:
+        records = Records()
+    resolve_round(1,hostnames,records)
+    queried = set()
+    # hosts whose chain does not end with an address yet
+    pending = [host for host in hostnames if normalize(host) in records.cname]
+    for depth in range(1,max_depth+1):
+        targets = set()
+        still_pending = []
+        for host in pending:
+            chain, addresses, name = records.follow(host,max_depth)
+            if addresses or len(chain) >= max_depth or records.known(name) or name in queried:
+                continue
+            targets.add(name)
+            still_pending.append(host)
+        logging.debug("CNAME depth %d: %d hosts pending, %d unique targets" % (depth,len(still_pending),len(targets)))
+        if not targets:
+            break
+        queried.update(targets)
+        resolve_round(depth+1,sorted(targets),records)
+        pending = still_pending
+    return records
+
+# Final addresses of the hosts, 'NX' for an alias which does not end with an address
+def resolved_hosts(records,hostnames,max_depth=default_depth):
+    for host in hostnames:
+        name = normalize(host)
+        if not records.known(name):
+            continue
+        chain, addresses, _ = records.follow(name,max_depth)
+        if addresses:
+            for address in addresses:
+                yield (address,name,chain)
+        else:
+            yield ('NX',name,chain)
@@ -0,0 +1,221 @@
+# Native DNS resolution engine (alternative to the dockerized massdns)
+#
+# The queries are spread round-robin over the list of resolvers using a single
+# non-blocking UDP socket, with a bounded number of queries in flight. Queries
+# which time out or get SERVFAIL/REFUSED are retried on another resolver. The
+# answers are written like the answer section of the massdns full output (-o F),
+# with the TTLs:
+#
+#   www.example.sk. 3600 IN A 192.0.2.1
+#   www.example.sk. 300 IN CNAME example.cdn.net.
+import time
+import errno
+import socket
+import select
+import logging
+import collections
+import dns.flags
+import dns.rcode
+import dns.message
+import dns.rdatatype
+import dns.exception
+
+# default number of queries in flight
+default_window = 1000
+# default time to wait for an answer (seconds)
+default_timeout = 1.0
+# default number of attempts for a single name
+default_attempts = 10
+
+# answers which mean the resolver could not answer, try another one
+rcodes_retry = (dns.rcode.SERVFAIL, dns.rcode.REFUSED)
+
+
+# A query waiting for the answer
+PendingQuery = collections.namedtuple('PendingQuery', ['hostname', 'resolver', 'attempt', 'deadline'])
+
+
+# Parse "ip" or "ip:port" from the resolvers list
+def parse_resolver(resolver,port=53):
+    if ':' in resolver:
+        address, port = resolver.rsplit(':',1)
+        return (address,int(port))
+    return (resolver,port)
+
+# Load the resolvers list file
+def read_resolvers(filename,port=53):
+    resolvers = []
+    with open(filename) as fp:
+        for line in fp:
+            line = line.strip()
+            if len(line) != 0 and not line.startswith('#'):
+                resolvers.append(parse_resolver(line,port))
+    return resolvers
+
+# Format the answer records like the answer section of the massdns full format
+def format_answer(response):
+    lines = []
+    for rrset in response.answer:
+        for rdata in rrset:
+            if rrset.rdtype == dns.rdatatype.A:
+                value = rdata.address
+            elif rrset.rdtype == dns.rdatatype.CNAME:
+                value = rdata.target.to_text()
+            else:
+                continue
+            lines.append("%s %d IN %s %s\n" % (rrset.name.to_text(),rrset.ttl,dns.rdatatype.to_text(rrset.rdtype),value))
+    return lines
+
+
+class Engine(object):
+
+    def __init__(self,resolvers,window=default_window,timeout=default_timeout,attempts=default_attempts,rdtype=dns.rdatatype.A):
+        if len(resolvers) == 0:
+            raise ValueError("No resolvers to use")
+        self.resolvers = resolvers
+        if window is None:
+            window = default_window
+        self.window = min(window,65535)
+        self.timeout = timeout
+        self.attempts = attempts
+        self.rdtype = rdtype
+        self.next_resolver = 0
+        self.pending = {}
+        # the timeout is the same for all queries, so the deadlines are ordered by the time of sending
+        self.deadlines = collections.deque()
+        self.free_ids = collections.deque(range(65536))
+        self.retry = collections.deque()
+        self.stats = collections.Counter()
+        self.sock = None
+
+    # Pick the next resolver (round-robin)
+    def pick_resolver(self):
+        resolver = self.resolvers[self.next_resolver]
+        self.next_resolver = (self.next_resolver + 1) % len(self.resolvers)
+        return resolver
+
+    def send(self,hostname,attempt):
+        query_id = self.free_ids.popleft()
+        query = dns.message.make_query(hostname,self.rdtype)
+        query.id = query_id
+        resolver = self.pick_resolver()
+        try:
+            self.sock.sendto(query.to_wire(),resolver)
+        except socket.error, e:
+            logging.debug("Unable to send query to %s:%d : %s" % (resolver[0],resolver[1],e))
+        query = PendingQuery(hostname,resolver,attempt,time.time()+self.timeout)
+        self.pending[query_id] = query
+        self.deadlines.append((query_id,query))
+        self.stats['sent'] += 1
+
+    # The query failed, try again or give up
+    def failed(self,query):
+        if query.attempt < self.attempts:
+            self.retry.append((query.hostname,query.attempt+1))
+            self.stats['retried'] += 1
+        else:
+            self.stats['failed'] += 1
+            logging.debug("Giving up on %s after %d attempts" % (query.hostname,query.attempt))
+
+    def receive(self,output):
+        while True:
+            try:
+                wire, address = self.sock.recvfrom(65535)
+            except socket.error, e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                # ICMP unreachable from a dead resolver, the query will time out
+                continue
+            try:
+                response = dns.message.from_wire(wire)
+            except dns.exception.DNSException:
+                self.stats['malformed'] += 1
+                continue
+            query = self.pending.get(response.id)
+            # late answer or spoofed packet
+            if query is None or query.resolver != address or len(response.question) == 0 \
+                    or response.question[0].name.to_text().lower().rstrip('.') != query.hostname.lower().rstrip('.'):
+                self.stats['unexpected'] += 1
+                continue
+            del self.pending[response.id]
+            self.free_ids.append(response.id)
+            self.stats['received'] += 1
+            rcode = response.rcode()
+            if rcode in rcodes_retry or response.flags & dns.flags.TC:
+                self.failed(query)
+            elif rcode == dns.rcode.NOERROR:
+                lines = format_answer(response)
+                if lines:
+                    self.stats['resolved'] += 1
+                output.writelines(lines)
+            else:
+                self.stats['nxdomain'] += 1
+
+    # Time to wait for the oldest query still in flight
+    def next_deadline(self):
+        while self.deadlines:
+            query_id, query = self.deadlines[0]
+            if self.pending.get(query_id) is query:
+                return query.deadline
+            # already answered
+            self.deadlines.popleft()
+        return None
+
+    def expire(self):
+        now = time.time()
+        while True:
+            deadline = self.next_deadline()
+            if deadline is None or deadline > now:
+                return
+            query_id, query = self.deadlines.popleft()
+            del self.pending[query_id]
+            self.free_ids.append(query_id)
+            self.stats['timeouts'] += 1
+            self.failed(query)
+
+    # Resolve all the hostnames and write the answers to the output
+    def run(self,hostnames,output):
+        hostnames = iter(hostnames)
+        exhausted = False
+        self.stats = collections.Counter()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(0)
+        try:
+            while True:
+                # fill the window, retries go first
+                while len(self.pending) < self.window:
+                    if self.retry:
+                        hostname, attempt = self.retry.popleft()
+                    elif not exhausted:
+                        hostname = next(hostnames,None)
+                        if hostname is None:
+                            exhausted = True
+                            continue
+                        hostname = hostname.strip()
+                        if len(hostname) == 0:
+                            continue
+                        attempt = 1
+                    else:
+                        break
+                    self.send(hostname,attempt)
+                if not self.pending:
+                    break
+                wait = max(0,self.next_deadline() - time.time())
+                readable, _, _ = select.select([self.sock],[],[],wait)
+                if readable:
+                    self.receive(output)
+                self.expire()
+        finally:
+            self.sock.close()
+            self.sock = None
+        return self.stats
+
+
+# Resolve the hostnames from the input file, write the answers to the output file
+def resolve_file(file_resolvers,file_domains,file_output,window=default_window,timeout=default_timeout,attempts=default_attempts):
+    engine = Engine(read_resolvers(file_resolvers),window,timeout,attempts)
+    with open(file_domains) as fp_in:
+        with open(file_output, 'w') as fp_out:
+            stats = engine.run(fp_in,fp_out)
+    logging.debug("Resolved %s : %s" % (file_domains,dict(stats)))
+    return stats
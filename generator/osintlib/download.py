@@ -0,0 +1,161 @@
+# Download of the source exports
+#
+# The response is streamed in chunks to <file>.part and renamed when complete,
+# so a failed download never leaves a truncated export behind. The validators
+# of the last download (ETag, Last-Modified) are kept in a state file:
+#
+#   {url: {"etag":..., "last_modified":..., "file":..., "partial":...}}
+#
+# and sent with the next request, an unchanged export is answered with 304 and
+# linked from the previous file instead of downloaded again. The transfer is
+# gzip compressed if the server supports it, an interrupted download is resumed
+# with a Range request (If-Range makes sure the remote file did not change).
+import os
+import json
+import zlib
+import shutil
+import socket
+import urllib2
+import httplib
+import logging
+from osintlib import metrics
+
+# read size of the response
+chunk_size = 1 << 20
+# log the progress every N bytes
+progress_every = 16 << 20
+default_timeout = 60
+
+status_downloaded = 'downloaded'
+status_resumed = 'resumed'
+status_not_modified = 'not-modified'
+
+
+class DownloadError(IOError):
+    pass
+
+
+def partial_filename(localname):
+    return localname + '.part'
+
+# The state of the downloads ({} if there is none)
+def read_state(state_file):
+    try:
+        with open(state_file) as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return {}
+
+def write_state(state_file,state):
+    with open(state_file + '.tmp', 'w') as fp:
+        json.dump(state, fp, indent=4, sort_keys=True)
+    os.rename(state_file + '.tmp', state_file)
+
+# Validator of the partial download for If-Range (only a strong ETag or the date)
+def range_validator(headers):
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+# Copy of the previous download of an unchanged export (hard link if possible)
+def link_previous(previous,localname):
+    try:
+        os.link(previous,localname)
+    except OSError:
+        shutil.copyfile(previous,localname)
+
+# Stream the response body to the file, decompressed if the transfer is gzipped, returns the bytes received
+def stream_response(response,fp,url):
+    decompressor = None
+    if response.info().get('Content-Encoding','').lower() in ('gzip','x-gzip'):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    received = 0
+    reported = 0
+    while True:
+        chunk = response.read(chunk_size)
+        if not chunk:
+            break
+        received += len(chunk)
+        metrics.count('download.bytes',len(chunk))
+        fp.write(decompressor.decompress(chunk) if decompressor else chunk)
+        if received - reported >= progress_every:
+            logging.info("Downloading %s: %d bytes" % (url,received))
+            reported = received
+    if decompressor:
+        fp.write(decompressor.flush())
+    length = response.info().get('Content-Length')
+    if length is not None and received < int(length):
+        raise DownloadError("Incomplete download of %s: %d of %s bytes" % (url,received,length))
+    return received
+
+# Download the url to localname, returns {'status':..., 'size':..., 'received':...}
+#  raises DownloadError, the partial file is kept and resumed by the next call
+def fetch(url,localname,state_file,timeout=default_timeout):
+    state = read_state(state_file)
+    previous = state.get(url,{})
+    part = partial_filename(localname)
+    offset = os.path.getsize(part) if os.path.isfile(part) else 0
+
+    request = urllib2.Request(url)
+    if offset and previous.get('partial'):
+        # resume, the byte offset of the decoded file is the offset of the identity encoding
+        request.add_header('Range','bytes=%d-' % offset)
+        request.add_header('If-Range',previous['partial'])
+        request.add_header('Accept-Encoding','identity')
+    else:
+        offset = 0
+        request.add_header('Accept-Encoding','gzip')
+        if previous.get('file') and os.path.isfile(previous['file']):
+            if previous.get('etag'):
+                request.add_header('If-None-Match',previous['etag'])
+            if previous.get('last_modified'):
+                request.add_header('If-Modified-Since',previous['last_modified'])
+
+    try:
+        response = urllib2.urlopen(request, timeout=timeout)
+    except urllib2.HTTPError, e:
+        if e.code == 304:
+            if os.path.abspath(previous['file']) != os.path.abspath(localname):
+                link_previous(previous['file'],localname)
+            logging.info("%s not modified since %s" % (url,previous['file']))
+            previous['file'] = localname
+            state[url] = previous
+            write_state(state_file,state)
+            return {'status':status_not_modified,'size':os.path.getsize(localname),'received':0}
+        if e.code == 416 and offset:
+            # the partial file does not match the remote one, start again
+            logging.warning("Range of %s not satisfiable, restarting the download" % url)
+            os.remove(part)
+            return fetch(url,localname,state_file,timeout)
+        raise DownloadError("Unable to download %s: HTTP %d" % (url,e.code))
+    except (urllib2.URLError, socket.error, httplib.HTTPException), e:
+        raise DownloadError("Unable to download %s: %s" % (url,e))
+
+    try:
+        headers = response.info()
+        if response.getcode() != 206:
+            # full response (no resume or the remote file changed)
+            offset = 0
+        elif not headers.get('Content-Range','').startswith('bytes %d-' % offset):
+            raise DownloadError("Unexpected range of %s: %s" % (url,headers.get('Content-Range')))
+        previous['partial'] = range_validator(headers)
+        state[url] = previous
+        write_state(state_file,state)
+        if offset:
+            logging.info("Resuming %s at %d bytes" % (url,offset))
+        with open(part, 'ab' if offset else 'wb') as fp:
+            received = stream_response(response,fp,url)
+            fp.flush()
+            os.fsync(fp.fileno())
+    except (socket.error, httplib.HTTPException, zlib.error), e:
+        raise DownloadError("Download of %s interrupted: %s" % (url,e))
+    finally:
+        response.close()
+
+    os.rename(part,localname)
+    state[url] = {'etag':headers.get('ETag'),'last_modified':headers.get('Last-Modified'),'file':localname}
+    write_state(state_file,state)
+    size = os.path.getsize(localname)
+    logging.info("Downloaded %s to %s: %d bytes (%d received)" % (url,localname,size,received))
+    return {'status':status_resumed if offset else status_downloaded,'size':size,'received':received}
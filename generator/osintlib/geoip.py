@@ -0,0 +1,79 @@
+# GeoIP country lookup with a cache of the database networks
+#
+# Every record in the GeoIP database belongs to a network (prefix). The country
+# found for an address is cached for the whole network, so the other addresses
+# from the same prefix (typically thousands of hosts at the same hosting
+# provider) are answered without touching the database.
+import socket
+import struct
+import maxminddb
+
+# Country code used when the address is not found or is not an IPv4 address
+country_unknown = 'NX'
+
+
+# Convert the dotted IPv4 address to an integer
+def ip_to_int(ip):
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+
+class CountryLookup(object):
+
+    def __init__(self,path,mode=maxminddb.MODE_MMAP):
+        self.reader = maxminddb.open_database(path,mode)
+        # (prefix length, network) -> country code
+        self.networks = {}
+        # prefix lengths seen so far (longest first)
+        self.prefix_lens = []
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def lookup_network(self,address):
+        for prefix_len in self.prefix_lens:
+            key = (prefix_len, address >> (32 - prefix_len))
+            if key in self.networks:
+                return self.networks[key]
+        raise KeyError(address)
+
+    def add_network(self,address,prefix_len,iso_code):
+        # IPv4 address in an IPv6 database
+        if prefix_len > 32:
+            prefix_len -= 96
+        if prefix_len <= 0:
+            return
+        if prefix_len not in self.prefix_lens:
+            self.prefix_lens.append(prefix_len)
+            self.prefix_lens.sort(reverse=True)
+        self.networks[(prefix_len, address >> (32 - prefix_len))] = iso_code
+
+    # Country ISO code of the IP address (None if the network has no country assigned)
+    def country(self,ip):
+        try:
+            address = ip_to_int(ip)
+        except (socket.error, TypeError):
+            self.errors += 1
+            return country_unknown
+        try:
+            iso_code = self.lookup_network(address)
+            self.hits += 1
+            return iso_code
+        except KeyError:
+            self.misses += 1
+        try:
+            record, prefix_len = self.reader.get_with_prefix_len(ip)
+        except ValueError:
+            self.errors += 1
+            return country_unknown
+        if record is None:
+            iso_code = country_unknown
+        else:
+            iso_code = record.get('country',{}).get('iso_code')
+        self.add_network(address,prefix_len,iso_code)
+        return iso_code
+
+    def stats(self):
+        return {'hits':self.hits,'misses':self.misses,'errors':self.errors,'networks':len(self.networks)}
+
+    def close(self):
+        self.reader.close()
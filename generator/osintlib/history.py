@@ -0,0 +1,122 @@
+# Index of the history of the SK-NIC domains (sqlite)
+#
+# The snapshots are imported in date order. Every import is merged with the
+# previous one, so only the changes are stored: a span is a period during which
+# the domain was registered with the same registrar and holder. The span starts
+# at the date of the snapshot where it appeared first and ends (exclusive) at
+# the date of the snapshot where it was gone. The domain count of every
+# registrar is stored for every imported date.
+import sqlite3
+import logging
+
+schema = [
+    "CREATE TABLE IF NOT EXISTS imports (date TEXT PRIMARY KEY, domains INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS spans (domain TEXT NOT NULL, registrar TEXT NOT NULL, holder TEXT NOT NULL, since TEXT NOT NULL, until TEXT)",
+    "CREATE INDEX IF NOT EXISTS spans_domain ON spans (domain, until)",
+    "CREATE INDEX IF NOT EXISTS spans_holder ON spans (holder)",
+    "CREATE TABLE IF NOT EXISTS registrar_counts (registrar TEXT NOT NULL, date TEXT NOT NULL, count INTEGER NOT NULL, PRIMARY KEY (registrar, date))",
+    "CREATE TABLE IF NOT EXISTS registrars (id TEXT PRIMARY KEY, name TEXT NOT NULL)",
+]
+
+
+# Merge two iterables of records sorted by domain, yields (old record, new record), None where missing
+def merge_records(old_records,new_records):
+    old_iter = iter(old_records)
+    new_iter = iter(new_records)
+    old = next(old_iter,None)
+    new = next(new_iter,None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old[0] < new[0]):
+            yield (old,None)
+            old = next(old_iter,None)
+        elif old is None or new[0] < old[0]:
+            yield (None,new)
+            new = next(new_iter,None)
+        else:
+            yield (old,new)
+            old = next(old_iter,None)
+            new = next(new_iter,None)
+
+
+class History(object):
+
+    def __init__(self,path):
+        self.db = sqlite3.connect(path)
+        self.db.text_factory = str
+        for statement in schema:
+            self.db.execute(statement)
+
+    def close(self):
+        self.db.close()
+
+    # Drop everything (for a rebuild)
+    def reset(self):
+        for table in ('imports', 'spans', 'registrar_counts', 'registrars'):
+            self.db.execute("DELETE FROM %s" % table)
+        self.db.commit()
+
+    def imported_dates(self):
+        return [row[0] for row in self.db.execute("SELECT date FROM imports ORDER BY date")]
+
+    def last_import(self):
+        return self.db.execute("SELECT MAX(date) FROM imports").fetchone()[0]
+
+    # Import the snapshot, previous is the snapshot of the last imported date (None for the first import)
+    def import_snapshot(self,snap,previous=None):
+        last = self.last_import()
+        if last is not None and snap.date <= last:
+            raise ValueError("Snapshot %s is not newer than the last import %s" % (snap.date,last))
+        if (last is None) != (previous is None) or (previous is not None and previous.date != last):
+            raise ValueError("Snapshot %s must be merged with the snapshot of the last import %s" % (snap.date,last))
+
+        opened = []
+        closed = []
+        for old, new in merge_records(previous.records() if previous is not None else [],snap.records()):
+            if old is not None and (new is None or old[1:] != new[1:]):
+                closed.append((snap.date,old[0]))
+            if new is not None and (old is None or old[1:] != new[1:]):
+                opened.append((new[0],new[1],new[2],snap.date))
+        self.db.executemany("UPDATE spans SET until = ? WHERE domain = ? AND until IS NULL", closed)
+        self.db.executemany("INSERT INTO spans (domain, registrar, holder, since) VALUES (?,?,?,?)", opened)
+        self.db.executemany("INSERT INTO registrar_counts VALUES (?,?,?)", [(registrar,snap.date,count) for registrar, count in snap.counts('registrar').items()])
+        self.db.executemany("INSERT OR REPLACE INTO registrars VALUES (?,?)", snap.registrar_names().items())
+        self.db.execute("INSERT INTO imports VALUES (?,?)", (snap.date,snap.count))
+        self.db.commit()
+        logging.info("Imported %s: %d spans opened, %d closed" % (snap.date,len(opened),len(closed)))
+        return (len(opened),len(closed))
+
+    # All the registration periods of the domain
+    def domain(self,domain):
+        return [{'registrar':registrar,'holder':holder,'since':since,'until':until}
+                for registrar, holder, since, until in self.db.execute("SELECT registrar, holder, since, until FROM spans WHERE domain = ? ORDER BY since", (domain,))]
+
+    # Domains gained and lost by the holder, grouped by date
+    def holder(self,holder):
+        gained = set()
+        lost = set()
+        for domain, since, until in self.db.execute("SELECT domain, since, until FROM spans WHERE holder = ?", (holder,)):
+            gained.add((since,domain))
+            if until is not None:
+                lost.add((until,domain))
+        # a span closed and reopened with the same holder on the same date is a registrar change, not a holder event
+        kept = gained & lost
+        events = {}
+        for date, domain in gained - kept:
+            events.setdefault(date,{'date':date,'gained':[],'lost':[]})['gained'].append(domain)
+        for date, domain in lost - kept:
+            events.setdefault(date,{'date':date,'gained':[],'lost':[]})['lost'].append(domain)
+        for event in events.values():
+            event['gained'].sort()
+            event['lost'].sort()
+        return [events[date] for date in sorted(events)]
+
+    # Registrar ids matching the id or the name
+    def registrar_ids(self,registrar):
+        ids = [row[0] for row in self.db.execute("SELECT id FROM registrars WHERE id = ? OR name = ?", (registrar,registrar))]
+        return ids or [registrar]
+
+    # Count of domains of the registrar for every imported date
+    def registrar(self,registrar):
+        ids = self.registrar_ids(registrar)
+        return [{'date':date,'count':count} for date, count in self.db.execute(
+            "SELECT i.date, COALESCE(SUM(c.count),0) FROM imports i LEFT JOIN registrar_counts c ON c.date = i.date AND c.registrar IN (%s) GROUP BY i.date ORDER BY i.date" % ','.join('?' * len(ids)), ids)]
@@ -0,0 +1,208 @@
+# Compact map of the resolved addresses to the hosts
+#
+# The resolved pairs (address, host) are kept in two arrays of integers: the
+# IPv4 address as a 32-bit int and the index of the host in the table of the
+# host names (every name stored once). The keys which are not IPv4 addresses
+# (NX) are kept apart. The hosts are grouped by address on the first use (after
+# the DNS records are released) by sorting the host ids of every address. The
+# groups are assigned to the countries by index, so the results are never
+# copied to nested dicts of lists. The map is written in the format of
+# json.dump({country: {ip: [host, ...]}}, indent=4, sort_keys=True).
+import socket
+import struct
+from array import array
+from itertools import izip, islice
+from collections import defaultdict
+from osintlib import jsonstream
+
+
+# The IPv4 address as an integer, None if it is not a canonical dotted IPv4 address
+def ip_to_int(ip):
+    try:
+        packed = socket.inet_aton(ip)
+    except (socket.error, TypeError):
+        return None
+    # inet_aton accepts the short forms too (1.2), they must stay the same key
+    if socket.inet_ntoa(packed) != ip:
+        return None
+    return struct.unpack('!I', packed)[0]
+
+def int_to_ip(address):
+    return socket.inet_ntoa(struct.pack('!I', address))
+
+
+class HostMap(object):
+
+    def __init__(self):
+        # host names, the index is the id of the host
+        self.names = []
+        # resolved pairs
+        self.addresses = array('I')
+        self.hosts = array('I')
+        # not IPv4 key -> host ids
+        self.other = defaultdict(list)
+        # address -> integer (None if not IPv4) while adding
+        self.parsed = {}
+        # grouped by address: addresses, start of the hosts of every address in group_hosts
+        self.group_addresses = None
+        self.group_start = None
+        self.group_hosts = None
+        # country -> groups (index of an IPv4 address or the other key)
+        self.countries = None
+
+    # Add the resolved pairs (address, host), the pairs of a host come one after another (one name per host)
+    def update(self,pairs):
+        names = self.names
+        addresses = self.addresses
+        hosts = self.hosts
+        parsed = self.parsed
+        last = names[-1] if names else None
+        for address, host in pairs:
+            if host != last:
+                names.append(host)
+                last = host
+            try:
+                address_int = parsed[address]
+            except KeyError:
+                address_int = parsed[address] = ip_to_int(address)
+            if address_int is None:
+                self.other[address].append(len(names) - 1)
+            else:
+                addresses.append(address_int)
+                hosts.append(len(names) - 1)
+
+    # Group the pairs by address, the hosts of every address sorted by name
+    def group(self):
+        # renumber the hosts in the order of the names, sorting the ids sorts the names
+        #  (the hosts are usually resolved in the order of the sorted domains list)
+        rank = None
+        if not all(name <= next_name for name, next_name in izip(self.names,islice(self.names,1,None))):
+            order = sorted(xrange(len(self.names)), key=self.names.__getitem__)
+            rank = array('I', [0]) * len(order)
+            for position, host_id in enumerate(order):
+                rank[host_id] = position
+            self.names = [self.names[host_id] for host_id in order]
+            order = None
+        by_address = defaultdict(lambda: array('I'))
+        if rank is None:
+            for address, host_id in izip(self.addresses,self.hosts):
+                by_address[address].append(host_id)
+        else:
+            for address, host_id in izip(self.addresses,self.hosts):
+                by_address[address].append(rank[host_id])
+        self.addresses = self.hosts = self.parsed = None
+        self.group_addresses = array('I', sorted(by_address))
+        self.group_start = array('I')
+        self.group_hosts = array('I')
+        for address in self.group_addresses:
+            self.group_start.append(len(self.group_hosts))
+            # the pairs are added in the order of the host ids, already sorted without the renumbering
+            self.group_hosts.extend(by_address.pop(address) if rank is None else sorted(by_address.pop(address)))
+        self.group_start.append(len(self.group_hosts))
+        for key in self.other:
+            self.other[key] = sorted(rank[host_id] if rank is not None else host_id for host_id in self.other[key])
+
+    def grouped(self):
+        if self.group_addresses is None:
+            self.group()
+
+    # The address of the group (IPv4 group index or the other key)
+    def address(self,group):
+        if isinstance(group, basestring):
+            return group
+        return int_to_ip(self.group_addresses[group])
+
+    # Host names of the group, sorted
+    def group_names(self,group):
+        if isinstance(group, basestring):
+            host_ids = self.other[group]
+        else:
+            host_ids = self.group_hosts[self.group_start[group]:self.group_start[group+1]]
+        return [self.names[host_id] for host_id in host_ids]
+
+    def group_size(self,group):
+        if isinstance(group, basestring):
+            return len(self.other[group])
+        return self.group_start[group+1] - self.group_start[group]
+
+    # All the groups, the IPv4 addresses in numeric order
+    def groups(self):
+        self.grouped()
+        return range(len(self.group_addresses)) + sorted(self.other)
+
+    # Number of addresses (keys)
+    def __len__(self):
+        if self.group_addresses is None:
+            return len(set(self.addresses)) + len(self.other)
+        return len(self.group_addresses) + len(self.other)
+
+    # Number of the resolved pairs
+    def host_count(self):
+        if self.group_hosts is None:
+            return len(self.hosts) + sum(len(host_ids) for host_ids in self.other.values())
+        return len(self.group_hosts) + sum(len(host_ids) for host_ids in self.other.values())
+
+    # The addresses of every host in the order of the names: (host, [(address, country), ...])
+    def host_addresses(self):
+        self.grouped()
+        other = sorted(self.other)
+        # the other keys are numbered after the IPv4 groups
+        other_base = len(self.group_addresses)
+        country_of = {}
+        if self.countries is not None:
+            for country, groups in self.countries.items():
+                for group in groups:
+                    country_of[group] = country
+        # counting sort of the pairs by host
+        first = array('I', [0]) * (len(self.names) + 1)
+        for host_id in self.group_hosts:
+            first[host_id+1] += 1
+        for key in other:
+            for host_id in self.other[key]:
+                first[host_id+1] += 1
+        for host_id in xrange(len(self.names)):
+            first[host_id+1] += first[host_id]
+        position = array('I', first)
+        pair_groups = array('I', [0]) * first[-1]
+        for group in xrange(len(self.group_addresses)):
+            for host_id in self.group_hosts[self.group_start[group]:self.group_start[group+1]]:
+                pair_groups[position[host_id]] = group
+                position[host_id] += 1
+        for index, key in enumerate(other):
+            for host_id in self.other[key]:
+                pair_groups[position[host_id]] = other_base + index
+                position[host_id] += 1
+        position = None
+        last = None
+        addresses = []
+        for host_id, name in enumerate(self.names):
+            if name != last and addresses:
+                yield (last,addresses)
+                addresses = []
+            last = name
+            for group in pair_groups[first[host_id]:first[host_id+1]]:
+                if group >= other_base:
+                    group = other[group - other_base]
+                addresses.append((self.address(group),country_of.get(group)))
+        if addresses:
+            yield (last,addresses)
+
+    # Assign the addresses to the countries, country(ip) returns the country code
+    def set_countries(self,country):
+        self.countries = defaultdict(list)
+        for group in self.groups():
+            self.countries[country(self.address(group))].append(group)
+
+    # The groups of the country sorted like the keys of json.dump
+    def country_groups(self,country):
+        return sorted(self.countries[country], key=self.address)
+
+    # (countries, addresses, hosts)
+    def stats(self):
+        return (len(self.countries),len(self),self.host_count())
+
+    # Write the map grouped by country, the same bytes as json.dump(..., indent=4, sort_keys=True)
+    def write(self,fp):
+        countries = jsonstream.Pairs((country,jsonstream.Pairs((self.address(group),self.group_names(group)) for group in self.country_groups(country)))
+                                     for country in sorted(self.countries))
+        jsonstream.dump(countries,fp,4,True)
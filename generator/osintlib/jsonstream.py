@@ -0,0 +1,106 @@
+# Incremental JSON writer for the large outputs
+#
+# json.dump with indent goes through the pure python encoder and writes every
+# token separately. The writer below produces the same bytes (same indent,
+# separators, ensure_ascii and key order) but encodes the lists of strings in
+# one join and writes key by key, so the whole document is never in memory.
+import json
+from json.encoder import encode_basestring_ascii
+
+# Output buffer of the files opened by dump_file
+buffer_size = 1 << 20
+# Separators of the compact output
+compact_separators = (',', ':')
+
+
+# A dict given as (key, value) pairs in the output order (not sorted), the pairs
+# and the values can be generated on the fly
+class Pairs(object):
+
+    def __init__(self,pairs):
+        self.pairs = pairs
+
+    def __iter__(self):
+        return iter(self.pairs)
+
+
+# Encode a scalar value
+def encode_scalar(value):
+    if isinstance(value, basestring):
+        return encode_basestring_ascii(value)
+    return json.dumps(value)
+
+# Encode a dict key (the non-string keys are converted like json.dump does)
+def encode_key(key):
+    if isinstance(key, basestring):
+        return encode_basestring_ascii(key)
+    if key is None or isinstance(key, (bool, int, long, float)):
+        return '"' + json.dumps(key) + '"'
+    raise TypeError("key %r is not a string" % (key,))
+
+# Encode the object as chunks of JSON text
+def iterencode(obj,indent=None,sort_keys=False,separators=None):
+    if separators is not None:
+        item_separator, key_separator = separators
+    else:
+        item_separator, key_separator = ', ', ': '
+
+    def newlines(level):
+        if indent is None:
+            return '', ''
+        return '\n' + ' ' * (indent * (level + 1)), '\n' + ' ' * (indent * level)
+
+    def encode(value,level):
+        if isinstance(value, (dict, Pairs)):
+            newline, close = newlines(level)
+            if isinstance(value, Pairs):
+                items = value
+            elif sort_keys:
+                items = sorted(value.items(), key=lambda kv: kv[0])
+            else:
+                items = value.iteritems()
+            separator = '{' + newline
+            for key, item in items:
+                yield separator + encode_key(key) + key_separator
+                separator = item_separator + newline
+                for chunk in encode(item,level+1):
+                    yield chunk
+            # no item
+            if separator[0] == '{':
+                yield '{}'
+            else:
+                yield close + '}'
+        elif isinstance(value, (list, tuple)):
+            if not value:
+                yield '[]'
+                return
+            newline, close = newlines(level)
+            if all(isinstance(item, basestring) for item in value):
+                # the common case, a list of domains
+                yield '[' + newline + (item_separator + newline).join(map(encode_basestring_ascii,value)) + close + ']'
+                return
+            separator = '[' + newline
+            for item in value:
+                yield separator
+                separator = item_separator + newline
+                for chunk in encode(item,level+1):
+                    yield chunk
+            yield close + ']'
+        else:
+            yield encode_scalar(value)
+
+    return encode(obj,0)
+
+# Write the object to an open file
+def dump(obj,fp,indent=None,sort_keys=False,separators=None):
+    for chunk in iterencode(obj,indent,sort_keys,separators):
+        fp.write(chunk)
+
+# Write the object to a file (staged in the publish batch if given), indented like json.dump(indent=4) or compact
+def dump_file(obj,filename,compact=False,sort_keys=False,batch=None):
+    opener = batch.open if batch is not None else open
+    with opener(filename, 'w', buffer_size) as fp:
+        if compact:
+            dump(obj,fp,None,sort_keys,compact_separators)
+        else:
+            dump(obj,fp,4,sort_keys)
@@ -0,0 +1,121 @@
+# Run metrics of the generators (timing spans, counters, peak memory)
+#
+# The spans and counters are collected in one registry per process (shared by
+# the threads). At the end of a run the summary is written as JSON:
+#
+#   <path>/<run>.json            summary of the last run
+#   <path>/history.jsonl         one summary per line, appended by every run
+#
+# so the daily runtime of the stages can be followed over time.
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import datetime
+import functools
+import threading
+
+_lock = threading.Lock()
+_spans = {}
+_counters = {}
+_started = time.time()
+
+
+# Forget all the spans and counters (start of a new run)
+def reset():
+    global _started
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _started = time.time()
+
+# Add to a counter
+def count(name,value=1):
+    with _lock:
+        _counters[name] = _counters.get(name,0) + value
+
+# Add the counters from a dict {key: value} as <prefix>.<key>
+def count_all(prefix,values):
+    for key, value in values.items():
+        count("%s.%s" % (prefix,key),value)
+
+# Record the duration of a span (accumulated if the span is entered more than once)
+def add_span(name,seconds):
+    with _lock:
+        span = _spans.setdefault(name,{'seconds':0.0,'calls':0})
+        span['seconds'] += seconds
+        span['calls'] += 1
+
+
+class span(object):
+
+    def __init__(self,name):
+        self.name = name
+
+    def __enter__(self):
+        self.time_start = time.time()
+        return self
+
+    def __exit__(self,*exc_info):
+        add_span(self.name,time.time() - self.time_start)
+        return False
+
+# Decorator, the calls of the function are recorded as a span
+def timed(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args,**kwargs):
+            with span(name):
+                return function(*args,**kwargs)
+        return wrapper
+    return decorator
+
+# Peak resident memory of the process (KB on linux)
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+# Summary of the run
+def summary(run,status=None):
+    with _lock:
+        return {
+            'run':run,
+            'argv':sys.argv[1:],
+            'started':datetime.datetime.fromtimestamp(_started).strftime("%Y-%m-%d %H:%M:%S"),
+            'seconds':round(time.time() - _started,3),
+            'status':status,
+            'peak_rss_kb':peak_rss(),
+            'spans':dict((name,{'seconds':round(value['seconds'],3),'calls':value['calls']}) for name, value in _spans.items()),
+            'counters':dict(_counters),
+        }
+
+# Write the summary of the run and append it to the history
+def write_summary(path,run,status=None):
+    data = summary(run,status)
+    try:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        with open(os.path.join(path,run+'.json'), 'w') as outfile:
+            json.dump(data, outfile, indent=4, sort_keys=True)
+        with open(os.path.join(path,'history.jsonl'), 'a') as fp:
+            fp.write(json.dumps(data, sort_keys=True) + '\n')
+    except (IOError, OSError), e:
+        # the metrics must not break the update
+        logging.error("Unable to write the metrics to %s: %s" % (path,e))
+    return data
+
+# Run the main function of a script and write the summary, whatever the result is
+def run(main,path,name):
+    status = 'OK'
+    try:
+        main()
+    except SystemExit, e:
+        if e.code not in (None,0):
+            status = "EXIT %s" % e.code
+        raise
+    except BaseException, e:
+        status = "FAILED %s" % e.__class__.__name__
+        raise
+    finally:
+        write_summary(path,name,status)
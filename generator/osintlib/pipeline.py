@@ -0,0 +1,58 @@
+# Execution of dependent stages
+#
+# Every stage runs in its own thread as soon as all its dependencies are
+# finished, so the independent stages run in parallel. A stage whose
+# dependency failed is skipped. The result of every stage is recorded with
+# its status and duration (also as the metrics span stage.<name>).
+import time
+import logging
+import threading
+import collections
+from osintlib import metrics
+
+status_ok = 'OK'
+status_failed = 'FAILED'
+status_skipped = 'SKIPPED'
+
+
+# Run the stages [(name, [dependencies], function)], listed in the order of the dependencies
+#  returns {name: {'status':..., 'seconds':..., 'result':...}} in the order of the stages
+def run_stages(stages):
+    names = set()
+    for name, deps, _ in stages:
+        for dep in deps:
+            if dep not in names:
+                raise ValueError("Stage %s depends on %s which is not listed before it" % (name,dep))
+        names.add(name)
+
+    results = collections.OrderedDict((name,None) for name, _, _ in stages)
+    finished = dict((name,threading.Event()) for name, _, _ in stages)
+
+    def run(name,deps,function):
+        for dep in deps:
+            finished[dep].wait()
+        failed = [dep for dep in deps if results[dep]['status'] != status_ok]
+        if failed:
+            logging.warning("Stage %s skipped, failed dependencies: %s" % (name,", ".join(failed)))
+            results[name] = {'status':status_skipped,'seconds':0.0,'result':"%s not done" % ", ".join(failed)}
+            finished[name].set()
+            return
+        logging.info("Stage %s BEGIN." % name)
+        time_start = time.time()
+        try:
+            results[name] = {'status':status_ok,'result':function()}
+        except Exception, e:
+            logging.exception("Stage %s failed" % name)
+            results[name] = {'status':status_failed,'result':str(e)}
+        results[name]['seconds'] = time.time() - time_start
+        metrics.add_span("stage.%s" % name,results[name]['seconds'])
+        logging.info("Stage %s END (%s, %.1f s)." % (name,results[name]['status'],results[name]['seconds']))
+        finished[name].set()
+
+    threads = [threading.Thread(target=run, name=name, args=(name,deps,function)) for name, deps, function in stages]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
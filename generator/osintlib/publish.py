@@ -0,0 +1,208 @@
+# Crash-safe publishing of the output files
+#
+# The outputs of a run are written to temporary files next to the targets
+# (staged) and published together by commit():
+#
+#   1. fsync of all the staged files
+#   2. the journal (list of temp -> target renames) is written and synced,
+#      this is the commit point of the run
+#   3. the renames, fsync of the directories, the journal is removed
+#
+# A run which dies before the commit point leaves the published files
+# untouched. A run which dies after it is completed by the next run
+# (recover), so the readers never see a half-written set of files.
+# The files which only grow (the trends) are not copied: the appended data
+# is staged alone and written at the offset recorded in the journal, so an
+# append repeated by the recovery gives the same file.
+import os
+import json
+import shutil
+import logging
+from osintlib import metrics
+
+
+# Temporary name of the staged file
+def temp_filename(filename):
+    directory, name = os.path.split(filename)
+    return os.path.join(directory, '.%s.tmp-%d' % (name,os.getpid()))
+
+# Flush the file content to the disk
+def fsync_file(filename):
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# Flush the directory entries (renames) to the disk
+def fsync_dir(path):
+    try:
+        fsync_file(path)
+    except OSError, e:
+        # not supported on every filesystem
+        logging.debug("Unable to fsync directory %s: %s" % (path,e))
+
+# Write the staged data to the target at the offset (the target is truncated there first)
+def apply_append(temp,target,offset):
+    with open(target, 'r+b' if os.path.isfile(target) else 'wb') as fp:
+        fp.truncate(offset)
+        fp.seek(offset)
+        with open(temp, 'rb') as data:
+            shutil.copyfileobj(data, fp)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.remove(temp)
+
+# Complete the renames and appends of a committed batch (left by a crashed run)
+def recover(journal_file):
+    if not os.path.isfile(journal_file):
+        return 0
+    with open(journal_file) as fp:
+        journal = json.load(fp)
+    # journal of the older versions: only the renames
+    if isinstance(journal, list):
+        journal = {'renames':journal,'appends':[]}
+    renames = journal['renames']
+    appends = journal['appends']
+    cnt = 0
+    for temp, target, offset in appends:
+        # the temp file is removed when the append is done
+        if os.path.isfile(temp):
+            apply_append(temp, target, offset)
+            cnt += 1
+    for temp, target in renames:
+        if os.path.isfile(temp):
+            os.rename(temp, target)
+            cnt += 1
+    for directory in set(os.path.dirname(target) for _, target in renames):
+        fsync_dir(directory)
+    os.remove(journal_file)
+    logging.warning("Recovered %d of %d files from the journal %s" % (cnt,len(renames)+len(appends),journal_file))
+    return cnt
+
+
+class Batch(object):
+
+    def __init__(self,journal_file):
+        self.journal_file = journal_file
+        # target -> temp file, in the order of staging
+        self.staged = {}
+        self.order = []
+        # target -> (temp file with the appended data, offset in the target)
+        self.appends = {}
+        recover(journal_file)
+
+    def stage(self,filename):
+        if filename not in self.staged:
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            self.staged[filename] = temp_filename(filename)
+            self.order.append(filename)
+        return self.staged[filename]
+
+    # Open a staged file for writing (same arguments as open)
+    def open(self,filename,mode='w',buffering=-1):
+        return open(self.stage(filename), mode, buffering)
+
+    # Staged copy of the file (empty if the file does not exist) to be modified in place
+    def copy(self,filename):
+        if filename in self.staged:
+            return self.staged[filename]
+        temp = self.stage(filename)
+        if os.path.isfile(filename):
+            shutil.copyfile(filename, temp)
+        else:
+            open(temp, 'w').close()
+        # the staged append becomes a part of the copy
+        if filename in self.appends:
+            append_temp, offset = self.appends.pop(filename)
+            apply_append(append_temp, temp, offset)
+        return temp
+
+    # Append the data to the file when the batch is committed, the file is truncated to
+    #  the offset first (default: the end of the file), the file itself is not copied
+    def append(self,filename,data,offset=None):
+        if filename in self.staged:
+            with open(self.staged[filename], 'r+b') as fp:
+                if offset is not None:
+                    fp.truncate(offset)
+                fp.seek(0, os.SEEK_END)
+                fp.write(data)
+            return
+        size = os.path.getsize(filename) if os.path.isfile(filename) else 0
+        if filename in self.appends:
+            append_temp, start = self.appends[filename]
+            if offset is not None and offset < start:
+                # the new data overwrite the published part, patch a full copy
+                self.copy(filename)
+                self.append(filename,data,offset)
+                return
+            with open(append_temp, 'r+b') as fp:
+                if offset is not None:
+                    fp.truncate(offset - start)
+                fp.seek(0, os.SEEK_END)
+                fp.write(data)
+            return
+        if offset is None:
+            offset = size
+        elif offset > size:
+            raise ValueError("Append to %s at %d beyond the end of the file (%d)" % (filename,offset,size))
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        append_temp = temp_filename(filename) + '.append'
+        with open(append_temp, 'wb') as fp:
+            fp.write(data)
+        self.appends[filename] = (append_temp,offset)
+
+    # Path to read the file from, the staged version if there is one
+    def path(self,filename):
+        if filename in self.appends:
+            # the reader must see the appended data
+            return self.copy(filename)
+        return self.staged.get(filename, filename)
+
+    # Publish all the staged files
+    @metrics.timed('publish.commit')
+    def commit(self):
+        if not self.order and not self.appends:
+            return 0
+        renames = [(self.staged[target],target) for target in self.order]
+        appends = [(temp,target,offset) for target, (temp,offset) in sorted(self.appends.items())]
+        for temp in [temp for temp, _ in renames] + [temp for temp, _, _ in appends]:
+            fsync_file(temp)
+            metrics.count('publish.bytes',os.path.getsize(temp))
+        metrics.count('publish.files',len(renames)+len(appends))
+        if not os.path.isdir(os.path.dirname(self.journal_file)):
+            os.makedirs(os.path.dirname(self.journal_file))
+        journal_temp = temp_filename(self.journal_file)
+        with open(journal_temp, 'w') as fp:
+            json.dump({'renames':renames,'appends':appends}, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.rename(journal_temp, self.journal_file)
+        fsync_dir(os.path.dirname(self.journal_file))
+        # committed
+        for temp, target, offset in appends:
+            apply_append(temp, target, offset)
+        for temp, target in renames:
+            os.rename(temp, target)
+        for directory in set(os.path.dirname(target) for _, target in renames):
+            fsync_dir(directory)
+        os.remove(self.journal_file)
+        logging.info("Published %d files (%d appended)" % (len(renames)+len(appends),len(appends)))
+        self.staged = {}
+        self.order = []
+        self.appends = {}
+        return len(renames) + len(appends)
+
+    # Drop the staged files (nothing is published)
+    def abort(self):
+        temps = [self.staged[target] for target in self.order] + [temp for temp, _ in self.appends.values()]
+        for temp in temps:
+            if os.path.isfile(temp):
+                os.remove(temp)
+        if temps:
+            logging.warning("Dropped %d staged files" % len(temps))
+        self.staged = {}
+        self.order = []
+        self.appends = {}
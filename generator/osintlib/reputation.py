@@ -0,0 +1,123 @@
+# Persistent reputation of the open resolvers (sqlite)
+#
+# Every check of a resolver is recorded: the number of checks and successes,
+# the latencies of the last successful checks, the time of the last success
+# and failure and the result of the last check (ok, wrong answer, timeout,
+# error). A resolver which failed is not checked again until its backoff
+# expires (doubled with every consecutive failure, longer for a resolver giving
+# wrong answers), so the dead and lying resolvers do not slow down the checks of
+# every run. The working resolvers are ranked by the success rate and the median
+# latency, only the best ones are used for the resolution.
+import time
+import sqlite3
+import logging
+
+# results of a check
+result_ok = 'ok'
+result_wrong = 'wrong'
+result_timeout = 'timeout'
+result_error = 'error'
+# backoff after the first failure, doubled by every next failure up to the max (seconds)
+default_backoff = 86400
+default_wrong_backoff = 7 * 86400
+default_max_backoff = 30 * 86400
+# a resolver is checked a bit before its backoff expires (the daily runs do not start at the same second)
+check_margin = 6 * 3600
+# latencies kept for the median
+latency_samples = 15
+
+schema = """
+CREATE TABLE IF NOT EXISTS resolvers (
+    resolver TEXT PRIMARY KEY,
+    checks INTEGER NOT NULL,
+    successes INTEGER NOT NULL,
+    failures INTEGER NOT NULL,
+    latencies TEXT NOT NULL,
+    last_result TEXT NOT NULL,
+    last_success INTEGER,
+    last_failure INTEGER,
+    next_check INTEGER NOT NULL
+)
+"""
+
+
+def median(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[len(values) // 2]
+
+# Score of a resolver, the success rate (smoothed for the resolvers with few checks) slowed down by the latency
+def score(checks,successes,median_latency):
+    rate = (successes + 1.0) / (checks + 2.0)
+    return rate / (1.0 + (median_latency or 0.0) / 100.0)
+
+
+class Reputation(object):
+
+    def __init__(self,path,backoff=default_backoff,wrong_backoff=default_wrong_backoff,max_backoff=default_max_backoff):
+        self.path = path
+        self.backoff = backoff
+        self.wrong_backoff = wrong_backoff
+        self.max_backoff = max_backoff
+        self.db = sqlite3.connect(path)
+        self.db.text_factory = str
+        self.db.execute(schema)
+
+    def close(self):
+        self.db.close()
+
+    # Resolvers to check now (unknown, the backoff expired or always checked), the rest are skipped
+    def due(self,resolvers,now=None,always=()):
+        if now is None:
+            now = int(time.time())
+        waiting = set(row[0] for row in self.db.execute("SELECT resolver FROM resolvers WHERE next_check > ?", (now+check_margin,)))
+        waiting.difference_update(always)
+        selected = [resolver for resolver in resolvers if resolver not in waiting]
+        logging.info("Resolvers reputation: %d resolvers, %d skipped (backoff), %d to check" % (len(resolvers),len(resolvers)-len(selected),len(selected)))
+        return selected
+
+    # Record the results of the checks [(resolver, result, latency in ms)]
+    def record(self,results,now=None):
+        if now is None:
+            now = int(time.time())
+        known = dict((row[0],row[1:]) for row in self.db.execute("SELECT resolver, checks, successes, failures, latencies, last_success, last_failure FROM resolvers"))
+        rows = []
+        for resolver, result, latency in results:
+            checks, successes, failures, latencies, last_success, last_failure = known.get(resolver,(0,0,0,'',None,None))
+            latencies = latencies.split()
+            checks += 1
+            if result == result_ok:
+                successes += 1
+                failures = 0
+                latencies = (latencies + ['%.1f' % latency])[-latency_samples:]
+                last_success = now
+                next_check = now
+            else:
+                failures += 1
+                last_failure = now
+                backoff = self.wrong_backoff if result == result_wrong else self.backoff
+                next_check = now + min(backoff << min(failures - 1, 16), self.max_backoff)
+            rows.append((resolver,checks,successes,failures,' '.join(latencies),result,last_success,last_failure,next_check))
+        self.db.executemany("INSERT OR REPLACE INTO resolvers VALUES (?,?,?,?,?,?,?,?,?)", rows)
+        self.db.commit()
+
+    # The resolvers ranked by the score (best first): [(resolver, score, success rate, median latency)]
+    def ranked(self,resolvers):
+        resolvers = set(resolvers)
+        ranking = []
+        for resolver, checks, successes, latencies in self.db.execute("SELECT resolver, checks, successes, latencies FROM resolvers"):
+            if resolver not in resolvers:
+                continue
+            latency = median([float(value) for value in latencies.split()])
+            ranking.append((resolver,score(checks,successes,latency),float(successes) / checks if checks else 0.0,latency))
+        ranking.sort(key=lambda entry: (-entry[1],entry[0]))
+        return ranking
+
+    # Drop the resolvers which are no longer in the list
+    def purge(self,resolvers):
+        resolvers = set(resolvers)
+        deleted = [(row[0],) for row in self.db.execute("SELECT resolver FROM resolvers") if row[0] not in resolvers]
+        self.db.executemany("DELETE FROM resolvers WHERE resolver = ?", deleted)
+        self.db.commit()
+        logging.debug("Resolvers reputation: purged %d resolvers" % len(deleted))
@@ -0,0 +1,88 @@
+# Daily delta of the resolved hosts
+#
+# The resolved hosts of the last run are kept in a snapshot sorted by host,
+# one host per line with its addresses and their countries:
+#
+#   # 2020-01-02
+#   www.example.sk 1.2.3.4=SK 5.6.7.8=DE
+#
+# The delta is computed by a merge of the previous snapshot (read line by line)
+# with the hosts of the current run (in the same order), the new snapshot is
+# written in the same pass. Only the changed hosts are kept in memory.
+import logging
+
+# date line of the snapshot
+snapshot_header = '# '
+# country of an address not assigned to any country
+country_none = ''
+
+
+# Format the snapshot line of a host
+def format_line(host,addresses):
+    return host + ''.join(' %s=%s' % (address,country if country is not None else country_none) for address, country in addresses) + '\n'
+
+# Parse the snapshot line of a host
+def parse_line(line):
+    fields = line.split()
+    addresses = []
+    for field in fields[1:]:
+        address, country = field.rsplit('=',1)
+        addresses.append((address,country if country != country_none else None))
+    return (fields[0],addresses)
+
+# Date of the snapshot (None if it has no header)
+def read_date(filename):
+    with open(filename) as fp:
+        line = fp.readline()
+    if line.startswith(snapshot_header):
+        return line[len(snapshot_header):].strip()
+    return None
+
+# The hosts of the snapshot (host, [(address, country), ...]) in the order of the file
+def read_snapshot(filename):
+    with open(filename) as fp:
+        for line in fp:
+            if line.startswith(snapshot_header) or not line.strip():
+                continue
+            yield parse_line(line)
+
+def addresses_of(addresses):
+    return sorted(set(address for address, _ in addresses))
+
+def countries_of(addresses):
+    return sorted(set(country for _, country in addresses))
+
+
+# Merge the previous and the current hosts (both sorted by host), the current hosts are written to the snapshot file
+#  returns the delta {'appeared', 'disappeared', 'moved', 'country', 'unchanged'}
+def merge(previous,current,snapshot_fp=None,date=None):
+    delta = {'appeared':[],'disappeared':[],'moved':[],'country':[],'unchanged':0}
+    if snapshot_fp is not None:
+        snapshot_fp.write(snapshot_header + (date or '') + '\n')
+    end = (None,None)
+    old = next(previous,end)
+    new = next(current,end)
+    while old is not end or new is not end:
+        if new is not end and snapshot_fp is not None and (old is end or new[0] <= old[0]):
+            snapshot_fp.write(format_line(new[0],new[1]))
+        if new is end or (old is not end and old[0] < new[0]):
+            delta['disappeared'].append([old[0],addresses_of(old[1]),countries_of(old[1])])
+            old = next(previous,end)
+        elif old is end or new[0] < old[0]:
+            delta['appeared'].append([new[0],addresses_of(new[1]),countries_of(new[1])])
+            new = next(current,end)
+        else:
+            changed = False
+            if addresses_of(old[1]) != addresses_of(new[1]):
+                delta['moved'].append([new[0],addresses_of(old[1]),addresses_of(new[1])])
+                changed = True
+            if countries_of(old[1]) != countries_of(new[1]):
+                delta['country'].append([new[0],countries_of(old[1]),countries_of(new[1])])
+                changed = True
+            if not changed:
+                delta['unchanged'] += 1
+            old = next(previous,end)
+            new = next(current,end)
+    logging.debug("Resolved delta: appeared %d, disappeared %d, moved %d, country %d, unchanged %d" % (
+        len(delta['appeared']),len(delta['disappeared']),len(delta['moved']),len(delta['country']),delta['unchanged']))
+    return delta
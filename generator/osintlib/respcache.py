@@ -0,0 +1,88 @@
+# Content-addressed cache of API responses
+#
+# Every response is stored in its own file, named by the hash of the request
+# (query, facets) and the date, in a subfolder per date:
+#
+#   <path>/<date>/<sha1>.json
+#
+# The entries older than the max age are ignored (and overwritten by the next
+# response for the same request). The folders of the old dates are removed by
+# prune, the responses of the last days are kept for the replay. A read-only
+# cache (test mode) serves the cached responses but does not store new ones.
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import datetime
+
+# default max age of a cached response (seconds)
+default_max_age = 86400
+# default number of days of responses kept
+default_keep_days = 30
+
+
+# No cached response for the request (offline)
+class CacheMiss(Exception):
+    pass
+
+
+class ResponseCache(object):
+
+    def __init__(self,path,max_age=default_max_age,readonly=False):
+        self.path = path
+        self.max_age = max_age
+        self.readonly = readonly
+        self.hits = 0
+        self.misses = 0
+
+    def filename(self,query,facets,date):
+        key = json.dumps([query,facets,date], sort_keys=True)
+        return os.path.join(self.path,date,hashlib.sha1(key).hexdigest()+'.json')
+
+    # The cached response or None
+    def get(self,query,facets,date,now=None):
+        if now is None:
+            now = time.time()
+        filename = self.filename(query,facets,date)
+        try:
+            with open(filename) as json_file:
+                entry = json.load(json_file)
+        except (IOError, ValueError):
+            self.misses += 1
+            return None
+        if self.max_age is not None and entry['saved'] + self.max_age < now:
+            logging.debug("Cached response for %s expired" % query)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry['response']
+
+    def put(self,query,facets,date,response):
+        if self.readonly:
+            return
+        filename = self.filename(query,facets,date)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        entry = {'query':query,'facets':facets,'date':date,'saved':time.time(),'response':response}
+        # write to a temporary file first, a broken run must not leave a truncated entry
+        with open(filename+'.tmp', 'w') as outfile:
+            json.dump(entry, outfile)
+        os.rename(filename+'.tmp',filename)
+
+    # Remove the responses of the dates older than keep_days, returns the number of removed dates
+    def prune(self,keep_days=default_keep_days,today=None):
+        if today is None:
+            today = datetime.date.today()
+        oldest = (today - datetime.timedelta(days=keep_days)).strftime("%Y-%m-%d")
+        if not os.path.isdir(self.path):
+            return 0
+        removed = 0
+        for date in sorted(os.listdir(self.path)):
+            # only the date folders (YYYY-MM-DD)
+            if len(date) == 10 and date[4] == '-' and date < oldest:
+                shutil.rmtree(os.path.join(self.path,date))
+                removed += 1
+        logging.info("Removed the cached responses of %d dates older than %s" % (removed,oldest))
+        return removed
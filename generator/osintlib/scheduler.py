@@ -0,0 +1,80 @@
+# Rate limited execution of API calls
+#
+# The calls are executed by a pool of worker threads, the start of every call
+# (including the retries) takes a token from a shared token bucket, so the calls
+# run at the rate allowed by the API and not slower. The calls which fail with a
+# retryable error (e.g. rate limit reached) are retried with an exponential
+# backoff.
+import time
+import logging
+import threading
+import Queue
+
+# default number of retries of a call
+default_retries = 5
+# default delay before the first retry (seconds), doubled for every next one
+default_backoff = 2.0
+
+
+class TokenBucket(object):
+
+    def __init__(self,rate,burst=1,clock=time.time,sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = float(burst)
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    # Take a token, wait if there is none (the waiting callers are served in order)
+    def acquire(self):
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            self.sleep(wait)
+
+
+# Execute the calls {key: function}, returns {key: result}
+def run_calls(calls,bucket,workers=4,retries=default_retries,backoff=default_backoff,retryable=lambda e: False,sleep=time.sleep):
+    results = {}
+    errors = []
+    queue = Queue.Queue()
+    for key, call in calls:
+        queue.put((key,call))
+
+    def worker():
+        while not errors:
+            try:
+                key, call = queue.get_nowait()
+            except Queue.Empty:
+                return
+            attempt = 0
+            while True:
+                bucket.acquire()
+                try:
+                    results[key] = call()
+                    break
+                except Exception, e:
+                    if attempt >= retries or not retryable(e):
+                        logging.error("Call %s failed : %s" % (key,e))
+                        errors.append(e)
+                        return
+                    delay = backoff * (2 ** attempt)
+                    attempt += 1
+                    logging.warning("Call %s failed (%s), retry %d in %.1f s" % (key,e,attempt,delay))
+                    sleep(delay)
+
+    threads = [threading.Thread(target=worker) for _ in range(max(1,min(workers,len(calls))))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
@@ -0,0 +1,94 @@
+# Readers of the SK-NIC exports (domains.txt, registrars.txt)
+import os
+import re
+import glob
+import logging
+import datetime
+import collections
+from osintlib import snapshot
+from osintlib import metrics
+
+# A single record of the SK-NIC domains export
+DomainRecord = collections.namedtuple('DomainRecord', ['domain', 'registrar', 'holder'])
+
+# The SK-NIC exports start with a header block of comment lines ("--")
+def is_export_header(line):
+    return len(line) == 0 or line.startswith('--')
+
+# Read the data lines of a SK-NIC export and yield their fields
+def read_export_fields(filename,min_fields):
+    cnt = 0
+    cnt_skipped = 0
+    with open(filename) as fp:
+        for line in fp:
+            cnt += 1
+            line = line.rstrip('\r\n')
+            if is_export_header(line):
+                cnt_skipped += 1
+                continue
+            fields = line.split(';')
+            # the column names or a broken line
+            if len(fields) < min_fields or len(fields[0]) == 0:
+                cnt_skipped += 1
+                continue
+            yield fields
+    logging.debug("Processed %d lines (%d skipped) from %s" % (cnt,cnt_skipped,filename))
+
+# Read the registrars export (id -> name)
+def read_registrars(filename):
+    registrars = {}
+    for fields in read_export_fields(filename,2):
+        registrars[fields[0]] = fields[1]
+    return registrars
+
+# Read the domains export and yield one record per domain
+def read_domain_records(filename):
+    for fields in read_export_fields(filename,3):
+        # not a domain name (column names)
+        if '.' not in fields[0]:
+            continue
+        # registrars and holders repeat across many domains, keep a single copy of each
+        yield DomainRecord(fields[0],intern(fields[1]),intern(fields[2]))
+
+# Feed all the records to the subscribed aggregators in a single pass
+def aggregate_records(records,aggregators):
+    cnt = 0
+    for record in records:
+        cnt += 1
+        for aggregator in aggregators:
+            aggregator.add(record)
+    return cnt
+
+# Date of the export from its filename (domains_YYYY-MM-DD.txt), today if there is none
+def export_date(filename):
+    match = re.search(r'(\d{4}-\d{2}-\d{2})', os.path.basename(filename))
+    if match:
+        return match.group(1)
+    return datetime.datetime.now().strftime("%Y-%m-%d")
+
+# Path of the snapshot for the date
+def snapshot_filename(path_snapshots,date):
+    return os.path.join(path_snapshots,'domains_'+date+'.snap')
+
+# Archived exports in the date range (date -> domains export, None if only the snapshot is kept)
+def archived_exports(path_domains,path_snapshots,date_from=None,date_to=None):
+    exports = {}
+    for filename in glob.glob(os.path.join(path_snapshots,'domains_*.snap')):
+        exports[export_date(filename)] = None
+    for filename in glob.glob(os.path.join(path_domains,'domains_*.txt')):
+        exports[export_date(filename)] = filename
+    for date in exports.keys():
+        if (date_from is not None and date < date_from) or (date_to is not None and date > date_to):
+            del exports[date]
+    return exports
+
+# Parse the export and write its snapshot
+@metrics.timed('sknic.snapshot')
+def create_snapshot(filename_domains,registrars,filename_snapshot,date):
+    builder = snapshot.SnapshotBuilder()
+    cnt = aggregate_records(read_domain_records(filename_domains),[builder])
+    logging.debug("Parsed %d domain records from %s" % (cnt,filename_domains))
+    metrics.count('sknic.records',cnt)
+    metrics.count('sknic.bytes_parsed',os.path.getsize(filename_domains))
+    builder.write(filename_snapshot,date,registrars)
+    logging.info("Wrote snapshot %s (%d domains, %d bytes)" % (filename_snapshot,cnt,os.path.getsize(filename_snapshot)))
@@ -0,0 +1,201 @@
+# Compact daily snapshot of the SK-NIC domains export
+#
+# A snapshot holds the sorted column of domains and, for every domain, the
+# index of its registrar and holder in the dictionaries of distinct values.
+# Every column is stored as a separate zlib compressed section, the file is
+# memory-mapped and only the sections needed by the query are decompressed.
+#
+#   magic (8 bytes) | header length (uint32 LE) | header (json) | sections
+#
+# The header contains the date, the number of domains and the position
+# (offset, length) of every section relative to the end of the header.
+import os
+import json
+import mmap
+import zlib
+import array
+import struct
+import sys
+
+magic = 'SKNICSN1'
+# record fields which are dictionary encoded
+fields = ('registrar', 'holder')
+# compression level of the sections
+compress_level = 6
+
+
+# Drop consecutive duplicates from a sorted iterable
+def unique_sorted(items):
+    previous = None
+    for item in items:
+        if item != previous:
+            yield item
+        previous = item
+
+# Linear merge of two sorted iterables, returns the (added, deleted, unchanged count)
+def diff_sorted(old_domains,new_domains):
+    added = []
+    deleted = []
+    unchanged = 0
+    old_iter = unique_sorted(old_domains)
+    new_iter = unique_sorted(new_domains)
+    old = next(old_iter,None)
+    new = next(new_iter,None)
+    while old is not None and new is not None:
+        if old == new:
+            unchanged += 1
+            old = next(old_iter,None)
+            new = next(new_iter,None)
+        elif old < new:
+            deleted.append(old)
+            old = next(old_iter,None)
+        else:
+            added.append(new)
+            new = next(new_iter,None)
+    while old is not None:
+        deleted.append(old)
+        old = next(old_iter,None)
+    while new is not None:
+        added.append(new)
+        new = next(new_iter,None)
+    return (added,deleted,unchanged)
+
+# The index arrays are stored little-endian
+def index_array(data=None):
+    values = array.array('I')
+    if data is not None:
+        values.fromstring(data)
+        if sys.byteorder != 'little':
+            values.byteswap()
+    return values
+
+def index_bytes(values):
+    if sys.byteorder != 'little':
+        values = array.array('I', values)
+        values.byteswap()
+    return values.tostring()
+
+
+# Aggregator which collects the records for the snapshot
+class SnapshotBuilder(object):
+
+    def __init__(self):
+        self.domains = []
+        self.values = dict((field, []) for field in fields)
+        self.lookup = dict((field, {}) for field in fields)
+        self.index = dict((field, index_array()) for field in fields)
+
+    def add(self,record):
+        self.domains.append(record.domain)
+        for field in fields:
+            value = getattr(record,field)
+            lookup = self.lookup[field]
+            if value not in lookup:
+                lookup[value] = len(self.values[field])
+                self.values[field].append(value)
+            self.index[field].append(lookup[value])
+
+    # Write the snapshot (registrar_names is the id -> name table of the registrars export)
+    def write(self,filename,date,registrar_names=None):
+        order = sorted(xrange(len(self.domains)), key=self.domains.__getitem__)
+        sections = [('domains', '\n'.join(self.domains[i] for i in order))]
+        for field in fields:
+            index = self.index[field]
+            sections.append((field+'_values', '\n'.join(self.values[field])))
+            sections.append((field+'_index', index_bytes(array.array('I', (index[i] for i in order)))))
+        sections.append(('registrar_names', json.dumps(registrar_names or {})))
+
+        header = {'version':1, 'date':date, 'count':len(self.domains), 'sections':{}}
+        blobs = []
+        offset = 0
+        for name, data in sections:
+            blob = zlib.compress(data,compress_level)
+            header['sections'][name] = [offset, len(blob)]
+            blobs.append(blob)
+            offset += len(blob)
+        header = json.dumps(header, sort_keys=True)
+
+        with open(filename+'.tmp', 'wb') as outfile:
+            outfile.write(magic)
+            outfile.write(struct.pack('<I', len(header)))
+            outfile.write(header)
+            for blob in blobs:
+                outfile.write(blob)
+        os.rename(filename+'.tmp',filename)
+
+
+# Read-only access to a snapshot file
+class Snapshot(object):
+
+    def __init__(self,filename):
+        self.filename = filename
+        with open(filename, 'rb') as fp:
+            self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(magic)] != magic:
+            raise ValueError("Not a snapshot file: %s" % filename)
+        header_length = struct.unpack('<I', self.data[len(magic):len(magic)+4])[0]
+        self.start = len(magic) + 4 + header_length
+        self.header = json.loads(self.data[len(magic)+4:self.start])
+        self.date = self.header['date']
+        self.count = self.header['count']
+        self.cache = {}
+
+    def close(self):
+        self.data.close()
+
+    def section(self,name):
+        offset, length = self.header['sections'][name]
+        return zlib.decompress(self.data[self.start+offset:self.start+offset+length])
+
+    def cached(self,name,load):
+        if name not in self.cache:
+            self.cache[name] = load()
+        return self.cache[name]
+
+    # Sorted list of domains
+    def domains(self):
+        def load():
+            data = self.section('domains')
+            return data.split('\n') if data else []
+        return self.cached('domains',load)
+
+    # Distinct values of the field (registrar/holder)
+    def values(self,field):
+        def load():
+            data = self.section(field+'_values')
+            return data.split('\n') if data else []
+        return self.cached(field+'_values',load)
+
+    # Index of the field value for every domain (same order as domains)
+    def index(self,field):
+        return self.cached(field+'_index',lambda: index_array(self.section(field+'_index')))
+
+    def registrar_names(self):
+        return self.cached('registrar_names',lambda: json.loads(self.section('registrar_names')))
+
+    # Count of domains per field value
+    def counts(self,field):
+        counts = [0] * len(self.values(field))
+        for i in self.index(field):
+            counts[i] += 1
+        return dict(zip(self.values(field),counts))
+
+    # List of domains per field value (domains sorted)
+    def domains_by(self,field):
+        values = self.values(field)
+        groups = [[] for _ in values]
+        for domain, i in zip(self.domains(),self.index(field)):
+            groups[i].append(domain)
+        return dict(zip(values,groups))
+
+    # The records in the domains order (domain, registrar, holder)
+    def records(self):
+        registrars = self.values('registrar')
+        holders = self.values('holder')
+        for domain, registrar, holder in zip(self.domains(),self.index('registrar'),self.index('holder')):
+            yield (domain,registrars[registrar],holders[holder])
+
+
+# Diff of two snapshots, returns the (added, deleted, unchanged count)
+def diff_snapshots(old,new):
+    return diff_sorted(old.domains(),new.domains())
@@ -0,0 +1,208 @@
+# Append-only store for the trends datasets
+#
+# Every trends dataset is published as a single JSON file {key: [entry, entry, ...]}.
+# The history is kept in a JSON Lines file under raw (one entry per line, not
+# published), so adding the daily entry is a plain append:
+#
+#   <basedir>/trends/<dataset>/<name>.json -> <basedir>/raw/trends/<dataset>/<name>.jsonl
+#
+# The published JSON is patched in place by rewriting only its closing brackets, it is rebuilt from the
+# store only when the patch is not possible.
+# With a publish batch the new store line and the patched end of the published
+# file are staged as appends (the files are not copied) and written together
+# with the other outputs of the run.
+import os
+import re
+import json
+import logging
+import operator
+import collections
+
+# Indentation used by the published trends files
+trends_indent = 4
+# Closing of a non-empty / empty list in the published trends files
+trends_tail = '\n' + ' ' * trends_indent + ']\n}'
+trends_tail_empty = '[]\n}'
+# The list key on the first lines of the published trends file
+trends_key_re = re.compile(r'^\{\s*"((?:[^"\\]|\\.)*)"\s*:\s*\[')
+
+
+# Path of the store file for the published trends file (under raw, out of the published datasets)
+def store_filename(trends_file):
+    directory, name = os.path.split(os.path.abspath(trends_file))
+    path_trends, dataset = os.path.split(directory)
+    basedir, trends_dir = os.path.split(path_trends)
+    return os.path.join(basedir,'raw',trends_dir,dataset,os.path.splitext(name)[0] + '.jsonl')
+
+# Path of the store file of the older versions (next to the published file)
+def legacy_store_filename(trends_file):
+    return os.path.splitext(trends_file)[0] + '.jsonl'
+
+# The store file of the trends, the directory is created and the store of the older versions is moved there
+def prepare_store(trends_file):
+    store_file = store_filename(trends_file)
+    if not os.path.isdir(os.path.dirname(store_file)):
+        os.makedirs(os.path.dirname(store_file))
+    legacy_file = legacy_store_filename(trends_file)
+    if not os.path.isfile(store_file) and os.path.isfile(legacy_file):
+        os.rename(legacy_file,store_file)
+        logging.info("Moved the trends store %s to %s" % (legacy_file,store_file))
+    return store_file
+
+# Read the entries from the store
+def read_entries(store_file):
+    with open(store_file) as fp:
+        for line in fp:
+            line = line.strip()
+            if len(line) != 0:
+                yield json.loads(line)
+
+# Append a single entry to the store
+def append_entry(store_file,entry):
+    with open(store_file, 'a') as fp:
+        fp.write(json.dumps(entry) + '\n')
+
+# Get the list key of the published trends file without loading the whole file
+def trends_key(trends_file):
+    with open(trends_file) as fp:
+        head = fp.read(1024)
+    match = trends_key_re.match(head)
+    if not match:
+        return None
+    return json.loads('"%s"' % match.group(1))
+
+# Create the store from the published trends file (one-time import)
+def import_trends(trends_file,store_file):
+    with open(trends_file) as json_file:
+        data_trends = json.load(json_file)
+    entries = data_trends[data_trends.keys()[0]]
+    with open(store_file, 'w') as fp:
+        for entry in entries:
+            fp.write(json.dumps(entry) + '\n')
+    logging.info("Imported %d trends entries from %s to %s" % (len(entries),trends_file,store_file))
+    return len(entries)
+
+# Materialize the published trends file from the store
+def export_trends(store_file,trends_file,dict_key,batch=None):
+    data_trends = {dict_key:list(read_entries(store_file))}
+    with (batch.open(trends_file) if batch else open(trends_file, 'w')) as outfile:
+        json.dump(data_trends, outfile, indent=trends_indent)
+    logging.debug("Exported %d trends entries from %s to %s" % (len(data_trends[dict_key]),store_file,trends_file))
+
+# Format a single entry exactly like json.dump would inside the published list
+def format_entry(entry):
+    dumped = json.dumps({'_':[entry]}, indent=trends_indent)
+    return dumped[dumped.index('[\n')+2:-len(trends_tail)]
+
+# Separator between two list items as written by json.dump (', ' on python 2)
+def item_separator():
+    dumped = json.dumps([0,0], indent=1)
+    return dumped[dumped.index('0')+1:dumped.index('\n',dumped.index('0'))]
+
+# The patch appending the entry to the published trends file: (offset, data), None if the file has an unexpected format
+def trends_patch(trends_file,entry):
+    with open(trends_file, 'rb') as fp:
+        fp.seek(0, os.SEEK_END)
+        size = fp.tell()
+        fp.seek(max(0,size-64))
+        tail = fp.read()
+    if tail.endswith(trends_tail):
+        return (size - len(trends_tail),item_separator() + '\n' + format_entry(entry) + trends_tail)
+    if tail.endswith(trends_tail_empty):
+        return (size - len(trends_tail_empty) + 1,'\n' + format_entry(entry) + trends_tail)
+    return None
+
+# Append the entry to the published trends file by patching its end, returns False if the file has an unexpected format
+def append_trends_json(trends_file,entry):
+    patch = trends_patch(trends_file,entry)
+    if patch is None:
+        return False
+    position, data = patch
+    with open(trends_file, 'r+b') as fp:
+        fp.seek(position)
+        fp.truncate()
+        fp.write(data)
+    return True
+
+# Append the entry to the trends (store + published file), staged in the batch if there is one
+def append_trends(trends_file,entry,dict_key=None,batch=None):
+    store_file = prepare_store(trends_file)
+    current_trends = batch.path(trends_file) if batch is not None else trends_file
+    has_store = os.path.isfile(batch.path(store_file) if batch is not None else store_file)
+    has_trends = os.path.isfile(current_trends)
+    if has_trends:
+        if dict_key is None:
+            dict_key = trends_key(current_trends)
+        # first run with the store, import the history from the published file
+        if not has_store:
+            import_trends(current_trends,batch.stage(store_file) if batch is not None else store_file)
+    elif dict_key is None:
+        raise IOError("Trends file %s is missing" % trends_file)
+    elif batch is None:
+        # no trends yet, start with an empty history
+        open(store_file, 'a').close()
+
+    if batch is not None:
+        batch.append(store_file,json.dumps(entry) + '\n')
+    else:
+        append_entry(store_file,entry)
+
+    patched = False
+    if has_trends:
+        if batch is not None:
+            patch = trends_patch(current_trends,entry)
+            if patch is not None:
+                batch.append(trends_file,patch[1],patch[0])
+                patched = True
+        else:
+            patched = append_trends_json(trends_file,entry)
+    if not patched:
+        if dict_key is None:
+            raise ValueError("Unable to get the trends key from %s" % trends_file)
+        logging.info("Rebuilding %s from %s" % (trends_file,store_file))
+        export_trends(batch.path(store_file) if batch is not None else store_file,trends_file,dict_key,batch)
+
+# Replace the entries with the same dates (or add them), the store and the published file are rewritten in date order
+def replace_entries(trends_file,entries,dict_key=None,batch=None):
+    store_file = prepare_store(trends_file)
+    current_trends = batch.path(trends_file) if batch is not None else trends_file
+    if os.path.isfile(current_trends):
+        if dict_key is None:
+            dict_key = trends_key(current_trends)
+        if not os.path.isfile(batch.path(store_file) if batch is not None else store_file):
+            # the import is a part of the batch, an aborted run leaves no store behind
+            import_trends(current_trends,batch.stage(store_file) if batch is not None else store_file)
+    elif dict_key is None:
+        raise IOError("Trends file %s is missing" % trends_file)
+    if dict_key is None:
+        raise ValueError("Unable to get the trends key from %s" % trends_file)
+
+    dates = set(entry['date'] for entry in entries)
+    kept = []
+    source = batch.path(store_file) if batch is not None else store_file
+    if os.path.isfile(source):
+        kept = [entry for entry in read_entries(source) if entry.get('date') not in dates]
+    # stable sort, the entries of the same date keep their order
+    merged = sorted(kept + list(entries), key=lambda entry: entry.get('date'))
+
+    if batch is not None:
+        fp = batch.open(store_file)
+    else:
+        fp = open(store_file + '.tmp', 'w')
+    with fp:
+        for entry in merged:
+            fp.write(json.dumps(entry) + '\n')
+    if batch is not None:
+        store_file = batch.path(store_file)
+    else:
+        os.rename(store_file + '.tmp', store_file)
+    export_trends(store_file,trends_file,dict_key,batch)
+    logging.info("Replaced %d trends entries in %s (%d kept)" % (len(entries),trends_file,len(kept)))
+    return len(merged)
+
+# Top10 items by value
+def get_top10(data_stats):
+    # create an ordered list DESC by VALUE
+    data_stats = collections.OrderedDict(sorted(data_stats.items(), reverse=True, key=operator.itemgetter(1)))
+    # get only the Top10
+    return dict(data_stats.items()[:10])
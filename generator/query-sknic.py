@@ -0,0 +1,102 @@
+#! /usr/bin/env python
+import os
+import json
+import logging
+from optparse import OptionParser
+from osintlib import common
+from osintlib import sknic
+from osintlib import snapshot
+from osintlib import history
+
+config = common.load_config()
+
+# populate variables with values from config
+path_basedir = config["path"]["basedir"]
+path_logdir = config["path"]["logdir"]
+file_log = os.path.join(path_logdir,"updates.log")
+# archived SK-NIC exports and their snapshots
+path_raw = os.path.join(path_basedir,"raw","domain")
+path_raw_domains = os.path.join(path_raw,"domains")
+path_raw_registrars = os.path.join(path_raw,"registrars")
+path_raw_snapshots = os.path.join(path_raw,"snapshots")
+# index of the history
+file_history = os.path.join(path_raw,"history.sqlite")
+
+
+# Snapshot of the date, created from the archived export if missing
+def get_snapshot(date,filename_domains):
+    filename_snapshot = sknic.snapshot_filename(path_raw_snapshots,date)
+    if not os.path.isfile(filename_snapshot):
+        filename_registrars = os.path.join(path_raw_registrars,'registrars_'+date+'.txt')
+        registrars = {}
+        if os.path.isfile(filename_registrars):
+            registrars = sknic.read_registrars(filename_registrars)
+        if not os.path.isdir(path_raw_snapshots):
+            os.makedirs(path_raw_snapshots)
+        sknic.create_snapshot(filename_domains,registrars,filename_snapshot,date)
+    return snapshot.Snapshot(filename_snapshot)
+
+# Import the exports which are newer than the last import
+def import_history(rebuild=False):
+    index = history.History(file_history)
+    if rebuild:
+        index.reset()
+    last = index.last_import()
+    exports = sknic.archived_exports(path_raw_domains,path_raw_snapshots)
+    imported = set(index.imported_dates())
+    skipped = [date for date in exports if last is not None and date <= last and date not in imported]
+    if skipped:
+        print("[!] %d exports older than the last import %s are not in the index, use --rebuild to include them" % (len(skipped),last))
+    previous = None
+    if last is not None:
+        previous = snapshot.Snapshot(sknic.snapshot_filename(path_raw_snapshots,last))
+    cnt = 0
+    for date in sorted(exports):
+        if last is not None and date <= last:
+            continue
+        snap = get_snapshot(date,exports[date])
+        index.import_snapshot(snap,previous)
+        if previous is not None:
+            previous.close()
+        previous = snap
+        cnt += 1
+    if previous is not None:
+        previous.close()
+    index.close()
+    return cnt
+
+
+def main(argv=None):
+    usage = "usage: %prog [options] "
+    parser = OptionParser(usage)
+    parser.add_option("-i", "--import", action="store_true", dest="update",help="Import the new archived exports to the index")
+    parser.add_option("--rebuild", action="store_true", dest="rebuild",help="Rebuild the index from all the archived exports")
+    parser.add_option("--domain", dest="domain", help="Registration history of the DOMAIN", metavar="DOMAIN")
+    parser.add_option("--holder", dest="holder", help="Domains gained and lost by the HOLDER (id)", metavar="HOLDER")
+    parser.add_option("--registrar", dest="registrar", help="Domains count history of the REGISTRAR (id or name)", metavar="REGISTRAR")
+    parser.add_option("-d", "--debug", action="store_true", dest="debugmode",help="Enable DEBUG logging")
+    # Parse arguments
+    (options, _) = parser.parse_args(argv)
+
+    # create logger
+    common.setup_logging(file_log,'sknic-query',options.debugmode)
+
+    if options.update or options.rebuild:
+        cnt = import_history(options.rebuild)
+        print("Imported %d exports to %s" % (cnt,file_history))
+
+    if options.domain or options.holder or options.registrar:
+        if not os.path.isfile(file_history):
+            print("[!] No index found, run with --import first")
+            exit(2)
+        index = history.History(file_history)
+        if options.domain:
+            print(json.dumps({'domain':options.domain,'history':index.domain(options.domain.lower())}, indent=4))
+        if options.holder:
+            print(json.dumps({'holder':options.holder,'history':index.holder(options.holder)}, indent=4))
+        if options.registrar:
+            print(json.dumps({'registrar':options.registrar,'history':index.registrar(options.registrar)}, indent=4))
+        index.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+#! /usr/bin/env python
+# Daily update of all the datasets in one process (replaces the crontab-update-*.sh pipelines)
+#
+#   resolvers ---\
+#                 +--> resolved
+#   sknic -------/
+#   shodan (independent)
+#
+# The stages run in parallel where the dependencies allow it, the changes of
+# all the stages are committed to git at once and one notification is sent.
+import os
+import json
+import time
+import urllib2
+import logging
+import subprocess
+from optparse import OptionParser
+from osintlib import common
+from osintlib import publish
+from osintlib import pipeline
+from osintlib import metrics
+import osint
+
+config = common.load_config()
+
+# populate variables with values from config
+path_basedir = config["path"]["basedir"]
+path_logdir = config["path"]["logdir"]
+path_keychain = config["path"].get("keychain")
+signal_src = config.get("signal",{}).get("src")
+signal_dst = config.get("signal",{}).get("dst")
+file_log = os.path.join(path_logdir,"updates.log")
+# run metrics (one summary per cycle)
+path_metrics = os.path.join(path_logdir,"metrics")
+# Source of the open resolvers in SK
+url_resolvers = "https://public-dns.info/nameserver/sk.json"
+# binaries
+bin_git = "/usr/bin/git"
+bin_signal = "/usr/local/bin/signal-cli"
+# stages (name, dependencies), in the order of the dependencies
+stages = [
+    ('resolvers', []),
+    ('sknic', []),
+    ('shodan', []),
+    ('resolved', ['resolvers','sknic']),
+]
+
+
+# Run the main() of a generator script with the arguments, exit() of the script is an error unless the code is 0
+def run_script(command,argv):
+    script = osint.load_command(command)
+    try:
+        script.main(argv)
+    except SystemExit, e:
+        if e.code not in (None,0):
+            raise RuntimeError("%s %s exited with %s" % (command," ".join(argv),e.code))
+
+# Download the list of the open resolvers (replaces the curl | jq pipeline)
+def stage_resolvers(testmode):
+    resolved = osint.load_command('resolved')
+    response = urllib2.urlopen(url_resolvers, timeout=60)
+    resolvers = [entry['ip'] for entry in json.load(response)]
+    if len(resolvers) == 0:
+        raise ValueError("No resolvers in %s" % url_resolvers)
+    if testmode:
+        return "%d resolvers" % len(resolvers)
+    batch = publish.Batch(resolved.path_raw_publish_journal)
+    try:
+        with batch.open(resolved.path_actual_resolvers) as f:
+            f.write(''.join(resolver+'\n' for resolver in resolvers))
+        batch.commit()
+    finally:
+        batch.abort()
+    return "%d resolvers" % len(resolvers)
+
+# Download the SK-NIC exports, update the stats and the trends
+#  the test mode does not download, it runs on the latest downloaded exports
+def stage_sknic(testmode):
+    sknic = osint.load_command('sknic')
+    if testmode:
+        status = sknic.latest_source_data()
+        failed = [name for name in sorted(status) if status[name]['file'] is None]
+        if failed:
+            raise RuntimeError("No downloaded %s export (the test mode does not download)" % " and ".join(failed))
+    else:
+        sknic.create_dirs()
+        status = sknic.download_source_data()
+        failed = [name for name in sorted(status) if status[name]['file'] is None]
+        if failed:
+            raise RuntimeError("Download of the %s export failed" % " and ".join(failed))
+    argv = ['-a','-u','-f',status['domains']['file'],'-r',status['registrars']['file']]
+    run_script('sknic',argv + (['-t'] if testmode else []))
+    return "domains %s, registrars %s" % (status['domains']['size'],status['registrars']['size'])
+
+def stage_resolved(testmode):
+    run_script('resolved',['-a','-u'] + (['-t'] if testmode else []))
+
+def stage_shodan(testmode):
+    run_script('shodan',['-a','-u'] + (['-t'] if testmode else []))
+
+# Commit and push the changed datasets, the new files are added first (git commit -a does not add them), returns (ok, output)
+def git_commit(message,new_files=()):
+    new_files = [os.path.relpath(filename,path_basedir) for filename in new_files if os.path.isfile(filename)]
+    if new_files:
+        process = subprocess.Popen([bin_git,'add','--'] + new_files, cwd=path_basedir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = process.communicate()[0]
+        if process.returncode != 0:
+            return (False, output)
+    command = '%s commit -a -m "$1" && %s push' % (bin_git,bin_git)
+    if path_keychain:
+        # ssh agent of the keychain for the push
+        command = '. "$2" && ' + command
+    process = subprocess.Popen(['/bin/sh','-c',command,'git-commit',message,path_keychain or ''], cwd=path_basedir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.communicate()[0]
+    return (process.returncode == 0, output)
+
+# Send the report with signal
+def notify(message):
+    if not signal_src or not signal_dst:
+        logging.warning("No signal config, notification not sent")
+        return False
+    process = subprocess.Popen([bin_signal,'-u',signal_src,'send',signal_dst], stdin=subprocess.PIPE)
+    process.communicate(message)
+    return process.returncode == 0
+
+# Text of the notification
+def format_report(date,results,seconds,git_result=None):
+    lines = ["[update-all] %s" % date]
+    for name, result in results.items():
+        line = "%s: %s (%.1f s)" % (name,result['status'],result['seconds'])
+        if result['result']:
+            line += " - %s" % result['result']
+        lines.append(line)
+    if git_result is not None:
+        lines.append("git-commit: %s" % ("OK" if git_result[0] else "FAILED"))
+    lines.append("total: %.1f s" % seconds)
+    if git_result is not None and git_result[1]:
+        lines.append("")
+        lines.append(git_result[1].strip())
+    return "\n".join(lines)
+
+# One update of all the datasets
+def run_cycle(selected,testmode,commit):
+    functions = {'resolvers':stage_resolvers,'sknic':stage_sknic,'resolved':stage_resolved,'shodan':stage_shodan}
+    date = common.date_today()
+    time_start = time.time()
+    # the stages which are not selected are considered done
+    plan = [(name,[dep for dep in deps if dep in selected],lambda function=functions[name]: function(testmode)) for name, deps in stages if name in selected]
+    results = pipeline.run_stages(plan)
+    git_result = None
+    if commit and not testmode:
+        new_files = osint.load_command('resolved').files_git_add if 'resolved' in selected else []
+        git_result = git_commit("factory-worker: auto-commit %s" % date,new_files)
+        logging.info("git commit + push: %s" % ("OK" if git_result[0] else "FAILED"))
+    report = format_report(date,results,time.time() - time_start,git_result)
+    print(report)
+    if commit and not testmode:
+        notify(report)
+    ok = all(result['status'] == pipeline.status_ok for result in results.values())
+    metrics.write_summary(path_metrics,'update-all',"OK" if ok else "FAILED")
+    metrics.reset()
+    return ok
+
+
+def main(argv=None):
+    usage = "usage: %prog [options] "
+    parser = OptionParser(usage)
+    parser.add_option("-t", "--test", action="store_true", dest="testmode",help="Test mode, no file modification (the stages run with -t, SK-NIC uses the last downloaded exports), no commit.")
+    parser.add_option("-s", "--stages", dest="stages", default=",".join(name for name, _ in stages), help="Stages to run (default: %default)", metavar="LIST")
+    parser.add_option("-n", "--no-commit", action="store_false", dest="commit", default=True, help="No git commit and no notification")
+    parser.add_option("-i", "--interval", type="float", dest="interval", help="Keep running, one cycle every HOURS", metavar="HOURS")
+    parser.add_option("-d", "--debug", action="store_true", dest="debugmode",help="Enable DEBUG logging")
+    (options, _) = parser.parse_args(argv)
+
+    selected = [name.strip() for name in options.stages.split(',') if name.strip()]
+    unknown = [name for name in selected if name not in dict(stages)]
+    if unknown:
+        print("[!] Unknown stages: %s" % ", ".join(unknown))
+        exit(2)
+
+    # the generators log to the same file, every line is tagged with the stage (thread) name
+    common.setup_logging(file_log,'update-all/%(threadName)s',options.debugmode)
+    logging.info('Update BEGIN.')
+
+    while True:
+        time_start = time.time()
+        ok = run_cycle(selected,options.testmode,options.commit)
+        if not options.interval:
+            break
+        wait = max(0, options.interval * 3600 - (time.time() - time_start))
+        logging.info("Next cycle in %.0f s" % wait)
+        time.sleep(wait)
+
+    logging.info('Update END.')
+    if not ok:
+        exit(1)
+
+if __name__ == '__main__':
+    main()
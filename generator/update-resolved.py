@@ -3,33 +3,34 @@ import os
 import time
 import json
 import logging
-import datetime
-import operator
-import collections
 from optparse import OptionParser
 from collections import defaultdict
 from itertools import islice
-import dns.resolver
+import glob
+import functools
 import subprocess
-import geoip2.database
+import threading
+import Queue
+from osintlib import common
+from osintlib import trends
+from osintlib import dnschain
+from osintlib import publish
+from osintlib import metrics
+from osintlib import hostmap
+from osintlib import jsonstream
+from osintlib import resolvedelta
+from osintlib import reputation
+# loaded on the first use, not needed for the trends update
+dns_resolver = common.lazy_import('dns.resolver')
+dns_exception = common.lazy_import('dns.exception')
+dnsengine = common.lazy_import('osintlib.dnsengine')
+geoip = common.lazy_import('osintlib.geoip')
+dnscache = common.lazy_import('osintlib.dnscache')
 
-# Path to global or local config file
-config_global = "/usr/local/etc/osint/config.json"
-config_local = os.path.expanduser("~/.osint.json")
 # Do we run in testmode?
 testmode = False
 
-if os.path.exists(config_global) and os.path.getsize(config_global) > 0:
-        with open(config_global) as json_file:
-                config = json.load(json_file)
-else:
-        if os.path.exists(config_local) and os.path.getsize(config_local) > 0:
-                with open(config_local) as json_file:
-                        config = json.load(json_file)
-        else:
-                print("No configuration file found in %s or %s" % (config_global,config_local))
-                exit(1)
-
+config = common.load_config()
 
 # populate variables with values from config
 path_basedir = config["path"]["basedir"]
@@ -43,79 +44,178 @@ path_trends = os.path.join(path_basedir,"trends","resolve")
 path_actual_resolvers = os.path.join(path_actual,"open-resolvers.txt")
 # source list of active SLDs
 path_actual_domains = os.path.join(path_basedir,"actual","domain","sk-domains.txt")
+# SLDs added since the last update of the list
+path_actual_domain_changes = os.path.join(path_basedir,"actual","domain","stats-domain-changes.json")
 # temp dir to store raw unprocessed data
 path_raw = os.path.join(path_basedir,"raw","resolve")
 filename_raw_resolvers = "working-resolvers.txt"
 filename_raw_domains = "domains-to-resolve.txt"
-filename_raw_domains_r2 = "domains-to-resolve-r2.txt"
-filename_raw_massdns_r1 = "massdns-resolved-r1.txt"
-filename_raw_massdns_r2 = "massdns-resolved-r2.txt"
+filename_raw_domains_round = "domains-to-resolve-r%d.txt" # round 2+ (CNAME targets)
+filename_raw_massdns_round = "massdns-resolved-r%d.txt" # round 1 (host -> A/CNAME), round 2+ (CNAME -> A/CNAME)
+filename_raw_chains = "cname-chains.txt"
+filename_raw_cache = "dns-cache.sqlite"
 path_raw_resolvers = os.path.join(path_raw,filename_raw_resolvers)
 path_raw_domains = os.path.join(path_raw,filename_raw_domains)
-path_raw_domains_r2 = os.path.join(path_raw,filename_raw_domains_r2)
-path_raw_massdns_r1 = os.path.join(path_raw,filename_raw_massdns_r1) # round 1 (host -> A/CNAME)
-path_raw_massdns_r2 = os.path.join(path_raw,filename_raw_massdns_r2) # round 2 (CNAME -> A)
+path_raw_chains = os.path.join(path_raw,filename_raw_chains)
+path_raw_cache = os.path.join(path_raw,filename_raw_cache)
+# reputation of the open resolvers (results of the checks of all the runs)
+path_raw_reputation = os.path.join(path_raw,"resolvers.sqlite")
+# run metrics (and the name of the run)
+path_metrics = os.path.join(path_logdir,"metrics")
+run_name = "resolve-update"
+# journal of the published files (crash recovery)
+path_raw_publish_journal = os.path.join(path_raw,"publish.journal")
 # files to store actual stats
 file_actual_resolved = os.path.join(path_actual,"sk-www-domains-resolved.json")
+# changes of the resolved hosts since the previous run, computed against the snapshot of the hosts
+file_actual_resolved_delta = os.path.join(path_actual,"sk-www-domains-resolved-delta.json")
+path_raw_snapshot = os.path.join(path_raw,"resolved-hosts.txt")
+# published files which may not be tracked by the git of the datasets yet (git commit -a does not add them)
+files_git_add = [file_actual_resolved_delta]
 file_trends_resolved_country = os.path.join(path_trends,"sk-resolved-country.json")
 file_trends_resolved_ip = os.path.join(path_trends,"sk-resolved-ip.json")
 # path to docker bin
 bin_docker = "/usr/bin/docker"
-
-
-# Today's date in YMD format
-def date_today():
-    return datetime.datetime.now().strftime("%Y-%m-%d")
-
-def test_resolver(resolver):
+# number of resolvers tested in parallel
+resolvers_test_workers = 32
+# port used when testing resolvers (a local stub server can be used for testing)
+resolvers_test_port = 53
+# public resolvers, checked and ranked like the open resolvers, used alone if no resolver works
+resolvers_public = ['8.8.8.8','8.8.4.4','1.1.1.1','1.0.0.1']
+# number of the best resolvers used for the resolution and their minimal success rate
+resolvers_max = 500
+resolvers_min_rate = 0.5
+# less than 1/N of the checked resolvers answered: the network of the host is down, the results are not recorded
+resolvers_outage_ratio = 100
+# resolution engines (massdns in docker or the native python engine)
+engines = ['massdns','native']
+
+
+# Check the resolver, returns the result (ok, wrong answer, timeout, error)
+def test_resolver(resolver,port=53):
     # Create our own resolver instance
-    my_resolver = dns.resolver.Resolver()
+    my_resolver = dns_resolver.Resolver(configure=False)
     my_resolver.timeout = 1
     my_resolver.lifetime = 1
     my_resolver.nameservers = [resolver]
+    my_resolver.port = port
     # Check if the resolver is working
     try:
         result = str(my_resolver.query('osint.sk', 'A')[0])
         if result == '91.210.182.151':
             #print("%s > %s > OK" % (resolver,result))
-            return True
+            return reputation.result_ok
         else:
             #print("%s > %s > NOK" % (resolver,result))
-            return False
-    except dns.exception.Timeout:
+            return reputation.result_wrong
+    except dns_exception.Timeout:
         #print("%s timeout." % resolver)
-        return False
-    return True
-
-# Generate all the stats and trends from downloaded files
-def create_resolvers_list(filename_resolvers_data,filename_resolvers_active):
+        return reputation.result_timeout
+    except dns_exception.DNSException:
+        # NXDOMAIN, SERVFAIL, empty answer, ...
+        return reputation.result_error
+
+# Test the resolver and measure the time of the check (in ms)
+def measure_resolver(resolver,port=53):
+    time_start = time.time()
+    result = test_resolver(resolver,port)
+    latency = (time.time() - time_start) * 1000
+    return (result,latency)
+
+# Test the resolvers using a bounded pool of worker threads, results are returned in the input order
+def test_resolvers(resolvers,workers=resolvers_test_workers,port=resolvers_test_port):
+    results = [None] * len(resolvers)
+    queue = Queue.Queue()
+    for index, resolver in enumerate(resolvers):
+        queue.put((index,resolver))
+
+    def worker():
+        while True:
+            try:
+                index, resolver = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[index] = measure_resolver(resolver,port)
+            except Exception, e:
+                logging.error("Unable to test resolver %s : %s" % (resolver,e))
+                results[index] = (reputation.result_error,0.0)
+
+    threads = [threading.Thread(target=worker) for _ in range(max(1,min(workers,len(resolvers))))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+# Create the list of the working resolvers, the best ones by the reputation
+#  the resolvers which failed recently are not checked again until their backoff expires
+@metrics.timed('resolved.test_resolvers')
+def create_resolvers_list(filename_resolvers_data,filename_resolvers_active,workers=resolvers_test_workers,max_resolvers=resolvers_max):
     # list of public resolvers
-    resolvers_list = ['8.8.8.8','8.8.4.4','1.1.1.1','1.0.0.1']
+    resolvers_candidates = list(resolvers_public)
     # load list of public resolvers
     with open(filename_resolvers_data) as fp:
         line = fp.readline().strip()
         cnt = 0
-        cnt_ok = 0
-        cnt_nok = 0
         while line:
             cnt += 1
-            # is it a working resolver
-            if '.' in line:
-                if test_resolver(line):
-                    cnt_ok += 1
-                    resolvers_list.append(line)
-                else:
-                    cnt_nok +=1
+            # is it a resolver address
+            if '.' in line and line not in resolvers_candidates:
+                resolvers_candidates.append(line)
             line = fp.readline().strip()
         logging.debug("Processed %d lines from %s" % (cnt,filename_resolvers_data))
 
-    print("Resolvers test (ok/nok/total): %d/%d/%d" % (cnt_ok,cnt_nok,cnt))
+    reputation_db = reputation.Reputation(path_raw_reputation)
+    try:
+        reputation_db.purge(resolvers_candidates)
+        # the public resolvers are always checked, the fallback must not wait for a backoff
+        resolvers_checked = reputation_db.due(resolvers_candidates,always=resolvers_public)
+        # is it a working resolver
+        time_start = time.time()
+        results = test_resolvers(resolvers_checked,workers)
+        counts = dict((result,0) for result in (reputation.result_ok,reputation.result_wrong,reputation.result_timeout,reputation.result_error))
+        latencies = []
+        working = []
+        for resolver, (result,latency) in zip(resolvers_checked,results):
+            logging.debug("Resolver %s : %s (%.1f ms)" % (resolver,result,latency))
+            counts[result] += 1
+            if result == reputation.result_ok:
+                latencies.append(latency)
+                working.append(resolver)
+        latencies.sort()
+        logging.info("Tested %d resolvers in %.1f s using %d workers (median latency of working resolvers: %.1f ms)" % 
+            (len(resolvers_checked),time.time()-time_start,workers,latencies[len(latencies)//2] if latencies else 0.0))
+        answered = counts[reputation.result_ok] + counts[reputation.result_wrong]
+        if resolvers_checked and answered * resolvers_outage_ratio < len(resolvers_checked):
+            # no answers at all, not a failure of the resolvers
+            logging.warning("Only %d of %d resolvers answered, network outage? The results are not recorded" % (answered,len(resolvers_checked)))
+        else:
+            reputation_db.record([(resolver,result,latency) for resolver, (result,latency) in zip(resolvers_checked,results)])
+        # the best of the working resolvers
+        ranking = [entry for entry in reputation_db.ranked(working) if entry[2] >= resolvers_min_rate]
+        resolvers_list = [entry[0] for entry in ranking[:max_resolvers]]
+        for resolver, resolver_score, rate, latency in ranking[:max_resolvers]:
+            logging.debug("Resolver %s selected: score %.3f, success rate %.2f, median latency %.1f ms" % (resolver,resolver_score,rate,latency or 0.0))
+    finally:
+        reputation_db.close()
+    if not resolvers_list:
+        logging.warning("No working resolvers, using the public resolvers")
+        resolvers_list = list(resolvers_public)
+
+    cnt_ok = counts[reputation.result_ok]
+    cnt_nok = len(resolvers_checked) - cnt_ok
+    print("Resolvers test (ok/nok/skipped/total): %d/%d/%d/%d, %d selected" % (cnt_ok,cnt_nok,len(resolvers_candidates)-len(resolvers_checked),len(resolvers_candidates),len(resolvers_list)))
+    counts.update({'nok':cnt_nok,'skipped':len(resolvers_candidates)-len(resolvers_checked),'selected':len(resolvers_list)})
+    metrics.count_all('resolved.resolvers',counts)
     # write to temporary list
     with open(filename_resolvers_active, 'w') as f:
         for resolver in resolvers_list:
             f.write("%s\n" % resolver)
 
-def create_domains_list(filename_domains_src,filename_domains_dst):
+# Create the list of hosts to resolve
+def create_domains_list(filename_domains_src):
     # list fo domains
     domains = []
     with open(filename_domains_src) as fp:
@@ -128,168 +228,271 @@ def create_domains_list(filename_domains_src,filename_domains_dst):
             line = fp.readline().strip()
         logging.debug("Processed %d lines from %s" % (cnt,filename_domains_src))
 
-    # write to temporary list
-    with open(filename_domains_dst, 'w') as f:
-        for domain in domains:
-            f.write("www.%s\n" % domain)
+    return ["www.%s" % domain for domain in domains]
 
-def run_massdns(file_resolvers, file_domains,file_output):
-    command = [ bin_docker, 'run', '-t', '--rm', '-v', 
+# Hosts of the SLDs added since the last update of the list
+def load_added_hosts(filename_domain_changes):
+    if not os.path.isfile(filename_domain_changes):
+        return []
+    with open(filename_domain_changes) as json_file:
+        changes = json.load(json_file)
+    return ["www.%s" % domain for domain in changes.get('added',[])]
+
+# The massdns command (docker), reads the names from stdin and writes the answers to stdout without the files
+def massdns_command(file_resolvers,file_domains=None,file_output=None):
+    command = [ bin_docker, 'run', '-t' if file_domains else '-i', '--rm', '-v', 
                 path_raw+':/data',  
                 'massdns', 
                 '-r', os.path.join("/data",file_resolvers), 
-                '-w', os.path.join("/data",file_output), 
                 '-c', '50',
                 '-t', 'A', 
-                '-o', 'S',
-                os.path.join("/data",file_domains)
+                '-o', 'F',
                 ]
+    if file_output:
+        command += ['-w', os.path.join("/data",file_output)]
+    else:
+        # every answer as it arrives
+        command += ['--flush']
+    if file_domains:
+        command.append(os.path.join("/data",file_domains))
+    return command
+
+@metrics.timed('resolved.massdns')
+def run_massdns(file_resolvers, file_domains,file_output):
+    command = massdns_command(file_resolvers,file_domains,file_output)
     logging.debug(command)
     # result = subprocess.check_output(command,shell=True)
     result = subprocess.Popen(command, stdout=subprocess.PIPE)
     out = result.stdout.read()
     # return result
     return out
-    
-def create_r2_inputfiles(output_r1,input_r2):
-    # list fo domains
-    domains = []
-    with open(output_r1) as fp:
-        line = fp.readline().strip()
-        cnt = 0
-        while line:
-            cnt += 1
-            if ' CNAME ' in line:
-                domains.append(line.split(' ')[2])
-            line = fp.readline().strip()
-        logging.debug("Processed %d lines from %s" % (cnt,output_r1))
 
-    # write to temporary list
-    with open(input_r2, 'w') as f:
-        for domain in domains:
-            f.write("%s\n" % domain)
-
-def import_results_file():
-    # final dictionary
-    resolved_dict = {}
-    resolved_dict = defaultdict(list)
-    # cname lookup table
-    cname_dict = {}
-    # populate data into the CNAME lookup table
-    with open(path_raw_massdns_r2) as rfp:
-        line = rfp.readline().strip()
-        while line:
-            line_fields = line.split(' ')
-            resolved_ip = line_fields[2]
-            resolved_host = line_fields[0][:-1]
-            cname_dict[resolved_host]= resolved_ip
-            # read next line
-            line = rfp.readline().strip()
-    # load round-1 results and lookup CNAMEs
-    with open(path_raw_massdns_r1) as rfp:
-        line = rfp.readline().strip()
-        while line:
-            line_fields = line.split(' ')
-            if ' A ' in line:
-                resolved_ip = line_fields[2]
-                resolved_host = line_fields[0][:-1] # strip the last dot '.sk.'
-                resolved_dict[resolved_ip].append(resolved_host)
-            # for aliases do a lookup in R2 table
-            if ' CNAME ' in line:
-                try:
-                    resolved_ip = cname_dict[line_fields[2][:-1]] # strip the last dot '.sk.'
-                except:
-                    resolved_ip = 'NX'
-                resolved_host = line_fields[0][:-1] # strip the last dot '.sk.'
-                resolved_dict[resolved_ip].append(resolved_host)
-            # read next line
-            line = rfp.readline().strip()
-
-    return resolved_dict
-
-def generate_actual():
-    resolved_dict_r1 = import_results_file() # result from r1
-    resolved_dict_r2 = {} # results grouped by country-code
-    resolved_dict_r2 = defaultdict(dict)
-    # prepare geoip reader
-    reader = geoip2.database.Reader(path_geoip)
-    for ip in resolved_dict_r1:
+# Resolve one round of names with massdns (through the raw files)
+def resolve_round_massdns(round_no,names,records):
+    if round_no == 1:
+        # the list of hosts is already written by resolve_domains
+        file_domains = filename_raw_domains
+    else:
+        file_domains = filename_raw_domains_round % round_no
+        with open(os.path.join(path_raw,file_domains), 'w') as f:
+            for name in names:
+                f.write("%s\n" % name)
+    file_output = filename_raw_massdns_round % round_no
+    result = run_massdns(filename_raw_resolvers,file_domains,file_output)
+    logging.debug(result)
+    dnschain.read_records(os.path.join(path_raw,file_output),records)
+
+# Resolve one round of names with massdns through pipes, the names are fed from a thread and the answers parsed as they arrive
+#  the raw files are written only with keep_raw
+@metrics.timed('resolved.massdns')
+def resolve_round_massdns_stream(round_no,names,records,keep_raw=False):
+    if keep_raw and round_no > 1:
+        with open(os.path.join(path_raw,filename_raw_domains_round % round_no), 'w') as f:
+            for name in names:
+                f.write("%s\n" % name)
+    command = massdns_command(filename_raw_resolvers)
+    logging.debug(command)
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def feed():
         try:
-            iso_code = reader.country(ip).country.iso_code
-        except:
-            iso_code = 'NX'
-        resolved_dict_r2[iso_code][ip] = resolved_dict_r1[ip]
-   
-    del(resolved_dict_r1) # R1 data are no longer needed
+            for name in names:
+                process.stdin.write("%s\n" % name)
+        except IOError, e:
+            # massdns exited, reported by its exit code
+            logging.debug("Feeding massdns stopped: %s" % e)
+        finally:
+            try:
+                process.stdin.close()
+            except IOError:
+                pass
+
+    feeder = threading.Thread(target=feed, name=threading.current_thread().name+'-massdns')
+    feeder.daemon = True
+    feeder.start()
+    raw = open(os.path.join(path_raw,filename_raw_massdns_round % round_no), 'w') if keep_raw else None
+    records.raw = raw
+    try:
+        # readline, the file iterator would wait for a full read-ahead buffer
+        for line in iter(process.stdout.readline, ''):
+            records.write(line)
+    finally:
+        records.raw = None
+        if raw is not None:
+            raw.close()
+        feeder.join()
+    if process.wait() != 0:
+        raise RuntimeError("massdns exited with %d in round %d" % (process.returncode,round_no))
+
+# Resolve one round of names with the native engine, the answers are parsed in memory (a copy goes to the raw file with keep_raw)
+def resolve_round_native(engine,round_no,names,records,keep_raw=True):
+    raw = open(os.path.join(path_raw,filename_raw_massdns_round % round_no), 'w') if keep_raw else None
+    records.raw = raw
+    try:
+        stats = engine.run(names,records)
+    finally:
+        records.raw = None
+        if raw is not None:
+            raw.close()
+    logging.debug("Queries (sent/received/timeouts/failed/resolved): %d/%d/%d/%d/%d" % (stats['sent'],stats['received'],stats['timeouts'],stats['failed'],stats['resolved']))
+    metrics.count_all('resolved.queries',stats)
+
+# Resolve the hosts and follow the CNAME chains using the selected engine
+#  stream: massdns through pipes, the raw files (hosts list, answers) are written only with keep_raw
+@metrics.timed('resolved.resolve')
+def resolve_domains(engine,hostnames,window=None,depth=dnschain.default_depth,stream=False,keep_raw=True,records=None):
+    keep_raw = keep_raw or not stream
+    # drop the results of the previous run
+    for filename in raw_results_files():
+        os.remove(filename)
+    # write the list of hosts (input of the round 1)
+    if keep_raw:
+        with open(path_raw_domains, 'w') as f:
+            for hostname in hostnames:
+                f.write("%s\n" % hostname)
+    if engine == 'native':
+        resolve_round = functools.partial(resolve_round_native,dnsengine.Engine(dnsengine.read_resolvers(path_raw_resolvers),window),keep_raw=keep_raw)
+    elif stream:
+        resolve_round = functools.partial(resolve_round_massdns_stream,keep_raw=keep_raw)
+    else:
+        resolve_round = resolve_round_massdns
+
+    def resolve_round_logged(round_no,names,records):
+        resolve_round(round_no,names,records)
+        logging.info('Resolve (%s) Round-%d finished.' % (engine,round_no))
+
+    metrics.count('resolved.hosts',len(hostnames))
+    return dnschain.resolve_chains(resolve_round_logged,hostnames,depth,records)
+
+# Group the resolved hosts (address, host, chain) by IP address, the CNAME chains are saved with keep_raw
+def group_results(resolved_hosts,keep_raw=True):
+    # final map (compact, the hosts are grouped by the addresses)
+    resolved_map = hostmap.HostMap()
+    f = open(path_raw_chains, 'w') if keep_raw else None
+    try:
+        def pairs():
+            for resolved_ip, resolved_host, chain in resolved_hosts:
+                if chain and f is not None:
+                    f.write("%s %s %s\n" % (resolved_host,' '.join(chain),resolved_ip))
+                yield (resolved_ip,resolved_host)
+        resolved_map.update(pairs())
+    finally:
+        if f is not None:
+            f.close()
+    return resolved_map
+
+@metrics.timed('resolved.import')
+def import_results(records,hostnames,depth=dnschain.default_depth,keep_raw=True):
+    return group_results(dnschain.resolved_hosts(records,hostnames,depth),keep_raw)
+
+# The raw massdns files of the last run
+def raw_results_files():
+    return sorted(glob.glob(os.path.join(path_raw,filename_raw_massdns_round.replace('%d','*'))))
+
+# The hosts resolved in the last run
+def raw_results_hosts():
+    with open(path_raw_domains) as fp:
+        return [line.strip() for line in fp if '.' in line]
+
+# Group the resolved hosts by IP address from the raw files of the last run
+@metrics.timed('resolved.import_file')
+def import_results_file(depth=dnschain.default_depth):
+    records = dnschain.Records()
+    for filename in raw_results_files():
+        dnschain.read_records(filename,records)
+    return import_results(records,raw_results_hosts(),depth)
+
+# Resolve only the hosts missing in the cache (or expired), the rest is answered from the cache
+def resolve_cached(engine,hostnames,window=None,depth=dnschain.default_depth,stream=False,keep_raw=True,records=None):
+    cache = dnscache.Cache(path_raw_cache)
+    try:
+        cache.purge(hostnames)
+        selected = cache.select(hostnames,load_added_hosts(path_actual_domain_changes))
+        metrics.count_all('resolved.cache',{'hits':len(hostnames)-len(selected),'misses':len(selected)})
+        if selected:
+            records = resolve_domains(engine,selected,window,depth,stream,keep_raw,records)
+            cache.update(records,selected,depth)
+            del(records)
+        return group_results(cache.resolved_hosts(hostnames),keep_raw)
+    finally:
+        cache.close()
+
+# Rebuild the cache entries of the hosts in the raw files of the last run
+def rebuild_cache(depth=dnschain.default_depth):
+    filenames = raw_results_files()
+    if not filenames:
+        print("[!] No raw results found in %s" % path_raw)
+        return
+    cache = dnscache.Cache(path_raw_cache)
+    try:
+        cache.rebuild(filenames,raw_results_hosts(),depth,int(max(os.path.getmtime(filename) for filename in filenames)))
+    finally:
+        cache.close()
+
+# Group the results by country, the reader may be already warmed up by the lookups during the resolution
+@metrics.timed('resolved.geoip')
+def generate_actual(resolved_map,reader=None):
+    # prepare geoip reader (cached by network)
+    if reader is None:
+        reader = geoip.CountryLookup(path_geoip)
+    # the addresses are assigned to the countries in place (by index)
+    resolved_map.set_countries(reader.country)
     reader.close() # close geoip db
-    return resolved_dict_r2
+    logging.info("GeoIP lookups (hits/misses/errors/networks): %(hits)d/%(misses)d/%(errors)d/%(networks)d" % reader.stats())
+    metrics.count_all('resolved.geoip',reader.stats())
+    return resolved_map
 
 
 # Save actual stats to json files (sorted)
-def save_actual(json_file,json_data):
-
-        for country in json_data:
-            for ip in json_data[country]:
-                json_data[country][ip].sort()
-
-        with open(json_file, 'w') as outfile:
-                json.dump(json_data, outfile, indent=4, sort_keys=True) 
-
-
-def dict_stats(dict):
-    country = len(dict)
-    ips = 0
-    hosts = 0
-    for iso in dict:
-        ips += len(dict[iso])
-        for ip in dict[iso]:
-            hosts += len(dict[iso][ip])
-    return (country,ips,hosts)
-
-def get_top10(data_stats):
-    # create an ordered list DESC by VALUE
-    data_stats = collections.OrderedDict(sorted(data_stats.items(), reverse=True, key=operator.itemgetter(1)))
-    # get only the Top10
-    data_stats = dict(data_stats.items()[:10])
-    return data_stats
-
-def generate_trends(actual_dict):
+@metrics.timed('resolved.save')
+def save_actual(json_file,resolved_map,batch):
+
+        with batch.open(json_file, 'w', jsonstream.buffer_size) as outfile:
+                resolved_map.write(outfile)
+
+# Save the changes since the previous run and the snapshot of the hosts for the next one (streaming merge)
+@metrics.timed('resolved.delta')
+def save_delta(delta_file,resolved_map,batch):
+        previous_file = batch.path(path_raw_snapshot)
+        previous = iter([])
+        previous_date = None
+        if os.path.isfile(previous_file):
+                previous_date = resolvedelta.read_date(previous_file)
+                previous = resolvedelta.read_snapshot(previous_file)
+        else:
+                logging.warning("No previous snapshot %s, all the hosts are new" % path_raw_snapshot)
+        date = common.date_today()
+        with batch.open(path_raw_snapshot, 'w', jsonstream.buffer_size) as snapshot_file:
+                delta = resolvedelta.merge(previous,resolved_map.host_addresses(),snapshot_file,date)
+        delta['date'] = date
+        delta['previous'] = previous_date
+        metrics.count_all('resolved.delta',dict((key,len(value) if isinstance(value, list) else value) for key, value in delta.items() if key in ('appeared','disappeared','moved','country','unchanged')))
+        jsonstream.dump_file(delta,delta_file,compact=True,sort_keys=True,batch=batch)
+        return delta
+
+
+def dict_stats(resolved_map):
+    return resolved_map.stats()
+
+def generate_trends(resolved_map):
     trends_country = {}
     trends_ip = {}
-    for country in actual_dict:
-        trends_country[country] = len(actual_dict[country])
-        for ip in actual_dict[country]:
-            trends_ip[ip] = len(actual_dict[country][ip])
-    return (get_top10(trends_country),get_top10(trends_ip))
-
-# If there are no trends data create a dummy file
-def dummy_trends_file(trends_file,dict_key):
-    data = {dict_key:[]}
-    with open(trends_file, 'w+') as outfile:
-        json.dump(data, outfile, indent=4)
-    outfile.close()
-
-def save_trends(trends_file,data_stats,dict_key):
-    # make dummy if file not found
-    if not os.path.isfile(trends_file):
-        dummy_trends_file(trends_file,dict_key)
-
-    # read actual trends
-    with open(trends_file) as json_file:
-            data_trends = json.load(json_file)
-
-    data_stats["date"]= date_today()
+    for country in resolved_map.countries:
+        trends_country[country] = len(resolved_map.countries[country])
+        for group in resolved_map.countries[country]:
+            trends_ip[resolved_map.address(group)] = resolved_map.group_size(group)
+    return (trends.get_top10(trends_country),trends.get_top10(trends_ip))
+
+@metrics.timed('resolved.trends')
+def save_trends(trends_file,data_stats,dict_key,batch):
+    data_stats["date"]= common.date_today()
     # append last stats to trends
-    data_trends[data_trends.keys()[0]].append(data_stats)
-   
-    # print(data_trends)
-    with open(trends_file, 'w') as outfile:
-            json.dump(data_trends, outfile, indent=4)
+    trends.append_trends(trends_file,data_stats,dict_key,batch)
 
 
 
 
-def main():
+def main(argv=None):
     global testmode
 
     usage = "usage: %prog [options] "
@@ -298,14 +501,20 @@ def main():
     parser.add_option("-a", "--actual", action="store_true", dest="actual",help="Update actual stats")
     parser.add_option("-u", "--update", action="store_true", dest="update",help="Update trends")
     parser.add_option("-d", "--debug", action="store_true", dest="debugmode",help="Enable DEBUG logging")
+    parser.add_option("-e", "--engine", type="choice", choices=engines, dest="engine", default="massdns", help="DNS resolution engine: %s (default: %%default)" % "/".join(engines))
+    parser.add_option("--cname-depth", type="int", dest="depth", default=dnschain.default_depth, help="Number of CNAME hops to follow (default: %default)")
+    parser.add_option("--window", type="int", dest="window", help="Queries in flight for the native engine (default: 1000)")
+    parser.add_option("-c", "--cache", action="store_true", dest="cache", help="Resolve only the hosts which are not in the DNS cache (or expired)")
+    parser.add_option("--rebuild-cache", action="store_true", dest="rebuild_cache", help="Rebuild the DNS cache entries of the hosts in the raw results of the last run (the other entries are kept)")
+    parser.add_option("-s", "--stream", action="store_true", dest="stream", help="Pipe the hosts to massdns and parse the answers as they arrive, no raw files")
+    parser.add_option("--keep-raw", action="store_true", dest="keep_raw", help="Write the CNAME chains and with --stream the raw files anyway (debug)")
+    parser.add_option("--max-resolvers", type="int", dest="max_resolvers", default=resolvers_max, help="Number of the best working resolvers used for the resolution (default: %default)")
+    parser.add_option("-w", "--workers", type="int", dest="workers", default=resolvers_test_workers, help="Number of resolvers tested in parallel (default: %default)")
     # Parse arguments
-    (options, _) = parser.parse_args()
+    (options, _) = parser.parse_args(argv)
 
     # create logger
-    if options.debugmode:
-            logging.basicConfig(filename=file_log,level=logging.DEBUG,format='%(asctime)s - resolve-update - %(levelname)s - %(message)s')
-    else:
-            logging.basicConfig(filename=file_log,level=logging.INFO,format='%(asctime)s - resolve-update - %(levelname)s - %(message)s')
+    common.setup_logging(file_log,'resolve-update',options.debugmode)
     logging.info('Update BEGIN.')
     
 
@@ -314,46 +523,57 @@ def main():
             print("Running in TESTMODE")
             logging.info("Running in TESTMODE")
 
-    if options.actual:
-        # prepare resolvers list
-        create_resolvers_list(path_actual_resolvers,path_raw_resolvers)
-        create_domains_list(path_actual_domains, path_raw_domains)
-        logging.info('Finished processing of input files.')
-        result = run_massdns(filename_raw_resolvers,filename_raw_domains,filename_raw_massdns_r1)
-        logging.info('Massdns Round-1 finished.')
-        logging.debug(result)
-        ##print(result) #debug
-
-        # Prepare Round-2
-        create_r2_inputfiles(path_raw_massdns_r1,path_raw_domains_r2)
-        # Run Phase-2
-        result = run_massdns(filename_raw_resolvers,filename_raw_domains_r2,filename_raw_massdns_r2)
-        logging.info('Massdns Round-2 finished.')
-        logging.debug(result)
-        ##print(result) #debug
-
-        # Process combined results from both rounds
-        actual_dict = generate_actual()
-        ##print(actual_dict) # debug
-        # update actual stats
-        if not testmode:
-            save_actual(file_actual_resolved,actual_dict)
-        else:
-            print("Actual stats [country/ip/hosts]: %d/%d/%d" % dict_stats(actual_dict)) 
-
-    if options.update:
-        # get actual trends
-        trends_country,trends_ip = generate_trends(actual_dict)
-        if not testmode:
-            save_trends(file_trends_resolved_country,trends_country,"resolved_by_country")
-            save_trends(file_trends_resolved_ip,trends_ip,"resolved_by_ip")
-        else:
-            print(trends_country)
-            print(trends_ip)
+    if options.rebuild_cache:
+        rebuild_cache(options.depth)
+
+    # all the outputs of the run are published at once
+    batch = publish.Batch(path_raw_publish_journal)
+    try:
+        if options.actual:
+            # prepare resolvers list
+            create_resolvers_list(path_actual_resolvers,path_raw_resolvers,options.workers,options.max_resolvers)
+            hostnames = create_domains_list(path_actual_domains)
+            logging.info('Finished processing of input files.')
+            reader = None
+            records = None
+            if options.stream:
+                # the countries of the addresses are looked up while the answers are arriving
+                reader = geoip.CountryLookup(path_geoip)
+                records = dnschain.Records(on_address=reader.country)
+            if options.cache:
+                resolved_dict = resolve_cached(options.engine,hostnames,options.window,options.depth,options.stream,options.keep_raw,records)
+            else:
+                records = resolve_domains(options.engine,hostnames,options.window,options.depth,options.stream,options.keep_raw,records)
+                resolved_dict = import_results(records,hostnames,options.depth,options.keep_raw)
+            del(records)
+
+            # Process the results from all rounds
+            actual_dict = generate_actual(resolved_dict,reader)
+            ##print(actual_dict) # debug
+            # update actual stats
+            if not testmode:
+                save_actual(file_actual_resolved,actual_dict,batch)
+                save_delta(file_actual_resolved_delta,actual_dict,batch)
+            else:
+                print("Actual stats [country/ip/hosts]: %d/%d/%d" % dict_stats(actual_dict)) 
+
+        if options.update:
+            # get actual trends
+            trends_country,trends_ip = generate_trends(actual_dict)
+            if not testmode:
+                save_trends(file_trends_resolved_country,trends_country,"resolved_by_country",batch)
+                save_trends(file_trends_resolved_ip,trends_ip,"resolved_by_ip",batch)
+            else:
+                print(trends_country)
+                print(trends_ip)
+        batch.commit()
+    finally:
+        # drop the staged files of a failed run
+        batch.abort()
 
     logging.info('Update END.')
 
 if __name__ == '__main__':
-    main()
+    metrics.run(main,path_metrics,run_name)
 
 
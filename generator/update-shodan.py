@@ -1,28 +1,21 @@
 #!/usr/bin/env python
 
-from shodan import Shodan
 from optparse import OptionParser
-from datetime import datetime
-from time import sleep
 import json
 import os
+import re
 import logging
-
-# Path to global or local config file
-config_global = "/usr/local/etc/osint/config.json"
-config_local = os.path.expanduser("~/.osint.json")
-
-if os.path.exists(config_global) and os.path.getsize(config_global) > 0:
-        with open(config_global) as json_file:
-                config = json.load(json_file)
-else:
-        if os.path.exists(config_local) and os.path.getsize(config_local) > 0:
-                with open(config_local) as json_file:
-                        config = json.load(json_file)
-        else:
-                print("No configuration file found in %s or %s" % (config_global,config_local))
-                exit(1)
-
+import functools
+from osintlib import common
+from osintlib import trends
+from osintlib import scheduler
+from osintlib import respcache
+from osintlib import publish
+from osintlib import metrics
+# loaded on the first API call, not needed for --fix or the replay
+shodan = common.lazy_import('shodan')
+
+config = common.load_config()
 
 # populate variables with values from config
 SHODAN_API_KEY = config["keys"]["shodan"]
@@ -30,12 +23,16 @@ path_basedir = config["path"]["basedir"]
 path_logdir = config["path"]["logdir"]
 file_log = os.path.join(path_logdir,"updates.log")
 
-# SHODAN init
-api = Shodan(SHODAN_API_KEY)
-
 # subfolders
 path_actual = os.path.join(path_basedir,"actual","shodan")
 path_trends = os.path.join(path_basedir,"trends","shodan")
+# cached shodan responses
+path_raw_cache = os.path.join(path_basedir,"raw","shodan","cache")
+# run metrics (and the name of the run)
+path_metrics = os.path.join(path_logdir,"metrics")
+run_name = "shodan-update"
+# journal of the published files (crash recovery)
+path_raw_publish_journal = os.path.join(path_basedir,"raw","shodan","publish.journal")
 # files to store actual stats
 file_actual_stats_db = os.path.join(path_actual,"stats-db.json")
 file_actual_stats_ics = os.path.join(path_actual,"stats-ics.json")
@@ -50,153 +47,211 @@ file_trends_stats_cve = os.path.join(path_trends,"trends-cve.json")
 file_trends_stats_ports = os.path.join(path_trends,"trends-ports.json")
 file_trends_stats_bluekeep_org = os.path.join(path_trends,"trends-bluekeep_org.json")
 file_trends_stats_ssl = os.path.join(path_trends,"trends-ssl.json")
-
-
-# Get today's date as str
-def date_today():
-    return datetime.now().strftime("%Y-%m-%d")
-
-# get all the stats for DB
-def get_stats_db():
-        # Stats for databases
-        stats_db = {}
-        stats_db['MySQL']=api.count('product:MySQL country:"SK"')['total']
-        sleep(2)
-        stats_db['MongoDB']=api.count('product:MongoDB country:"SK"')['total']
-        sleep(2)
-        stats_db['Memcached']=api.count('product:Memcached country:"SK"')['total']
-        sleep(2)
-        stats_db['CouchDB']=api.count('product:CouchDB country:"SK"')['total']
-        sleep(2)
-        stats_db['PostgreSQL']=api.count('port:5432 PostgreSQL country:"SK"')['total']
-        sleep(2)
-        stats_db['Riak']=api.count('port:8087 Riak country:"SK"')['total']
-        sleep(2)
-        stats_db['Redis']=api.count('product:Redis country:"SK"')['total']
-        sleep(2)
-        stats_db['Cassandra']=api.count('product:Cassandra country:"SK"')['total']
-        sleep(2)
-        stats_db['Elastic']=api.count('port:9200 json country:"SK"')['total']
-        return stats_db
-
-# get all the stats for ICS
-def get_stats_ics():
-        # Stats for ICS
-        stats_ics = {}
-        sleep(2)
-        stats_ics['Modbus']=api.count('port:502 country:"SK"')['total']
-        sleep(2)
-        stats_ics['Niagara']=api.count('port:1911,4911 product:Niagara country:"SK"')['total']
-        sleep(2)
-        stats_ics['GE-SRTP']=api.count('port:18245,18246 product:"general electric" country:"SK"')['total']
-        sleep(2)
-        stats_ics['MELSEC-Q']=api.count('port:5006,5007 product:mitsubishi country:"SK"')['total']
-        sleep(2)
-        stats_ics['CODESYS']=api.count('port:2455 operating system country:"SK"')['total']
-        sleep(2)
-        stats_ics['Siemens-S7']=api.count('port:102 country:"SK"')['total']
-        sleep(2)
-        stats_ics['BACnet']=api.count('port:47808 country:"SK"')['total']
-        sleep(2)
-        stats_ics['HART-IP']=api.count('port:5094 hart-ip country:"SK"')['total']
-        sleep(2)
-        stats_ics['OMRON-FINS']=api.count('port:9600 response code country:"SK"')['total']
-        sleep(2)
-        stats_ics['IEC-60870-5-104']=api.count('port:2404 asdu address country:"SK"')['total']
-        sleep(2)
-        stats_ics['DNP3']=api.count('port:20000 source address country:"SK"')['total']
-        sleep(2)
-        stats_ics['EtherNet-IP']=api.count('port:44818 country:"SK"')['total']
-        sleep(2)
-        stats_ics['PCWorx']=api.count('port:1962 PLC country:"SK"')['total']
-        sleep(2)
-        stats_ics['Crimson-v3']=api.count('port:789 product:"Red Lion Controls" country:"SK"')['total']
-        sleep(2)
-        stats_ics['ProConOS']=api.count('port:20547 PLC country:"SK"')['total']
-        return stats_ics
-
-# get all the stats for CVEs
-def get_stats_cve():
-        # CVE stats for country
-        stats_cve = {}
-        sleep(2)
-        results_cve = api.count('country:"SK"',facets=[('vuln',20)])['facets']['vuln']
-        for result in results_cve:
-                stats_cve[result['value']]=result['count']
-        return stats_cve
-
-
-# get all the stats for PORTS
-def get_stats_ports():
-        # port stats for country
-        stats_ports = {}
-        sleep(2)
-        results_ports = api.count('country:"SK"',facets=[('port',20)])['facets']['port']
-        for result in results_ports:
-                stats_ports[result['value']]=result['count']
-        return stats_ports
-
-# get all the stats for the BLUEKEEP CVE grouped by ORG
-def get_stats_bluekeep():
-        # bluekeep stats per org
-        stats_bluekeep_org = {}
-        sleep(2)
-        results_bluekeep_org = api.count('vuln:cve-2019-0708 country:"SK"',facets=[('org',20)])['facets']['org']
-        for result in results_bluekeep_org:
-                stats_bluekeep_org[result['value']]=result['count']
-        return stats_bluekeep_org
-
-# get all the stats regarding SSL
-def get_stats_ssl():
-        stats_ssl = {}
-        sleep(2)
-        stats_ssl['http'] = api.count('country:SK HTTP')['total']
-        sleep(2)
-        stats_ssl['https'] = api.count('country:SK has_ssl:true HTTP')['total']
-        sleep(2)
-        stats_ssl['cert_expired'] = api.count('has_ssl:true ssl.cert.expired:true country:SK HTTP')['total']
-        return stats_ssl
+# shodan API rate limit (requests per second) and number of parallel calls
+api_rate = 1.0
+api_workers = 4
+
+# Stats counted by shodan (stats -> list of (key, query))
+queries_count = {
+        'db' : [
+                ('MySQL','product:MySQL country:"SK"'),
+                ('MongoDB','product:MongoDB country:"SK"'),
+                ('Memcached','product:Memcached country:"SK"'),
+                ('CouchDB','product:CouchDB country:"SK"'),
+                ('PostgreSQL','port:5432 PostgreSQL country:"SK"'),
+                ('Riak','port:8087 Riak country:"SK"'),
+                ('Redis','product:Redis country:"SK"'),
+                ('Cassandra','product:Cassandra country:"SK"'),
+                ('Elastic','port:9200 json country:"SK"'),
+        ],
+        'ics' : [
+                ('Modbus','port:502 country:"SK"'),
+                ('Niagara','port:1911,4911 product:Niagara country:"SK"'),
+                ('GE-SRTP','port:18245,18246 product:"general electric" country:"SK"'),
+                ('MELSEC-Q','port:5006,5007 product:mitsubishi country:"SK"'),
+                ('CODESYS','port:2455 operating system country:"SK"'),
+                ('Siemens-S7','port:102 country:"SK"'),
+                ('BACnet','port:47808 country:"SK"'),
+                ('HART-IP','port:5094 hart-ip country:"SK"'),
+                ('OMRON-FINS','port:9600 response code country:"SK"'),
+                ('IEC-60870-5-104','port:2404 asdu address country:"SK"'),
+                ('DNP3','port:20000 source address country:"SK"'),
+                ('EtherNet-IP','port:44818 country:"SK"'),
+                ('PCWorx','port:1962 PLC country:"SK"'),
+                ('Crimson-v3','port:789 product:"Red Lion Controls" country:"SK"'),
+                ('ProConOS','port:20547 PLC country:"SK"'),
+        ],
+        'ssl' : [
+                ('http','country:SK HTTP'),
+                ('https','country:SK has_ssl:true HTTP'),
+                ('cert_expired','has_ssl:true ssl.cert.expired:true country:SK HTTP'),
+        ],
+}
+# The counts filtered only by one of these fields can be derived from a facet of the whole country
+mergeable_facets = ('port',)
+# number of facet values requested when the counts are derived from a facet
+merged_facet_size = 1000
+# the whole country
+country_query = 'country:"SK"'
+# a query filtered by a single field value + country
+merge_query_re = re.compile(r'^(\w+):(\d+) country:"SK"$')
+
+# Stats taken from the shodan facets (stats -> (query, facet, number of values))
+queries_facets = {
+        'cve' : ('country:"SK"','vuln',20),
+        'ports' : ('country:"SK"','port',20),
+        'bluekeep_org' : ('vuln:cve-2019-0708 country:"SK"','org',20),
+}
+
+
+# SHODAN init (on the first use)
+def get_api():
+        return shodan.Shodan(SHODAN_API_KEY)
+
+# Shodan tells us to slow down
+def is_rate_limit(e):
+        return isinstance(e, shodan.APIError) and 'rate limit' in str(e).lower()
+
+# Plan the API calls, the compatible counts and facets are merged into a single faceted query of the whole country
+#  returns (country facets {facet: size}, merged counts {(stats,key): (facet,value)}, counts [((stats,key),query)], facets [(stats,query,facet,size)])
+def plan_queries():
+        country_facets = {}
+        merged = {}
+        counts = []
+        facets = []
+        for stats in queries_count:
+                for key, query in queries_count[stats]:
+                        match = merge_query_re.match(query)
+                        if match and match.group(1) in mergeable_facets:
+                                merged[(stats,key)] = (match.group(1),match.group(2))
+                                country_facets[match.group(1)] = max(country_facets.get(match.group(1),0),merged_facet_size)
+                        else:
+                                counts.append(((stats,key),query))
+        for stats in queries_facets:
+                query, facet, size = queries_facets[stats]
+                if query == country_query:
+                        country_facets[facet] = max(country_facets.get(facet,0),size)
+                else:
+                        facets.append((stats,query,facet,size))
+        return (country_facets,merged,counts,facets)
+
+# Number of API calls without merging
+def count_queries():
+        return sum(len(queries) for queries in queries_count.values()) + len(queries_facets)
+
+# Run the count queries [(key, query, facets)], returns {key: response}
+#  the cached responses are used without calling the API (no rate limiting), offline fails on a missing response
+def run_counts(api,specs,bucket,workers=api_workers,cache=None,date=None,offline=False):
+        results = {}
+        calls = []
+        for key, query, facets in specs:
+                response = cache.get(query,facets,date) if cache is not None else None
+                if response is not None:
+                        results[key] = response
+                elif offline:
+                        raise respcache.CacheMiss("No cached response for %s (%s)" % (query,date))
+                else:
+                        calls.append((key,functools.partial(count_cached,api,query,facets,cache,date)))
+        results.update(scheduler.run_calls(calls,bucket,workers,retryable=is_rate_limit))
+        return results
+
+# Call the API and keep the response in the cache
+def count_cached(api,query,facets,cache,date):
+        metrics.count('shodan.calls')
+        if facets:
+                response = api.count(query,facets=facets)
+        else:
+                response = api.count(query)
+        if cache is not None:
+                cache.put(query,facets,date,response)
+        return response
+
+# Does the facet list all the values? (shodan may return fewer values than requested, even if there are more)
+def facet_complete(response,facet):
+        return sum(result['count'] for result in response['facets'][facet]) >= response['total']
+
+# get all the stats from shodan (stats -> {key: count}), the calls are spread at the allowed API rate
+@metrics.timed('shodan.queries')
+def get_stats(api,rate=api_rate,workers=api_workers,cache=None,date=None,offline=False):
+        if date is None:
+                date = common.date_today()
+        country_facets, merged, counts, facets = plan_queries()
+        bucket = scheduler.TokenBucket(rate)
+        specs = []
+        if country_facets:
+                specs.append((('country',None),country_query,[[facet,size] for facet, size in sorted(country_facets.items())]))
+        for stats_key, query in counts:
+                specs.append((stats_key,query,None))
+        for stats, query, facet, size in facets:
+                specs.append(((stats,None),query,[[facet,size]]))
+        results = run_counts(api,specs,bucket,workers,cache,date,offline)
+
+        stats_all = dict((stats,{}) for stats in queries_count.keys() + queries_facets.keys())
+        for stats in queries_facets:
+                query, facet, size = queries_facets[stats]
+                if query == country_query:
+                        values = results[('country',None)]['facets'][facet][:size]
+                else:
+                        values = results[(stats,None)]['facets'][facet]
+                for result in values:
+                        stats_all[stats][result['value']] = result['count']
+        for stats_key, _ in counts:
+                stats_all[stats_key[0]][stats_key[1]] = results[stats_key]['total']
+
+        # derive the merged counts from the country facets
+        fallback = []
+        for (stats,key), (facet,value) in merged.items():
+                values = results[('country',None)]['facets'][facet]
+                found = [result['count'] for result in values if str(result['value']) == value]
+                if found:
+                        stats_all[stats][key] = found[0]
+                elif facet_complete(results[('country',None)],facet):
+                        # the facet lists all the values
+                        stats_all[stats][key] = 0
+                else:
+                        fallback.append(((stats,key),dict(queries_count[stats])[key]))
+        if fallback:
+                logging.info("Shodan facet truncated, querying %d counts directly" % len(fallback))
+                results = run_counts(api,[(stats_key,query,None) for stats_key, query in fallback],bucket,workers,cache,date,offline)
+                for stats_key, _ in fallback:
+                        stats_all[stats_key[0]][stats_key[1]] = results[stats_key]['total']
+
+        calls_made = len(specs) + len(fallback)
+        logging.info("Shodan queries: %d (saved %d by merging)" % (calls_made,count_queries()-calls_made))
+        metrics.count_all('shodan.queries',{'planned':calls_made,'saved':count_queries()-calls_made})
+        if cache is not None:
+                logging.info("Shodan cached responses (hits/misses): %d/%d" % (cache.hits,cache.misses))
+                metrics.count_all('shodan.cache',{'hits':cache.hits,'misses':cache.misses})
+        return stats_all
 
 # Fix/Update trends from local actual stats (not shodan)
-def fix_trends(stats_file,trends_file):
-        # read actual stats
-        with open(stats_file) as json_file:
+@metrics.timed('shodan.trends')
+def fix_trends(stats_file,trends_file,batch):
+        # read actual stats (the staged ones if written by this run)
+        with open(batch.path(stats_file)) as json_file:
                 data_stats = json.load(json_file)
-        # read actual trends
-        with open(trends_file) as json_file:
-                data_trends = json.load(json_file)
 
-        data_stats["date"]= date_today()
+        data_stats["date"]= common.date_today()
 
         # append last stats to trends
-        data_trends[data_trends.keys()[0]].append(data_stats)
-        
-        # print(data_trends)
-        with open(trends_file, 'w') as outfile:
-                json.dump(data_trends, outfile, indent=4)
+        trends.append_trends(trends_file,data_stats,batch=batch)
 
 # Update trends json with actual stats from shodan
-def update_trends(trends_file,data_stats):
-        # read actual trends
-        with open(trends_file) as json_file:
-                data_trends = json.load(json_file)
-
-        data_stats["date"]= date_today()
+@metrics.timed('shodan.trends')
+def update_trends(trends_file,data_stats,batch):
+        data_stats["date"]= common.date_today()
 
         # append last stats to trends
-        data_trends[data_trends.keys()[0]].append(data_stats)
-        
-        # print(data_trends)
-        with open(trends_file, 'w') as outfile:
-                json.dump(data_trends, outfile, indent=4)
+        trends.append_trends(trends_file,data_stats,batch=batch)
 
 # Save actual stats to json files
-def save_actual(json_file,json_data):
-        with open(json_file, 'w') as outfile:
+@metrics.timed('shodan.save')
+def save_actual(json_file,json_data,batch):
+        with batch.open(json_file) as outfile:
                 json.dump(json_data, outfile, indent=4)
 
 
-def main():
+def main(argv=None):
         usage = "usage: %prog [options]"
         parser = OptionParser(usage)
         parser.add_option("-t", "--test", action="store_true", dest="testmode",help="Test mode, no file modification.")
@@ -204,14 +259,17 @@ def main():
         parser.add_option("-u", "--update", action="store_true", dest="update",help="Update trends")
         parser.add_option("-f", "--fix", action="store_true", dest="fix",help="Fix trends (append) from actual stats")
         parser.add_option("-d", "--debug", action="store_true", dest="debugmode",help="Enable DEBUG logging")
+        parser.add_option("-r", "--rate", type="float", dest="rate", default=api_rate, help="Shodan API requests per second (default: %default)")
+        parser.add_option("--cache-max-age", type="int", dest="cache_max_age", default=respcache.default_max_age, help="Reuse the cached shodan responses up to SECONDS old (default: %default)", metavar="SECONDS")
+        parser.add_option("--no-cache", action="store_true", dest="no_cache", help="Do not use the cached shodan responses")
+        parser.add_option("--replay", action="store_true", dest="replay", help="Rebuild the actual stats from the cached responses only (offline)")
+        parser.add_option("--date", dest="date", help="Date of the cached responses for --replay (default: today)", metavar="YYYY-MM-DD")
+        parser.add_option("--cache-keep-days", type="int", dest="cache_keep_days", default=respcache.default_keep_days, help="Remove the cached shodan responses older than DAYS (default: %default)", metavar="DAYS")
         # Parse arguments
-        (options, args) = parser.parse_args()
+        (options, args) = parser.parse_args(argv)
 
         # create logger
-        if options.debugmode:
-                logging.basicConfig(filename=file_log,level=logging.DEBUG,format='%(asctime)s - shodan-update - %(levelname)s - %(message)s')
-        else:
-                logging.basicConfig(filename=file_log,level=logging.INFO,format='%(asctime)s - shodan-update - %(levelname)s - %(message)s')
+        common.setup_logging(file_log,'shodan-update',options.debugmode)
         logging.info('Update BEGIN.')
         
 
@@ -219,14 +277,37 @@ def main():
                 print("Running in TESTMODE")
                 logging.info("Running in TESTMODE")
 
+        if options.date and not options.replay:
+                # the fresh responses must be stored under the date they were received
+                print("[!] --date can only be used with --replay")
+                exit(2)
+
+        cache = None
+        if not options.no_cache:
+                # the test mode does not write the cache
+                cache = respcache.ResponseCache(path_raw_cache,options.cache_max_age,options.testmode)
+        if options.replay:
+                if cache is None:
+                        print("[!] --replay needs the response cache")
+                        exit(2)
+                # no expiry for the replay
+                cache.max_age = None
+                options.actual = True
+
         if not options.fix:
-                # Get data from shodan
-                stats_db_json = get_stats_db()
-                stats_ics_json = get_stats_ics()
-                stats_cve_json = get_stats_cve()
-                stats_ports_json = get_stats_ports()
-                stats_bluekeep_json = get_stats_bluekeep()
-                stats_ssl_json = get_stats_ssl()
+                # Get data from shodan (or from the cache only for replay)
+                try:
+                        stats_all = get_stats(None if options.replay else get_api(),options.rate,cache=cache,date=options.date,offline=options.replay)
+                except respcache.CacheMiss, e:
+                        print("[!] %s" % e)
+                        logging.error(str(e))
+                        exit(3)
+                stats_db_json = stats_all['db']
+                stats_ics_json = stats_all['ics']
+                stats_cve_json = stats_all['cve']
+                stats_ports_json = stats_all['ports']
+                stats_bluekeep_json = stats_all['bluekeep_org']
+                stats_ssl_json = stats_all['ssl']
 
 
         # Print them if in test mode
@@ -245,39 +326,49 @@ def main():
                 print(json.dumps(stats_ssl_json, indent=4))
 
 
-        # write data to actual dataset
-        if options.actual:
-                logging.debug("Updating actual datasets - BEGIN")
-                save_actual(file_actual_stats_db,stats_db_json)
-                save_actual(file_actual_stats_ics,stats_ics_json)
-                save_actual(file_actual_stats_cve,stats_cve_json)
-                save_actual(file_actual_stats_ports,stats_ports_json)
-                save_actual(file_actual_stats_bluekeep_org,stats_bluekeep_json)
-                save_actual(file_actual_stats_ssl,stats_ssl_json)
-                logging.debug("Updating actual datasets - END")
-
-
-        if options.fix:
-                logging.debug("Fixing trends - BEGIN")
-                fix_trends(file_actual_stats_db,file_trends_stats_db)
-                fix_trends(file_actual_stats_ics,file_trends_stats_ics)
-                fix_trends(file_actual_stats_cve,file_trends_stats_cve)
-                fix_trends(file_actual_stats_ports,file_trends_stats_ports)
-                fix_trends(file_actual_stats_bluekeep_org,file_trends_stats_bluekeep_org)
-                fix_trends(file_actual_stats_ssl,file_trends_stats_ssl)
-                logging.debug("Fixing trends - END")
-
-        if options.update:
-                logging.debug("Updating trends - BEGIN")
-                update_trends(file_trends_stats_db,stats_db_json)
-                update_trends(file_trends_stats_ics,stats_ics_json)
-                update_trends(file_trends_stats_cve,stats_cve_json)
-                update_trends(file_trends_stats_ports,stats_ports_json)
-                update_trends(file_trends_stats_bluekeep_org,stats_bluekeep_json)
-                update_trends(file_trends_stats_ssl,stats_ssl_json)
-                logging.debug("Updating trends - END")
+        # all the outputs of the run are published at once
+        batch = publish.Batch(path_raw_publish_journal)
+        try:
+                # write data to actual dataset
+                if options.actual:
+                        logging.debug("Updating actual datasets - BEGIN")
+                        save_actual(file_actual_stats_db,stats_db_json,batch)
+                        save_actual(file_actual_stats_ics,stats_ics_json,batch)
+                        save_actual(file_actual_stats_cve,stats_cve_json,batch)
+                        save_actual(file_actual_stats_ports,stats_ports_json,batch)
+                        save_actual(file_actual_stats_bluekeep_org,stats_bluekeep_json,batch)
+                        save_actual(file_actual_stats_ssl,stats_ssl_json,batch)
+                        logging.debug("Updating actual datasets - END")
+
+
+                if options.fix:
+                        logging.debug("Fixing trends - BEGIN")
+                        fix_trends(file_actual_stats_db,file_trends_stats_db,batch)
+                        fix_trends(file_actual_stats_ics,file_trends_stats_ics,batch)
+                        fix_trends(file_actual_stats_cve,file_trends_stats_cve,batch)
+                        fix_trends(file_actual_stats_ports,file_trends_stats_ports,batch)
+                        fix_trends(file_actual_stats_bluekeep_org,file_trends_stats_bluekeep_org,batch)
+                        fix_trends(file_actual_stats_ssl,file_trends_stats_ssl,batch)
+                        logging.debug("Fixing trends - END")
+
+                if options.update:
+                        logging.debug("Updating trends - BEGIN")
+                        update_trends(file_trends_stats_db,stats_db_json,batch)
+                        update_trends(file_trends_stats_ics,stats_ics_json,batch)
+                        update_trends(file_trends_stats_cve,stats_cve_json,batch)
+                        update_trends(file_trends_stats_ports,stats_ports_json,batch)
+                        update_trends(file_trends_stats_bluekeep_org,stats_bluekeep_json,batch)
+                        update_trends(file_trends_stats_ssl,stats_ssl_json,batch)
+                        logging.debug("Updating trends - END")
+                batch.commit()
+        finally:
+                # drop the staged files of a failed run
+                batch.abort()
+
+        if cache is not None and not options.replay and not options.testmode:
+                cache.prune(options.cache_keep_days)
 
         logging.info('Update END.')
 
 if __name__ == "__main__":
-        main()
\ No newline at end of file
+        metrics.run(main,path_metrics,run_name)
\ No newline at end of file
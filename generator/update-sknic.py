@@ -1,33 +1,29 @@
 #! /usr/bin/env python
-import urllib
 import os
 import time
 import json
 import logging
-import datetime
 import operator
 import collections
 from optparse import OptionParser
 from collections import defaultdict
 from itertools import islice
+import tempfile
+import glob
+import multiprocessing
+from osintlib import common
+from osintlib import trends
+from osintlib import snapshot
+from osintlib import sknic
+from osintlib import jsonstream
+from osintlib import publish
+from osintlib import metrics
+from osintlib import download
 
-# Path to global or local config file
-config_global = "/usr/local/etc/osint/config.json"
-config_local = os.path.expanduser("~/.osint.json")
 # Do we run in testmode?
 testmode = False
 
-if os.path.exists(config_global) and os.path.getsize(config_global) > 0:
-        with open(config_global) as json_file:
-                config = json.load(json_file)
-else:
-        if os.path.exists(config_local) and os.path.getsize(config_local) > 0:
-                with open(config_local) as json_file:
-                        config = json.load(json_file)
-        else:
-                print("No configuration file found in %s or %s" % (config_global,config_local))
-                exit(1)
-
+config = common.load_config()
 
 # populate variables with values from config
 path_basedir = config["path"]["basedir"]
@@ -40,6 +36,14 @@ path_trends = os.path.join(path_basedir,"trends","domain")
 path_raw = os.path.join(path_basedir,"raw","domain")
 path_raw_domains = os.path.join(path_raw,"domains")
 path_raw_registrars = os.path.join(path_raw,"registrars")
+path_raw_snapshots = os.path.join(path_raw,"snapshots")
+# run metrics (and the name of the run)
+path_metrics = os.path.join(path_logdir,"metrics")
+run_name = "sknic-update"
+# journal of the published files (crash recovery)
+file_publish_journal = os.path.join(path_raw,"publish.journal")
+# validators of the last downloads (conditional and resumed downloads)
+file_download_state = os.path.join(path_raw,"download-state.json")
 # files to store actual stats
 file_actual_stats_sk_domains = os.path.join(path_actual,"sk-domains.txt")
 file_actual_stats_domain_changes = os.path.join(path_actual,"stats-domain-changes.json")
@@ -65,37 +69,27 @@ def humansize(nbytes):
     f = ('%.2f' % nbytes).rstrip('0').rstrip('.')
     return '%s %s' % (f, suffixes[i])
 
-# Today's date in YMD format
-def date_today():
-    return datetime.datetime.now().strftime("%Y-%m-%d")
+# Download an export file, returns the size (zero if the file exists, None if the download failed)
+def get_source_file(url,localname,name):
+    if os.path.isfile(localname):
+        logging.warning('File '+localname+' already exists. Size: '+str(os.path.getsize(localname)))
+        return 0
+    try:
+        result = download.fetch(url,localname,file_download_state)
+    except download.DownloadError, e:
+        print "[!] Unable to download %s list: %s" % (name,e)
+        logging.error('Unable to download %s list: %s' % (name,e))
+        return None
+    logging.info('Downloaded file size : %d (%s)' % (result['size'],result['status']))
+    return result['size']
 
 # Download the domains export file
 def get_domains_file(localname):
-    if not os.path.isfile(localname):
-        try:
-            urllib.urlretrieve(url_domains, localname)
-        except Exception, e:
-            print "[!] Unable to download domains list.", e
-            logging.error('Unable to download domains list.')
-        logging.info('Downloaded file size : '+str(os.path.getsize(localname)))
-        return os.path.getsize(localname)
-    else:
-        logging.warning('File '+localname+' already exists. Size: '+str(os.path.getsize(localname)))
-        return 0
+    return get_source_file(url_domains,localname,'domains')
 
 # Download the registrars export file
 def get_registrators_file(localname):
-    if not os.path.isfile(localname):
-        try:
-            urllib.urlretrieve(url_registrators, localname)
-        except Exception, e:
-            print "[!] Unable to download registrators list: ", e
-            logging.error('Unable to download registrators list.')
-        logging.info('Downloaded file size : '+str(os.path.getsize(localname)))
-        return os.path.getsize(localname)
-    else:
-        logging.warning('File '+localname+' already exists. Size: '+str(os.path.getsize(localname)))
-        return 0
+    return get_source_file(url_registrators,localname,'registrators')
 
 # Make a directory if needed
 def create_dir(path):
@@ -110,73 +104,96 @@ def create_dir(path):
 def create_dirs():
     create_dir(path_raw_domains)
     create_dir(path_raw_registrars)
+    create_dir(path_raw_snapshots)
 
 # Download the domains and registrars source files and return filenames and sizes (zero if file exists)
+#  the file is None if the download failed
+@metrics.timed('sknic.download')
 def download_source_data():
     status = {'domains':{},'registrars':{}}
-    domains_save_to=os.path.join(path_raw_domains,'domains_'+date_today()+'.txt')
-    registrators_save_to=os.path.join(path_raw_registrars,'registrars_'+date_today()+'.txt')
+    domains_save_to=os.path.join(path_raw_domains,'domains_'+common.date_today()+'.txt')
+    registrators_save_to=os.path.join(path_raw_registrars,'registrars_'+common.date_today()+'.txt')
     logging.info('[+] Downloading domains file to : ' + domains_save_to)
     domains_file_size = get_domains_file(domains_save_to)
-    status['domains']={'file':domains_save_to,'size':humansize(domains_file_size)}
+    status['domains']=source_status(domains_save_to,domains_file_size)
     logging.info('[+] Downloading registrators file to : ' + registrators_save_to)
     registrators_file_size = get_registrators_file(registrators_save_to)
-    status['registrars']={'file':registrators_save_to,'size':humansize(registrators_file_size)}
+    status['registrars']=source_status(registrators_save_to,registrators_file_size)
+    return status
+
+# The latest downloaded domains and registrars files, nothing is downloaded (same format as download_source_data)
+def latest_source_data():
+    status = {}
+    for name, path in (('domains',path_raw_domains),('registrars',path_raw_registrars)):
+        files = sorted(glob.glob(os.path.join(path,name+'_*.txt')))
+        status[name] = source_status(files[-1],os.path.getsize(files[-1])) if files else source_status(None,None)
     return status
 
+def source_status(filename,size):
+    if size is None:
+        return {'file':None,'size':None}
+    return {'file':filename,'size':humansize(size)}
+
+# Read a domains list (one domain per line)
+def read_domains_list(filename):
+    with open(filename) as fp:
+        for line in fp:
+            line = line.strip()
+            if len(line) != 0:
+                yield line
+
+# Check if the list is sorted (older lists were written in export order)
+def is_sorted_list(filename):
+    previous = None
+    for domain in read_domains_list(filename):
+        if previous is not None and domain < previous:
+            return False
+        previous = domain
+    return True
+
+# Diff the previous list of domains against the actual (sorted) list of domains
+@metrics.timed('sknic.diff')
+def diff_domains_list(filename,domains):
+    if is_sorted_list(filename):
+        old_domains = read_domains_list(filename)
+    else:
+        logging.warning("List %s is not sorted, sorting it in memory" % filename)
+        old_domains = sorted(read_domains_list(filename))
+    return snapshot.diff_sorted(old_domains,domains)
+
+# Path of the snapshot for the date
+def snapshot_filename(date):
+    return sknic.snapshot_filename(path_raw_snapshots,date)
+
 # Generate all the stats and trends from downloaded files
-def parse_domains_file(filename_domains,filename_registrars):
-    # domains
-    result_actual_stats_sk_domains = []
-    result_actual_stats_count_by_registrar = {}
-    result_actual_stats_count_by_holder = {}
-    result_actual_stats_domains_by_registrar = {}
-    result_actual_stats_domains_by_holder = {}
+@metrics.timed('sknic.actual')
+def parse_domains_file(filename_domains,filename_registrars,batch,compact=False):
     result_actual_stats_domains_diff = {}
-    result_actual_stats_domains_by_registrar = defaultdict(list)
-    result_actual_stats_domains_by_holder = defaultdict(list)
-    result_actual_stats_count_by_registrar = defaultdict(int)
-    result_actual_stats_count_by_holder = defaultdict(int)
     # translations
     translated_actual_stats_domains_by_registrar = {}
     translated_actual_stats_count_by_registrar = {}
     # registrars
-    result_actual_registrars = {}
-
-    with open(filename_registrars) as fp:
-        line = fp.readline()
-        cnt = 1
-        while line:
-            line = fp.readline()
-            cnt += 1
-            # Skip the first 9 lines containing the header
-            if cnt >=  9:
-                if len(line) != 0:
-                    fields=line.split(';')
-                    result_actual_registrars[fields[0]] =  fields[1]
-        logging.debug("Processed %d lines from %s" % (cnt,filename_domains))
-    
+    result_actual_registrars = sknic.read_registrars(filename_registrars)
 
-    with open(filename_domains) as fp:
-        line = fp.readline()
-        cnt = 1
-        while line:
-            line = fp.readline()
-            cnt += 1
-            # Skip the first 9 lines containing the header
-            if cnt >=  9:
-                if len(line) != 0:
-                    fields=line.split(';')
-                    # append to list of domains
-                    result_actual_stats_sk_domains.append(fields[0])
-                    # increment group counters
-                    result_actual_stats_count_by_registrar[fields[1]] += 1
-                    result_actual_stats_count_by_holder[fields[2]] += 1
-                    # add values to groups
-                    result_actual_stats_domains_by_registrar[fields[1]].append(fields[0])
-                    result_actual_stats_domains_by_holder[fields[2]].append(fields[0])
-
-        logging.debug("Processed %d lines from %s" % (cnt,filename_domains))
+    # domains, the published stats are derived from the snapshot
+    if testmode:
+        fd, filename_snapshot = tempfile.mkstemp(suffix='.snap')
+        os.close(fd)
+    else:
+        filename_snapshot = snapshot_filename(sknic.export_date(filename_domains))
+    sknic.create_snapshot(filename_domains,result_actual_registrars,filename_snapshot,sknic.export_date(filename_domains))
+    snap = snapshot.Snapshot(filename_snapshot)
+    # sorted
+    result_actual_stats_sk_domains = snap.domains()
+    result_actual_stats_domains_by_registrar = snap.domains_by('registrar')
+    result_actual_stats_domains_by_holder = snap.domains_by('holder')
+    result_actual_stats_count_by_registrar = snap.counts('registrar')
+    result_actual_stats_count_by_holder = snap.counts('holder')
+    result_actual_registrars = snap.registrar_names()
+    snap.close()
+    metrics.count('sknic.domains',len(result_actual_stats_sk_domains))
+    if testmode:
+        os.remove(filename_snapshot)
 
     # key translation of registrars id->name
     for k, v in result_actual_stats_count_by_registrar.items():
@@ -197,14 +214,17 @@ def parse_domains_file(filename_domains,filename_registrars):
     del(translated_actual_stats_count_by_registrar)
     del(translated_actual_stats_domains_by_registrar)
 
+    # the lists are stored sorted, so the diff is a linear merge
     # Read results to calculate diff
-    if os.path.isfile(file_actual_stats_sk_domains):            
-        with open(file_actual_stats_sk_domains, 'r') as file_old:
-            old_stats_sk_domains = file_old.readlines()
-        # strip newlines    
-        old_stats_sk_domains = [line.strip() for line in old_stats_sk_domains]
-        result_actual_stats_domains_diff['deleted'] = list(set(old_stats_sk_domains) - set(result_actual_stats_sk_domains))
-        result_actual_stats_domains_diff['added'] = list(set(result_actual_stats_sk_domains) - set(old_stats_sk_domains))
+    result_actual_stats_domains_diff['added'] = []
+    result_actual_stats_domains_diff['deleted'] = []
+    if os.path.isfile(file_actual_stats_sk_domains):
+        added, deleted, unchanged = diff_domains_list(batch.path(file_actual_stats_sk_domains),result_actual_stats_sk_domains)
+        result_actual_stats_domains_diff['added'] = added
+        result_actual_stats_domains_diff['deleted'] = deleted
+        logging.debug("Domains unchanged %d" % unchanged)
+    else:
+        logging.warning("No previous list %s, skipping the diff" % file_actual_stats_sk_domains)
     logging.debug("[ ] TESTMODE: Domains Added %d , Deleted %d" % (len(result_actual_stats_domains_diff['added']),len(result_actual_stats_domains_diff['deleted'])))
 
     if testmode:
@@ -216,26 +236,26 @@ def parse_domains_file(filename_domains,filename_registrars):
         print("[ ] TESTMODE: Domains Added %d , Deleted %d" % (len(result_actual_stats_domains_diff['added']),len(result_actual_stats_domains_diff['deleted'])))
         
     else:
-        # Save the domains by holder
-        with open(file_actual_stats_domains_by_holder, "w") as outfile:
-            json.dump(result_actual_stats_domains_by_holder, outfile, indent=4)
-        # Save the domains by registrar 
-        with open(file_actual_stats_domains_by_registrar, "w") as outfile:
-            json.dump(result_actual_stats_domains_by_registrar, outfile, indent=4)
-        # Save the count by holder (sorted)
-        with open(file_actual_stats_count_by_holder, "w") as outfile:
-            json.dump(collections.OrderedDict(sorted(result_actual_stats_count_by_holder.items(), reverse=True, key=operator.itemgetter(1))), outfile, indent=4)
-        # Save the count by registrar (sorted)
-        with open(file_actual_stats_count_by_registrar, "w") as outfile:
-            json.dump(collections.OrderedDict(sorted(result_actual_stats_count_by_registrar.items(), reverse=True, key=operator.itemgetter(1))), outfile, indent=4)
-
-        # save diff, before we overwrite the source list
-        with open(file_actual_stats_domain_changes, "w") as outfile:
-            json.dump(result_actual_stats_domains_diff, outfile, indent=4)
-
-        # Save the domains file 
-        with open(file_actual_stats_sk_domains, "w") as outfile:
-            outfile.write('\n'.join(result_actual_stats_sk_domains))
+        with metrics.span('sknic.write'):
+            # the files are staged, they are published together by the batch commit
+            # Save the domains by holder (streamed, the same bytes as json.dump with indent=4)
+            jsonstream.dump_file(result_actual_stats_domains_by_holder,file_actual_stats_domains_by_holder,compact,batch=batch)
+            # Save the domains by registrar 
+            jsonstream.dump_file(result_actual_stats_domains_by_registrar,file_actual_stats_domains_by_registrar,compact,batch=batch)
+            # Save the count by holder (sorted)
+            with batch.open(file_actual_stats_count_by_holder) as outfile:
+                json.dump(collections.OrderedDict(sorted(result_actual_stats_count_by_holder.items(), reverse=True, key=operator.itemgetter(1))), outfile, indent=4)
+            # Save the count by registrar (sorted)
+            with batch.open(file_actual_stats_count_by_registrar) as outfile:
+                json.dump(collections.OrderedDict(sorted(result_actual_stats_count_by_registrar.items(), reverse=True, key=operator.itemgetter(1))), outfile, indent=4)
+
+            # save diff, before we overwrite the source list
+            with batch.open(file_actual_stats_domain_changes) as outfile:
+                json.dump(result_actual_stats_domains_diff, outfile, indent=4)
+
+            # Save the domains file 
+            with batch.open(file_actual_stats_sk_domains) as outfile:
+                outfile.write('\n'.join(result_actual_stats_sk_domains))
 
 
     # log stats for debug purposes            
@@ -245,59 +265,137 @@ def parse_domains_file(filename_domains,filename_registrars):
     logging.debug("Wrote %d keys to %s" % (len(result_actual_stats_count_by_holder),file_actual_stats_count_by_holder))
     logging.debug("Wrote %d keys to %s" % (len(result_actual_stats_count_by_registrar),file_actual_stats_count_by_registrar))
 
-# If there are no trends data create a dummy file
-def dummy_trends_file(trends_file,dict_key):
-    data = {dict_key:[]}
-    with open(trends_file, 'w+') as outfile:
-        json.dump(data, outfile, indent=4)
-    outfile.close()
-
 # Update a trend
-def update_trends_file(stats_file,trends_file,dict_key,count_mode=False):  
+def update_trends_file(stats_file,trends_file,dict_key,batch,count_mode=False):  
+    # read the stats written by this run if they are not published yet
+    stats_file = batch.path(stats_file)
     if not os.path.isfile(stats_file):
         print("[!] Stats file is missing: %s" % stats_file)
         logging.error("[!] Stats file is missing: %s" % stats_file)
         exit(5)
 
-    if not os.path.isfile(trends_file):
-        dummy_trends_file(trends_file,dict_key)
-
     # read actual stats
     with open(stats_file) as json_file:
             data_stats = json.load(json_file)
 
     if not count_mode:
-        # create an ordered list DESC by VALUE
-        data_stats = collections.OrderedDict(sorted(data_stats.items(), reverse=True, key=operator.itemgetter(1)))
-        # get only the Top10
-        data_stats = dict(data_stats.items()[:10])
+        data_stats = trends.get_top10(data_stats)
     else:
         # count items for "domains-count-by-holder"
         data_stats["added"]=len(data_stats["added"])
         data_stats["deleted"]=len(data_stats["deleted"])
 
-    # read actual trends
-    with open(trends_file) as json_file:
-            data_trends = json.load(json_file)
-
-    data_stats["date"]= date_today()
+    data_stats["date"]= common.date_today()
 
     # append last stats to trends
-    data_trends[data_trends.keys()[0]].append(data_stats)
-    
-    # print(data_trends)
-    with open(trends_file, 'w') as outfile:
-            json.dump(data_trends, outfile, indent=4)
-
+    trends.append_trends(trends_file,data_stats,dict_key,batch)
+
+
+# Diff between the snapshots of two dates
+def diff_snapshots(date_from,date_to):
+    for date in (date_from,date_to):
+        if not os.path.isfile(snapshot_filename(date)):
+            print("[!] No snapshot for %s" % date)
+            exit(6)
+    snap_from = snapshot.Snapshot(snapshot_filename(date_from))
+    snap_to = snapshot.Snapshot(snapshot_filename(date_to))
+    added, deleted, unchanged = snapshot.diff_snapshots(snap_from,snap_to)
+    snap_from.close()
+    snap_to.close()
+    return {'added':added,'deleted':deleted,'unchanged':unchanged}
 
 # Update all the trends
-def update_trends_from_actual():
-    update_trends_file(file_actual_stats_count_by_registrar,file_actual_trends_count_by_registrar,'domains-count-by-registrar')
-    update_trends_file(file_actual_stats_count_by_holder,file_actual_trends_count_by_holder,'domains-count-by-holder')
-    update_trends_file(file_actual_stats_domain_changes,file_actual_trends_domain_changes,'domain-changes',count_mode=True)
+@metrics.timed('sknic.trends')
+def update_trends_from_actual(batch):
+    update_trends_file(file_actual_stats_count_by_registrar,file_actual_trends_count_by_registrar,'domains-count-by-registrar',batch)
+    update_trends_file(file_actual_stats_count_by_holder,file_actual_trends_count_by_holder,'domains-count-by-holder',batch)
+    update_trends_file(file_actual_stats_domain_changes,file_actual_trends_domain_changes,'domain-changes',batch,count_mode=True)
+
+# Backfill worker: snapshot of the day (reused if present) and its Top10 counts
+def backfill_day(job):
+    date, filename_domains = job
+    filename_snapshot = snapshot_filename(date)
+    if not os.path.isfile(filename_snapshot):
+        filename_registrars = os.path.join(path_raw_registrars,'registrars_'+date+'.txt')
+        registrars = {}
+        if os.path.isfile(filename_registrars):
+            registrars = sknic.read_registrars(filename_registrars)
+        else:
+            logging.warning("No registrars export for %s, the registrars are not translated" % date)
+        sknic.create_snapshot(filename_domains,registrars,filename_snapshot,date)
+    snap = snapshot.Snapshot(filename_snapshot)
+    registrar_names = snap.registrar_names()
+    count_by_registrar = {}
+    for k, v in snap.counts('registrar').items():
+        count_by_registrar[registrar_names.get(k,k)] = v
+    count_by_holder = snap.counts('holder')
+    cnt = len(snap.domains())
+    snap.close()
+    return (date,trends.get_top10(count_by_registrar),trends.get_top10(count_by_holder),cnt)
+
+# Backfill worker: number of domains added/deleted between two neighbouring days
+def backfill_diff(job):
+    date_previous, date = job
+    snap_previous = snapshot.Snapshot(snapshot_filename(date_previous))
+    snap = snapshot.Snapshot(snapshot_filename(date))
+    added, deleted, unchanged = snapshot.diff_snapshots(snap_previous,snap)
+    snap_previous.close()
+    snap.close()
+    return (date,len(added),len(deleted))
+
+# Rebuild the trends of a date range from the archived exports
+@metrics.timed('sknic.backfill')
+def backfill_trends(date_from,date_to,jobs,batch):
+    exports = sknic.archived_exports(path_raw_domains,path_raw_snapshots,None,date_to)
+    dates = sorted(date for date in exports if date >= date_from)
+    if len(dates) == 0:
+        print("[!] No archived exports between %s and %s" % (date_from,date_to))
+        exit(6)
+    # the day before the range is the base of the first diff
+    earlier = sorted(date for date in exports if date < date_from)
+    if earlier:
+        dates_diff = [earlier[-1]] + dates
+    else:
+        logging.warning("No export before %s, no domain changes for %s" % (date_from,dates[0]))
+        dates_diff = dates
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        # the snapshots first, the diffs read two of them
+        days = pool.map(backfill_day, [(date,exports[date]) for date in dates_diff], 1)
+        changes = pool.map(backfill_diff, zip(dates_diff[:-1],dates_diff[1:]), 1)
+    finally:
+        pool.close()
+        pool.join()
+
+    # merge in date order
+    entries_registrar = []
+    entries_holder = []
+    entries_changes = []
+    for date, top_registrar, top_holder, cnt in days:
+        if date < date_from:
+            continue
+        top_registrar['date'] = date
+        top_holder['date'] = date
+        entries_registrar.append(top_registrar)
+        entries_holder.append(top_holder)
+        logging.debug("Backfill %s: %d domains" % (date,cnt))
+    for date, added, deleted in changes:
+        entries_changes.append({'added':added,'deleted':deleted,'date':date})
+
+    if testmode:
+        for entry in entries_changes:
+            print("[ ] TESTMODE: %s Domains Added %d , Deleted %d" % (entry['date'],entry['added'],entry['deleted']))
+        print("[ ] TESTMODE: Backfilled %d days" % len(dates))
+    else:
+        trends.replace_entries(file_actual_trends_count_by_registrar,entries_registrar,'domains-count-by-registrar',batch)
+        trends.replace_entries(file_actual_trends_count_by_holder,entries_holder,'domains-count-by-holder',batch)
+        trends.replace_entries(file_actual_trends_domain_changes,entries_changes,'domain-changes',batch)
+    logging.info("Backfilled the trends for %d days between %s and %s" % (len(dates),date_from,date_to))
+    return len(dates)
 
 
-def main():
+def main(argv=None):
     global testmode
 
     usage = "usage: %prog [options] "
@@ -308,8 +406,36 @@ def main():
     parser.add_option("-a", "--actual", action="store_true", dest="actual",help="Update actual stats")
     parser.add_option("-u", "--update", action="store_true", dest="update",help="Update trends")
     parser.add_option("-d", "--debug", action="store_true", dest="debugmode",help="Enable DEBUG logging")
+    parser.add_option("-c", "--compact", action="store_true", dest="compact",help="Write the domains by holder/registrar without indentation")
+    parser.add_option("--diff", dest="diff", help="Print the domains added/deleted between the snapshots of two dates", metavar="FROM,TO")
+    parser.add_option("--backfill", dest="backfill", help="Rebuild the trends of the archived exports between two dates", metavar="FROM,TO")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=multiprocessing.cpu_count(), help="Number of parallel processes for --backfill (default: %default)")
     # Parse arguments
-    (options, _) = parser.parse_args()
+    (options, _) = parser.parse_args(argv)
+
+    if options.diff:
+        dates = options.diff.split(',')
+        if len(dates) != 2:
+            print("[!] Use --diff YYYY-MM-DD,YYYY-MM-DD")
+            exit(2)
+        print(json.dumps(diff_snapshots(dates[0],dates[1]), indent=4))
+        exit(0)
+
+    if options.backfill:
+        dates = options.backfill.split(',')
+        if len(dates) != 2 or dates[0] > dates[1]:
+            print("[!] Use --backfill YYYY-MM-DD,YYYY-MM-DD")
+            exit(2)
+        common.setup_logging(file_log,'sknic-update',options.debugmode)
+        testmode = options.testmode
+        create_dirs()
+        batch = publish.Batch(file_publish_journal)
+        try:
+            backfill_trends(dates[0],dates[1],max(1,options.jobs),batch)
+            batch.commit()
+        finally:
+            batch.abort()
+        exit(0)
 
     if options.filename:
         if not os.path.isfile(options.filename):
@@ -330,10 +456,7 @@ def main():
 
 
     # create logger
-    if options.debugmode:
-            logging.basicConfig(filename=file_log,level=logging.DEBUG,format='%(asctime)s - sknic-update - %(levelname)s - %(message)s')
-    else:
-            logging.basicConfig(filename=file_log,level=logging.INFO,format='%(asctime)s - sknic-update - %(levelname)s - %(message)s')
+    common.setup_logging(file_log,'sknic-update',options.debugmode)
     logging.info('Update BEGIN.')
     
 
@@ -348,19 +471,28 @@ def main():
             # download source data from SK-NIC
             status = download_source_data()
             print json.dumps(status, indent=4)
+            if status['domains']['file'] is None or status['registrars']['file'] is None:
+                exit(4)
     
 
-    if options.actual:
-        # Parse the input file
-        parse_domains_file(options.filename,options.filename_registrars)
-    if options.update:
-        update_trends_from_actual()
+    # all the outputs of the run are published at once
+    batch = publish.Batch(file_publish_journal)
+    try:
+        if options.actual:
+            # Parse the input file
+            parse_domains_file(options.filename,options.filename_registrars,batch,options.compact)
+        if options.update:
+            update_trends_from_actual(batch)
+        batch.commit()
+    finally:
+        # drop the staged files of a failed run
+        batch.abort()
 
 
 
     logging.info('Update END.')
 
 if __name__ == '__main__':
-    main()
+    metrics.run(main,path_metrics,run_name)
 
 
@@ -0,0 +1,118 @@
+# Shared setup of the tests
+#
+# The generator scripts are loaded with a config pointing to a temporary data
+# directory ($OSINT_CONFIG), the real data are never touched. The DNS tests use
+# a stub server on the loopback instead of the real resolvers.
+import os
+import sys
+import json
+import atexit
+import shutil
+import socket
+import tempfile
+import threading
+import collections
+
+path_generator = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),"generator")
+sys.path.insert(0, path_generator)
+
+import dns.rcode
+import dns.rrset
+import dns.message
+import osint
+
+# temporary data directory of the tests (one per run)
+path_workdir = tempfile.mkdtemp(prefix="osint-tests-")
+atexit.register(shutil.rmtree, path_workdir, True)
+
+
+# Write the config of the tests, the scripts are loaded after it
+def setup_config():
+    config = {
+        "keys":{"shodan":"tests"},
+        "path":{
+            "basedir":os.path.join(path_workdir,"data"),
+            "logdir":os.path.join(path_workdir,"log"),
+            "geoip":os.path.join(path_workdir,"GeoLite2-Country.mmdb"),
+            "bindir":path_generator,
+        },
+    }
+    for name in ("basedir","logdir"):
+        if not os.path.isdir(config["path"][name]):
+            os.makedirs(config["path"][name])
+    config_file = os.path.join(path_workdir,"config.json")
+    with open(config_file,'w') as fp:
+        json.dump(config, fp)
+    os.environ["OSINT_CONFIG"] = config_file
+
+# The generator script of the command as a module
+def load_script(command):
+    setup_config()
+    return osint.load_command(command)
+
+
+# Stub DNS server answering from its records, on a free port of the loopback
+#  drop: number of the queries for the name which are not answered (lost)
+#  silent: no query is answered
+#  rcode: the rcode of all the answers (e.g. SERVFAIL)
+class StubServer(object):
+
+    def __init__(self,address='127.0.0.1',port=0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((address,port))
+        self.sock.settimeout(0.05)
+        self.address = self.sock.getsockname()
+        self.records = collections.defaultdict(list)
+        self.drop = collections.Counter()
+        self.silent = False
+        self.rcode = dns.rcode.NOERROR
+        # names of the received queries, in the order of arrival
+        self.queries = []
+        self.running = True
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self,name,rdtype,value,ttl=300):
+        self.records[name].append((rdtype,value,ttl))
+
+    def answer(self,query,name):
+        response = dns.message.make_response(query)
+        if self.rcode != dns.rcode.NOERROR:
+            response.set_rcode(self.rcode)
+            return response
+        if name not in self.records:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+            return response
+        # the answer follows the CNAMEs known to the server, like a recursive resolver
+        while name in self.records:
+            for rdtype, value, ttl in self.records[name]:
+                response.answer.append(dns.rrset.from_text(name+'.',ttl,'IN',rdtype,value))
+            targets = [value for rdtype, value, _ in self.records[name] if rdtype == 'CNAME']
+            if not targets:
+                break
+            name = targets[0].rstrip('.')
+        return response
+
+    def serve(self):
+        while self.running:
+            try:
+                wire, client = self.sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except socket.error:
+                return
+            query = dns.message.from_wire(wire)
+            name = query.question[0].name.to_text().lower().rstrip('.')
+            self.queries.append(name)
+            if self.silent:
+                continue
+            if self.drop[name] > 0:
+                self.drop[name] -= 1
+                continue
+            self.sock.sendto(self.answer(query,name).to_wire(),client)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
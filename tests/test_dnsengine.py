@@ -0,0 +1,100 @@
+# Native DNS engine against stub servers on the loopback
+import os
+import unittest
+import support
+from osintlib import dnschain
+from osintlib import dnsengine
+
+
+class EngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = support.StubServer()
+        self.server.add('www.a.sk','A','192.0.2.1',600)
+        self.server.add('www.b.sk','CNAME','cdn.example.net.',120)
+        self.server.add('cdn.example.net','A','192.0.2.2',3600)
+        self.servers = [self.server]
+
+    def tearDown(self):
+        for server in self.servers:
+            server.close()
+
+    def run_engine(self,hostnames,resolvers=None,timeout=0.2,attempts=3):
+        engine = dnsengine.Engine(resolvers or [self.server.address],10,timeout,attempts)
+        records = dnschain.Records()
+        stats = engine.run(hostnames,records)
+        return stats, records
+
+    def test_answers(self):
+        stats, records = self.run_engine(['www.a.sk','www.b.sk'])
+        self.assertEqual(stats['resolved'],2)
+        self.assertEqual(records.a['www.a.sk'],['192.0.2.1'])
+        self.assertEqual(records.follow('www.b.sk'),(['cdn.example.net'],['192.0.2.2'],'cdn.example.net'))
+        self.assertEqual(records.ttls,{'www.a.sk':600,'www.b.sk':120,'cdn.example.net':3600})
+        self.assertEqual(records.min_ttl(['www.b.sk','cdn.example.net']),120)
+
+    def test_nxdomain_not_retried(self):
+        stats, records = self.run_engine(['www.missing.sk'])
+        self.assertEqual(stats['nxdomain'],1)
+        self.assertEqual(stats['sent'],1)
+        self.assertFalse(records.known('www.missing.sk'))
+
+    def test_retry_after_timeout(self):
+        self.server.drop['www.a.sk'] = 1
+        stats, records = self.run_engine(['www.a.sk'])
+        self.assertEqual(stats['timeouts'],1)
+        self.assertEqual(stats['retried'],1)
+        self.assertEqual(stats['resolved'],1)
+        self.assertEqual(records.a['www.a.sk'],['192.0.2.1'])
+
+    def test_servfail_retried_on_other_resolver(self):
+        broken = support.StubServer()
+        self.servers.append(broken)
+        broken.rcode = dnsengine.rcodes_retry[0]
+        stats, records = self.run_engine(['www.a.sk'],[broken.address,self.server.address])
+        self.assertEqual(broken.queries,['www.a.sk'])
+        self.assertEqual(self.server.queries,['www.a.sk'])
+        self.assertEqual(stats['retried'],1)
+        self.assertEqual(records.a['www.a.sk'],['192.0.2.1'])
+
+    def test_give_up_after_attempts(self):
+        self.server.silent = True
+        stats, records = self.run_engine(['www.a.sk'],timeout=0.1,attempts=2)
+        self.assertEqual(stats['timeouts'],2)
+        self.assertEqual(stats['failed'],1)
+        self.assertEqual(len(self.server.queries),2)
+        self.assertFalse(records.known('www.a.sk'))
+
+    def test_parse_resolver(self):
+        self.assertEqual(dnsengine.parse_resolver('192.0.2.53'),('192.0.2.53',53))
+        self.assertEqual(dnsengine.parse_resolver('127.0.0.1:5353'),('127.0.0.1',5353))
+
+
+class ResolveRoundTest(unittest.TestCase):
+
+    def setUp(self):
+        self.resolved = support.load_script('resolved')
+        if not os.path.isdir(self.resolved.path_raw):
+            os.makedirs(self.resolved.path_raw)
+        self.server = support.StubServer()
+        self.server.add('www.a.sk','A','192.0.2.1')
+        self.server.add('www.b.sk','CNAME','cdn.example.net.')
+        self.server.add('cdn.example.net','A','192.0.2.2')
+
+    def tearDown(self):
+        self.server.close()
+
+    # the answers are parsed in memory and the raw copy gives the same records
+    def test_resolve_round_native(self):
+        engine = dnsengine.Engine([self.server.address],10,0.2,3)
+        records = dnschain.Records()
+        self.resolved.resolve_round_native(engine,1,['www.a.sk','www.b.sk'],records,keep_raw=True)
+        hosts = sorted(dnschain.resolved_hosts(records,['www.a.sk','www.b.sk']))
+        self.assertEqual(hosts,[('192.0.2.1','www.a.sk',[]),('192.0.2.2','www.b.sk',['cdn.example.net'])])
+        raw = dnschain.read_records(os.path.join(self.resolved.path_raw,self.resolved.filename_raw_massdns_round % 1))
+        self.assertEqual(sorted(dnschain.resolved_hosts(raw,['www.a.sk','www.b.sk'])),hosts)
+        self.assertEqual(raw.ttls,records.ttls)
+
+
+if __name__ == '__main__':
+    unittest.main()
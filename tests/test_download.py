@@ -0,0 +1,159 @@
+# Download of the exports from a local HTTP server: conditional requests, gzip, resume of the partial file
+import os
+import gzip
+import shutil
+import StringIO
+import tempfile
+import threading
+import unittest
+import BaseHTTPServer
+import support
+from osintlib import download
+
+
+class ExportHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        site = self.server.site
+        site.requests.append(dict(self.headers.items()))
+        headers = {'ETag':site.etag,'Last-Modified':site.last_modified}
+        if self.headers.get('If-None-Match') == site.etag or self.headers.get('If-Modified-Since') == site.last_modified:
+            self.send_response(304)
+            self.send_headers(headers,0)
+            return
+        body = site.content
+        status = 200
+        offset = 0
+        if self.headers.get('Range') and self.headers.get('If-Range') in (site.etag,site.last_modified):
+            offset = int(self.headers['Range'][len('bytes='):].rstrip('-'))
+            body = body[offset:]
+            status = 206
+            headers['Content-Range'] = 'bytes %d-%d/%d' % (offset,len(site.content)-1,len(site.content))
+        elif site.gzip and 'gzip' in self.headers.get('Accept-Encoding',''):
+            data = StringIO.StringIO()
+            with gzip.GzipFile(fileobj=data, mode='wb') as fp:
+                fp.write(body)
+            body = data.getvalue()
+            headers['Content-Encoding'] = 'gzip'
+        self.send_response(status)
+        self.send_headers(headers,len(body))
+        if site.cut is not None:
+            # the connection breaks in the middle of the body
+            self.wfile.write(body[:site.cut])
+            self.close_connection = 1
+            return
+        self.wfile.write(body)
+
+    def send_headers(self,headers,length):
+        for name, value in headers.items():
+            self.send_header(name,value)
+        self.send_header('Content-Length',str(length))
+        self.end_headers()
+
+    def log_message(self,format,*args):
+        pass
+
+
+# The served export and the requests received
+class Site(object):
+
+    def __init__(self):
+        self.content = ''.join("domain-%d.sk;REG-%d;HOLDER-%d;DOM_OK\n" % (i,i % 7,i % 13) for i in range(5000))
+        self.etag = '"v1"'
+        self.last_modified = 'Mon, 01 Jun 2020 00:00:00 GMT'
+        self.gzip = True
+        self.cut = None
+        self.requests = []
+
+
+class FetchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.site = Site()
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1',0),ExportHandler)
+        self.server.site = self.site
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/domains.txt' % self.server.server_address[1]
+        self.path = tempfile.mkdtemp(dir=support.path_workdir)
+        self.state_file = os.path.join(self.path,'download-state.json')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.path)
+
+    def fetch(self,name):
+        localname = os.path.join(self.path,name)
+        return localname, download.fetch(self.url,localname,self.state_file,5)
+
+    def read(self,filename):
+        with open(filename) as fp:
+            return fp.read()
+
+    def test_gzip(self):
+        localname, result = self.fetch('domains_2020-01-01.txt')
+        self.assertEqual(result['status'],download.status_downloaded)
+        self.assertEqual(self.site.requests[0]['accept-encoding'],'gzip')
+        self.assertEqual(self.read(localname),self.site.content)
+        self.assertEqual(result['size'],len(self.site.content))
+        self.assertTrue(result['received'] < len(self.site.content) / 4)
+        self.assertFalse(os.path.exists(download.partial_filename(localname)))
+
+    def test_not_modified(self):
+        previous, _ = self.fetch('domains_2020-01-01.txt')
+        localname, result = self.fetch('domains_2020-01-02.txt')
+        self.assertEqual(result['status'],download.status_not_modified)
+        self.assertEqual(result['received'],0)
+        self.assertEqual(self.site.requests[1]['if-none-match'],self.site.etag)
+        self.assertEqual(self.site.requests[1]['if-modified-since'],self.site.last_modified)
+        # the previous download is reused
+        self.assertEqual(self.read(localname),self.site.content)
+        self.assertEqual(os.stat(localname).st_ino,os.stat(previous).st_ino)
+        self.assertEqual(download.read_state(self.state_file)[self.url]['file'],localname)
+
+    def test_modified(self):
+        self.fetch('domains_2020-01-01.txt')
+        self.site.etag = '"v2"'
+        self.site.last_modified = 'Tue, 02 Jun 2020 00:00:00 GMT'
+        self.site.content += "new.sk;REG-1;HOLDER-1;DOM_OK\n"
+        localname, result = self.fetch('domains_2020-01-02.txt')
+        self.assertEqual(result['status'],download.status_downloaded)
+        self.assertEqual(self.read(localname),self.site.content)
+
+    def test_resume(self):
+        self.site.gzip = False
+        self.site.cut = 10000
+        with self.assertRaises(download.DownloadError):
+            self.fetch('domains_2020-01-01.txt')
+        localname = os.path.join(self.path,'domains_2020-01-01.txt')
+        self.assertFalse(os.path.exists(localname))
+        self.assertEqual(os.path.getsize(download.partial_filename(localname)),10000)
+        self.site.cut = None
+        localname, result = self.fetch('domains_2020-01-01.txt')
+        self.assertEqual(result['status'],download.status_resumed)
+        self.assertEqual(self.site.requests[1]['range'],'bytes=10000-')
+        self.assertEqual(self.site.requests[1]['if-range'],self.site.etag)
+        self.assertEqual(self.site.requests[1]['accept-encoding'],'identity')
+        self.assertEqual(result['received'],len(self.site.content) - 10000)
+        self.assertEqual(self.read(localname),self.site.content)
+
+    def test_resume_changed(self):
+        self.site.gzip = False
+        self.site.cut = 10000
+        with self.assertRaises(download.DownloadError):
+            self.fetch('domains_2020-01-01.txt')
+        # If-Range does not match, the whole new export is sent
+        self.site.cut = None
+        self.site.etag = '"v2"'
+        self.site.content = self.site.content.replace('DOM_OK','DOM_WARN')
+        localname, result = self.fetch('domains_2020-01-01.txt')
+        self.assertEqual(result['status'],download.status_downloaded)
+        self.assertEqual(self.read(localname),self.site.content)
+
+
+if __name__ == '__main__':
+    unittest.main()
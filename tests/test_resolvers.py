@@ -0,0 +1,45 @@
+# Checks of the open resolvers against stub servers on the loopback (one address per resolver, same port)
+import unittest
+import support
+import dns.rcode
+from osintlib import reputation
+
+
+class TestResolversTest(unittest.TestCase):
+
+    def setUp(self):
+        self.resolved = support.load_script('resolved')
+        ok = support.StubServer('127.0.0.1')
+        port = ok.address[1]
+        ok.add('osint.sk','A','91.210.182.151')
+        wrong = support.StubServer('127.0.0.2',port)
+        wrong.add('osint.sk','A','192.0.2.1')
+        silent = support.StubServer('127.0.0.3',port)
+        silent.silent = True
+        failing = support.StubServer('127.0.0.4',port)
+        failing.rcode = dns.rcode.SERVFAIL
+        self.servers = [ok,wrong,silent,failing]
+        self.port = port
+
+    def tearDown(self):
+        for server in self.servers:
+            server.close()
+
+    def test_results(self):
+        resolvers = ['127.0.0.3','127.0.0.1','127.0.0.4','127.0.0.2','127.0.0.1']
+        results = self.resolved.test_resolvers(resolvers,2,self.port)
+        # in the order of the input
+        self.assertEqual([result for result, _ in results],
+                         [reputation.result_timeout,reputation.result_ok,reputation.result_error,reputation.result_wrong,reputation.result_ok])
+        for _, latency in results:
+            self.assertTrue(latency >= 0)
+        # the timeout is the lifetime of the check (1 s)
+        self.assertTrue(results[0][1] >= 900)
+        self.assertEqual(self.servers[0].queries,['osint.sk','osint.sk'])
+
+    def test_no_resolvers(self):
+        self.assertEqual(self.resolved.test_resolvers([],4,self.port),[])
+
+
+if __name__ == '__main__':
+    unittest.main()
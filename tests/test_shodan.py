@@ -0,0 +1,107 @@
+# Shodan queries with a fake API client (no network): rate limit, merged country facets, fallback of the truncated facet
+import time
+import threading
+import unittest
+import support
+from osintlib import scheduler
+
+
+# Fake shodan client, records the calls (time, query, facets)
+class FakeApi(object):
+
+    def __init__(self,ports,total):
+        self.ports = ports
+        self.total = total
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def count(self,query,facets=None):
+        with self.lock:
+            self.calls.append((time.time(),query,facets))
+        if facets is None:
+            return {'total':len(query),'facets':{}}
+        response = {'total':self.total,'facets':{}}
+        for facet, size in facets:
+            if facet == 'port':
+                values = [{'value':port,'count':count} for port, count in sorted(self.ports.items(), key=lambda item: -item[1])]
+            else:
+                values = [{'value':'%s-%d' % (facet,i),'count':100-i} for i in range(size)]
+            response['facets'][facet] = values[:size]
+        return response
+
+    def queries(self):
+        return [query for _, query, _ in self.calls]
+
+
+class GetStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shodan = support.load_script('shodan')
+        # 47808 (BACnet) is not in the facet
+        self.ports = {80:5000,443:3000,502:7,102:3,44818:1}
+
+    def test_merged_country_query(self):
+        api = FakeApi(self.ports,sum(self.ports.values()))
+        stats = self.shodan.get_stats(api,rate=1000,workers=4)
+        country = [(query,facets) for _, query, facets in api.calls if query == self.shodan.country_query]
+        self.assertEqual(len(country),1)
+        self.assertEqual(sorted(country[0][1]),[['port',self.shodan.merged_facet_size],['vuln',20]])
+        # the single port counts are not queried
+        for query in ('port:502 country:"SK"','port:102 country:"SK"','port:44818 country:"SK"','port:47808 country:"SK"'):
+            self.assertNotIn(query,api.queries())
+        self.assertEqual(stats['ics']['Modbus'],7)
+        self.assertEqual(stats['ics']['Siemens-S7'],3)
+        self.assertEqual(stats['ics']['EtherNet-IP'],1)
+        # the facet is complete, the missing port has no hosts
+        self.assertEqual(stats['ics']['BACnet'],0)
+        self.assertEqual(stats['ports'][80],5000)
+        self.assertEqual(len(stats['cve']),20)
+        self.assertEqual(stats['db']['MySQL'],len('product:MySQL country:"SK"'))
+        self.assertEqual(len(api.calls),self.shodan.count_queries() - 5)
+
+    def test_truncated_facet_fallback(self):
+        # more hosts than the facet lists, the missing port may have some
+        api = FakeApi(self.ports,sum(self.ports.values()) + 100)
+        stats = self.shodan.get_stats(api,rate=1000,workers=4)
+        self.assertEqual(api.queries().count('port:47808 country:"SK"'),1)
+        self.assertEqual(stats['ics']['BACnet'],len('port:47808 country:"SK"'))
+        self.assertEqual(stats['ics']['Modbus'],7)
+        self.assertNotIn('port:502 country:"SK"',api.queries())
+
+    def test_facet_complete(self):
+        response = {'total':10,'facets':{'port':[{'value':80,'count':6},{'value':443,'count':4}]}}
+        self.assertTrue(self.shodan.facet_complete(response,'port'))
+        response['total'] = 11
+        self.assertFalse(self.shodan.facet_complete(response,'port'))
+
+    def test_rate_limit(self):
+        rate = 20.0
+        api = FakeApi(self.ports,sum(self.ports.values()))
+        self.shodan.get_stats(api,rate=rate,workers=4)
+        started = sorted(call[0] for call in api.calls)
+        gaps = [b - a for a, b in zip(started,started[1:])]
+        # the parallel calls still start one by one at the rate (small tolerance for the timer)
+        self.assertTrue(min(gaps) >= 1 / rate * 0.9, gaps)
+        self.assertTrue(started[-1] - started[0] >= (len(started) - 1) / rate * 0.9)
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_waits(self):
+        now = [0.0]
+        waits = []
+        def sleep(seconds):
+            waits.append(seconds)
+            now[0] += seconds
+        bucket = scheduler.TokenBucket(2,clock=lambda: now[0],sleep=sleep)
+        for _ in range(3):
+            bucket.acquire()
+        self.assertEqual(waits,[0.5,0.5])
+        # the tokens are refilled while idle, up to the burst
+        now[0] += 10
+        bucket.acquire()
+        self.assertEqual(waits,[0.5,0.5])
+
+
+if __name__ == '__main__':
+    unittest.main()